@@ -0,0 +1,683 @@
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+import database_setup
+import db_pool
+import db_utils
+
+# Archivo de backups comprimidos con rotación.
+# Los volcados .sql y las copias .db se comprimen mientras se escriben (gzip o lzma de la biblioteca
+# estándar): nunca se escribe en disco la versión sin comprimir, salvo las copias .db mayores que
+# BACKUP_MAXIMO_EN_MEMORIA_MB, que pasan por un archivo temporal. Cada backup queda registrado en
+# backup/indice_backups.json (tamaños, sha256 del archivo, duración) y tras cada backup se aplica
+# una retención abuelo-padre-hijo: se conservan los últimos backups y el último de cada una de las
+# últimas N horas, N días y N meses, y el resto se borra.
+#
+# Backups incrementales: los triggers de RegistroCambios (migración 7) anotan cada fila insertada,
+# modificada o borrada. Una base 'db' guarda en el índice su marca (la secuencia del registro en la
+# foto); cada incremental ('.inc', JSON por líneas) guarda el estado actual de las filas anotadas
+# después de la marca anterior y las que ya no existen. restaurar_backup aplica base + cadena.
+#
+# Cada entrada guarda además un manifiesto de la foto respaldada (calcular_manifiesto: filas y sumas
+# de control por tabla) con el que verificador_backups comprueba, en otro proceso, que el backup se
+# puede restaurar y contiene lo mismo que la base en el momento del backup.
+
+COMPRESION_POR_DEFECTO = 'gzip'
+EXTENSIONES_COMPRESION = {'gzip': '.gz', 'lzma': '.xz'}
+NIVEL_GZIP = 6
+PRESET_LZMA = 6
+RETENCION_POR_DEFECTO = {'ultimos': 5, 'horarios': 24, 'diarios': 14, 'mensuales': 12}
+BACKUP_MAXIMO_EN_MEMORIA_MB = 256 # Copias .db de hasta este tamaño se comprimen desde memoria
+TAMANO_BLOQUE = 1024 * 1024
+TAMANO_LOTE_INCREMENTAL = 500 # Filas por línea del archivo incremental
+TAMANO_LOTE_PODA = 2000 # Filas del registro de cambios borradas por transacción
+FORMATO_INCREMENTAL = 1
+NOMBRE_INDICE = 'indice_backups.json'
+
+_indice_lock = threading.RLock()
+_backup_lock = threading.Lock() # Un backup a la vez: las marcas de la cadena deben ser consecutivas
+
+
+class _ArchivoConSuma:
+    """Envuelve el archivo comprimido en disco: calcula su sha256 y su tamaño mientras se escribe."""
+    def __init__(self, archivo):
+        self._archivo = archivo
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, datos):
+        self.sha256.update(datos)
+        self.bytes += len(datos)
+        return self._archivo.write(datos)
+
+    def flush(self):
+        self._archivo.flush()
+
+
+def _abrir_compresor(destino_crudo, compresion):
+    if compresion == 'gzip':
+        return gzip.GzipFile(fileobj=destino_crudo, mode='wb', compresslevel=NIVEL_GZIP)
+    if compresion == 'lzma':
+        return lzma.LZMAFile(destino_crudo, mode='wb', preset=PRESET_LZMA)
+    raise ValueError(f"Compresión '{compresion}' no soportada. Opciones: {', '.join(EXTENSIONES_COMPRESION)}")
+
+def abrir_backup(ruta):
+    """Abre un archivo de backup para lectura binaria, descomprimiendo según su extensión."""
+    return db_utils.abrir_archivo_backup(ruta)
+
+def ruta_indice():
+    return os.path.join(db_utils.BACKUP_DIR, NOMBRE_INDICE)
+
+def _leer_indice():
+    try:
+        with open(ruta_indice(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 1, 'backups': []}
+
+def _guardar_indice(indice):
+    temporal = ruta_indice() + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta_indice()) # Un corte de luz nunca deja el índice a medias
+
+def _orden_backup(entrada):
+    # Dentro del mismo segundo, la marca del registro ordena los backups de una cadena
+    return entrada['fecha'], entrada.get('marca', -1)
+
+def listar_backups():
+    """Entradas del índice, de la más reciente a la más antigua."""
+    with _indice_lock:
+        return sorted(_leer_indice()['backups'], key=_orden_backup, reverse=True)
+
+def actualizar_entrada_backup(archivo, **campos):
+    """Añade o modifica campos de la entrada de un backup en el índice (p. ej. resultados de verificación)."""
+    with _indice_lock:
+        indice = _leer_indice()
+        for entrada in indice['backups']:
+            if entrada['archivo'] == archivo:
+                entrada.update(campos)
+                _guardar_indice(indice)
+                return entrada
+    return None
+
+def _registrar_en_indice(entrada):
+    with _indice_lock:
+        indice = _leer_indice()
+        indice['backups'].append(entrada)
+        _guardar_indice(indice)
+
+def _nombre_archivo(tipo, compresion, fecha):
+    base = f"pos_backup_{fecha.strftime('%Y%m%d_%H%M%S')}"
+    nombre = f"{base}.{tipo}{EXTENSIONES_COMPRESION[compresion]}"
+    sufijo = 1
+    while os.path.exists(os.path.join(db_utils.BACKUP_DIR, nombre)):
+        sufijo += 1
+        nombre = f"{base}_{sufijo}.{tipo}{EXTENSIONES_COMPRESION[compresion]}"
+    return nombre
+
+def _escribir_volcado_sql(compresor):
+    """Volcado SQL (iterdump) de una foto consistente de la base. Retorna (bytes sin comprimir, manifiesto)."""
+    conn = sqlite3.connect(db_utils.DATABASE_NAME)
+    try:
+        db_pool.aplicar_perfil(conn)
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        total = 0
+        for linea in conn.iterdump():
+            datos = (linea + '\n').encode('utf-8')
+            compresor.write(datos)
+            total += len(datos)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        datos = f"PRAGMA user_version = {version};\n".encode('utf-8') # Ver db_utils.export_database_to_sql
+        compresor.write(datos)
+        total += len(datos)
+        manifiesto = calcular_manifiesto(conn) # Misma transacción de lectura que el volcado
+        conn.rollback()
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)") # Ver db_utils.copiar_base_online
+        return total, manifiesto
+    finally:
+        conn.close()
+
+def calcular_manifiesto(conn, tablas=None):
+    """
+    Huella por tabla de la foto que ve conn: [filas, suma de ids, suma de ids ponderada por el largo
+    de cada fila, suma de las columnas numéricas]. Detecta filas perdidas, cambiadas o movidas sin ser
+    un hash criptográfico (la integridad del archivo la da su sha256). Se calcula con agregados de
+    SQLite, sin recorrer filas en Python, así no compite por el GIL con la interfaz.
+    tablas: por defecto las de database_setup.TABLAS_REGISTRO_CAMBIOS que existan en la base.
+    """
+    existentes = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    manifiesto = {}
+    for tabla in (tablas if tablas is not None else database_setup.TABLAS_REGISTRO_CAMBIOS):
+        if tabla not in existentes:
+            continue
+        columnas = conn.execute(f"PRAGMA table_info({tabla})").fetchall()
+        texto_fila = " || ',' || ".join(f"quote({c[1]})" for c in columnas)
+        numericas = [c[1] for c in columnas if any(t in (c[2] or '').upper() for t in ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC'))]
+        suma_numericas = " + ".join(f"COALESCE({c}, 0)" for c in numericas) or "0"
+        filas, ids, ponderada, valores = conn.execute(f'''
+            SELECT COUNT(*), TOTAL(id), TOTAL(id * length({texto_fila})), TOTAL({suma_numericas}) FROM {tabla}
+        ''').fetchone()
+        manifiesto[tabla] = [filas, ids, ponderada, round(valores, 4)]
+    return manifiesto
+
+def _marca_registro(conn):
+    """Secuencia actual de RegistroCambios en conn, o None si la base no tiene registro de cambios."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'RegistroCambios'").fetchone():
+        return None
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'RegistroCambios'").fetchone()
+    return fila[0] if fila else 0
+
+def _podar_registro(marca):
+    """
+    Borra del registro de cambios lo que ya quedó respaldado (id <= marca), en transacciones de
+    TAMANO_LOTE_PODA filas para no retener el bloqueo de escritura que necesitan las ventas.
+    """
+    conn = sqlite3.connect(db_utils.DATABASE_NAME)
+    try:
+        db_pool.aplicar_perfil(conn)
+        desde = conn.execute("SELECT MIN(id) FROM RegistroCambios").fetchone()[0]
+        while desde is not None and desde <= marca:
+            hasta = min(desde + TAMANO_LOTE_PODA - 1, marca)
+            with conn:
+                conn.execute("DELETE FROM RegistroCambios WHERE id BETWEEN ? AND ?", (desde, hasta))
+            desde = hasta + 1
+    except sqlite3.Error as e:
+        print(f"Advertencia: No se pudo podar el registro de cambios ({e}). Se reintentará en el próximo backup.")
+    finally:
+        conn.close()
+
+def _escribir_copia_db(compresor, progreso=None, paginas_por_paso=db_utils.BACKUP_PAGINAS_POR_PASO,
+                       pausa_s=db_utils.BACKUP_PAUSA_ENTRE_PASOS_S):
+    """
+    Copia en línea (db_utils.copiar_base_online) comprimida al vuelo, al ritmo de paginas_por_paso / pausa_s.
+    Retorna (bytes sin comprimir, marca del registro de cambios en la copia o None, manifiesto de la copia).
+    """
+    if not os.path.exists(db_utils.DATABASE_NAME):
+        raise FileNotFoundError(f"La base de datos '{db_utils.DATABASE_NAME}' no existe.")
+    en_memoria = (os.path.getsize(db_utils.DATABASE_NAME) <= BACKUP_MAXIMO_EN_MEMORIA_MB * 1024 * 1024
+                  and hasattr(sqlite3.Connection, 'serialize'))
+    if en_memoria:
+        memoria = sqlite3.connect(':memory:')
+        try:
+            db_utils.copiar_base_online(memoria, paginas_por_paso, pausa_s, progreso)
+            marca = _marca_registro(memoria)
+            manifiesto = calcular_manifiesto(memoria)
+            datos = bytearray(memoria.serialize())
+        finally:
+            memoria.close()
+        # Bytes 18-19 de la cabecera: 2 = WAL heredado del original, 1 = diario clásico (archivo autosuficiente)
+        datos[18] = datos[19] = 1
+        vista = memoryview(datos)
+        for inicio in range(0, len(datos), TAMANO_BLOQUE):
+            compresor.write(vista[inicio:inicio + TAMANO_BLOQUE])
+        return len(datos), marca, manifiesto
+
+    temporal = os.path.join(db_utils.BACKUP_DIR, f"copia_{os.getpid()}.db.parcial")
+    try:
+        conn = sqlite3.connect(temporal)
+        try:
+            db_utils.copiar_base_online(conn, paginas_por_paso, pausa_s, progreso)
+            marca = _marca_registro(conn)
+            manifiesto = calcular_manifiesto(conn)
+            conn.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            conn.close()
+        total = 0
+        with open(temporal, 'rb') as f:
+            while True:
+                bloque = f.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                compresor.write(bloque)
+                total += len(bloque)
+        return total, marca, manifiesto
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+def _escribir_incremental(conn, compresor, desde, hasta):
+    """
+    Escribe en JSON por líneas el estado actual (en la transacción de lectura de conn) de las filas
+    anotadas en RegistroCambios con id en (desde, hasta], ordenadas por su último cambio.
+    Retorna (bytes sin comprimir, filas escritas, filas borradas).
+    """
+    def _escribir(objeto):
+        datos = (json.dumps(objeto, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        compresor.write(datos)
+        return len(datos)
+
+    total = _escribir({'formato': FORMATO_INCREMENTAL, 'desde': desde, 'hasta': hasta})
+    por_tabla = {}
+    for tabla, fila_id in conn.execute('''
+        SELECT tabla, fila_id FROM RegistroCambios WHERE id > ? AND id <= ?
+        GROUP BY tabla, fila_id ORDER BY MAX(id)
+    ''', (desde, hasta)):
+        por_tabla.setdefault(tabla, []).append(fila_id)
+
+    filas = borradas = 0
+    for tabla, ids in por_tabla.items():
+        if tabla not in database_setup.TABLAS_REGISTRO_CAMBIOS:
+            raise ValueError(f"Tabla desconocida en el registro de cambios: {tabla}")
+        for inicio in range(0, len(ids), TAMANO_LOTE_INCREMENTAL):
+            lote = ids[inicio:inicio + TAMANO_LOTE_INCREMENTAL]
+            cursor = conn.execute(f"SELECT * FROM {tabla} WHERE id IN ({','.join('?' * len(lote))})", lote)
+            columnas = [d[0] for d in cursor.description]
+            pos_id = columnas.index('id')
+            actuales = {fila[pos_id]: list(fila) for fila in cursor}
+            bloque = {
+                'tabla': tabla, 'columnas': columnas,
+                'filas': [actuales[i] for i in lote if i in actuales],
+                'borrados': [i for i in lote if i not in actuales],
+            }
+            filas += len(bloque['filas'])
+            borradas += len(bloque['borrados'])
+            total += _escribir(bloque)
+    return total, filas, borradas
+
+def crear_backup(tipo='db', compresion=COMPRESION_POR_DEFECTO, progreso=None, retencion=RETENCION_POR_DEFECTO, origen='manual',
+                 paginas_por_paso=db_utils.BACKUP_PAGINAS_POR_PASO, pausa_s=db_utils.BACKUP_PAUSA_ENTRE_PASOS_S):
+    """
+    Crea un backup comprimido en BACKUP_DIR y lo registra en el índice.
+    tipo: 'db' (copia en línea de la base, se abre tras descomprimir) o 'sql' (volcado de texto portable).
+    progreso: progreso(paginas_copiadas, paginas_totales), solo para tipo 'db'.
+    paginas_por_paso / pausa_s: ritmo de la copia 'db' (ver db_utils.copiar_base_online).
+    retencion: dict para aplicar_retencion tras el backup, o None para no borrar nada.
+    Retorna la entrada del índice o None en caso de error.
+    """
+    if tipo not in ('db', 'sql'):
+        raise ValueError(f"Tipo de backup '{tipo}' no soportado. Opciones: db, sql")
+    if compresion not in EXTENSIONES_COMPRESION:
+        raise ValueError(f"Compresión '{compresion}' no soportada. Opciones: {', '.join(EXTENSIONES_COMPRESION)}")
+    with _backup_lock:
+        entrada = _crear_backup_completo(tipo, compresion, progreso, origen, paginas_por_paso, pausa_s)
+    if entrada and retencion:
+        aplicar_retencion(retencion)
+    return entrada
+
+def _crear_backup_completo(tipo, compresion, progreso, origen, paginas_por_paso=db_utils.BACKUP_PAGINAS_POR_PASO,
+                           pausa_s=db_utils.BACKUP_PAUSA_ENTRE_PASOS_S):
+    db_utils._ensure_backup_dir()
+    fecha = datetime.now()
+    nombre = _nombre_archivo(tipo, compresion, fecha)
+    destino = os.path.join(db_utils.BACKUP_DIR, nombre)
+    temporal = destino + '.parcial'
+
+    inicio = time.perf_counter()
+    try:
+        with open(temporal, 'wb') as crudo:
+            con_suma = _ArchivoConSuma(crudo)
+            with _abrir_compresor(con_suma, compresion) as compresor:
+                if tipo == 'db':
+                    bytes_origen, marca, manifiesto = _escribir_copia_db(compresor, progreso, paginas_por_paso, pausa_s)
+                else:
+                    (bytes_origen, manifiesto), marca = _escribir_volcado_sql(compresor), None
+        os.replace(temporal, destino)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error al crear el backup comprimido: {e}")
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+
+    duracion = time.perf_counter() - inicio
+    entrada = {
+        'archivo': nombre, 'tipo': tipo, 'compresion': compresion, 'origen': origen,
+        'fecha': fecha.isoformat(timespec='seconds'),
+        'bytes_origen': bytes_origen, 'bytes_archivo': con_suma.bytes,
+        'sha256': con_suma.sha256.hexdigest(), 'duracion_s': round(duracion, 3),
+        'manifiesto': manifiesto,
+    }
+    if marca is not None:
+        entrada['marca'] = marca # Esta copia puede ser la base de una cadena de incrementales
+    _registrar_en_indice(entrada)
+    print(f"Backup comprimido: {destino} ({bytes_origen / 1e6:.1f} MB -> {con_suma.bytes / 1e6:.1f} MB, "
+          f"{bytes_origen / con_suma.bytes if con_suma.bytes else 0:.1f}x, {duracion:.2f} s)")
+    if marca:
+        _podar_registro(marca)
+    return entrada
+
+def _cabeza_cadena(entradas, incluir_cerradas=False):
+    """Backup más reciente con marca (base 'db' o incremental): de él parte el próximo incremental."""
+    con_marca = [e for e in entradas if e.get('marca') is not None and (incluir_cerradas or not e.get('cerrada'))]
+    return max(con_marca, key=_orden_backup) if con_marca else None
+
+def cerrar_cadena_backups():
+    """
+    Marca las cadenas existentes como cerradas: el próximo incremental empezará con una base nueva.
+    Se llama tras reemplazar la base en uso (importación), cuyo registro de cambios ya no sigue la cadena.
+    """
+    with _indice_lock:
+        indice = _leer_indice()
+        for entrada in indice['backups']:
+            if entrada.get('marca') is not None:
+                entrada['cerrada'] = True
+        _guardar_indice(indice)
+
+def crear_backup_incremental(compresion=COMPRESION_POR_DEFECTO, retencion=RETENCION_POR_DEFECTO, origen='manual',
+                             progreso=None, paginas_por_paso=db_utils.BACKUP_PAGINAS_POR_PASO,
+                             pausa_s=db_utils.BACKUP_PAUSA_ENTRE_PASOS_S):
+    """
+    Backup incremental: filas insertadas, modificadas o borradas desde el último backup de la cadena.
+    Si no hay una base con marca, o el registro de cambios no continúa la cadena (la base se importó
+    o se restauró), crea una base 'db' completa en su lugar (progreso y ritmo como en crear_backup).
+    Retorna la entrada del índice, {'sin_cambios': True, 'marca', 'archivo'} si no hubo cambios,
+    o None en caso de error.
+    """
+    if compresion not in EXTENSIONES_COMPRESION:
+        raise ValueError(f"Compresión '{compresion}' no soportada. Opciones: {', '.join(EXTENSIONES_COMPRESION)}")
+    with _backup_lock:
+        entrada = _crear_incremental(compresion, origen)
+        if entrada is False:
+            entrada = _crear_backup_completo('db', compresion, progreso, origen, paginas_por_paso, pausa_s)
+    if entrada and not entrada.get('sin_cambios') and retencion:
+        aplicar_retencion(retencion)
+    return entrada
+
+def _crear_incremental(compresion, origen):
+    """Escribe el incremental; retorna False si hace falta una base completa."""
+    cabeza = _cabeza_cadena(listar_backups())
+    if cabeza is None or not os.path.exists(os.path.join(db_utils.BACKUP_DIR, cabeza['archivo'])):
+        return False
+    db_utils._ensure_backup_dir()
+    fecha = datetime.now()
+    nombre = _nombre_archivo('inc', compresion, fecha)
+    destino = os.path.join(db_utils.BACKUP_DIR, nombre)
+    temporal = destino + '.parcial'
+
+    inicio = time.perf_counter()
+    conn = sqlite3.connect(db_utils.DATABASE_NAME)
+    try:
+        db_pool.aplicar_perfil(conn)
+        conn.execute("BEGIN") # Filas y marca salen de la misma foto de lectura
+        marca = _marca_registro(conn)
+        if marca is None or marca < cabeza['marca']:
+            print("El registro de cambios no continúa la cadena de backups. Se creará una base completa.")
+            return False
+        if marca == cabeza['marca']:
+            return {'sin_cambios': True, 'marca': marca, 'archivo': cabeza['archivo']}
+        with open(temporal, 'wb') as crudo:
+            con_suma = _ArchivoConSuma(crudo)
+            with _abrir_compresor(con_suma, compresion) as compresor:
+                bytes_origen, filas, borradas = _escribir_incremental(conn, compresor, cabeza['marca'], marca)
+        # Solo las tablas que cambiaron: las demás quedan cubiertas por el manifiesto de la base
+        tocadas = [fila[0] for fila in conn.execute(
+            "SELECT DISTINCT tabla FROM RegistroCambios WHERE id > ? AND id <= ?", (cabeza['marca'], marca))]
+        manifiesto = calcular_manifiesto(conn, tocadas)
+        conn.rollback()
+        os.replace(temporal, destino)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"Error al crear el backup incremental: {e}")
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+    finally:
+        conn.close()
+
+    duracion = time.perf_counter() - inicio
+    entrada = {
+        'archivo': nombre, 'tipo': 'incremental', 'compresion': compresion, 'origen': origen,
+        'fecha': fecha.isoformat(timespec='seconds'),
+        'bytes_origen': bytes_origen, 'bytes_archivo': con_suma.bytes,
+        'sha256': con_suma.sha256.hexdigest(), 'duracion_s': round(duracion, 3),
+        'base': cabeza.get('base', cabeza['archivo']), 'anterior': cabeza['archivo'],
+        'desde': cabeza['marca'], 'marca': marca, 'filas': filas, 'borradas': borradas,
+        'manifiesto': manifiesto,
+    }
+    _registrar_en_indice(entrada)
+    print(f"Backup incremental: {destino} ({filas} filas, {borradas} borradas, "
+          f"{con_suma.bytes / 1024:.1f} KB, {duracion:.2f} s)")
+    _podar_registro(marca)
+    return entrada
+
+def seleccionar_conservados(entradas, retencion=RETENCION_POR_DEFECTO):
+    """
+    Retención abuelo-padre-hijo: nombres de archivo a conservar. Se conservan los
+    retencion['ultimos'] backups más recientes (al menos uno) y el más reciente de cada una de las
+    últimas retencion['horarios'] horas, retencion['diarios'] días y retencion['mensuales'] meses
+    (contando solo periodos con backups).
+    """
+    ordenadas = sorted(entradas, key=_orden_backup, reverse=True)
+    conservados = {e['archivo'] for e in ordenadas[:max(1, retencion.get('ultimos', 1))]}
+    # fecha ISO 'YYYY-MM-DDTHH:MM:SS': el prefijo identifica la hora, el día o el mes
+    for nivel, longitud in (('horarios', 13), ('diarios', 10), ('mensuales', 7)):
+        periodos = set()
+        for entrada in ordenadas:
+            periodo = entrada['fecha'][:longitud]
+            if periodo in periodos:
+                continue
+            if len(periodos) >= retencion.get(nivel, 0):
+                break
+            periodos.add(periodo)
+            conservados.add(entrada['archivo'])
+    # Un incremental solo sirve junto con su base y los incrementales anteriores de su cadena
+    for entrada in ordenadas:
+        if entrada['archivo'] in conservados and entrada['tipo'] == 'incremental':
+            conservados.add(entrada['base'])
+            conservados.update(e['archivo'] for e in ordenadas if e.get('base') == entrada['base']
+                               and e['tipo'] == 'incremental' and e['marca'] <= entrada['marca'])
+    return conservados
+
+def aplicar_retencion(retencion=RETENCION_POR_DEFECTO):
+    """Borra los backups del índice que la retención no conserva. Retorna los nombres borrados."""
+    with _indice_lock:
+        indice = _leer_indice()
+        conservados = seleccionar_conservados(indice['backups'], retencion)
+        borrados = []
+        for entrada in indice['backups']:
+            if entrada['archivo'] in conservados:
+                continue
+            try:
+                os.remove(os.path.join(db_utils.BACKUP_DIR, entrada['archivo']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"No se pudo borrar el backup {entrada['archivo']}: {e}")
+                conservados.add(entrada['archivo'])
+                continue
+            borrados.append(entrada['archivo'])
+        if borrados:
+            indice['backups'] = [e for e in indice['backups'] if e['archivo'] in conservados]
+            _guardar_indice(indice)
+    if borrados:
+        print(f"Retención de backups: {len(borrados)} archivos borrados.")
+    return borrados
+
+def archivar_backups_existentes(compresion=COMPRESION_POR_DEFECTO):
+    """
+    Comprime y registra en el índice los pos_backup_*.sql / *.db sin comprimir que haya en BACKUP_DIR
+    (los generados antes de este módulo), con la fecha de modificación del archivo. Retorna cuántos archivó.
+    """
+    if not os.path.isdir(db_utils.BACKUP_DIR):
+        return 0
+    archivados = 0
+    for nombre in sorted(os.listdir(db_utils.BACKUP_DIR)):
+        tipo = nombre.rsplit('.', 1)[-1]
+        if not nombre.startswith('pos_backup_') or tipo not in ('sql', 'db'):
+            continue
+        ruta = os.path.join(db_utils.BACKUP_DIR, nombre)
+        fecha = datetime.fromtimestamp(os.path.getmtime(ruta))
+        destino_nombre = f"{nombre}{EXTENSIONES_COMPRESION[compresion]}"
+        sufijo = 1
+        while os.path.exists(os.path.join(db_utils.BACKUP_DIR, destino_nombre)): # Un backup comprimido del mismo segundo
+            sufijo += 1
+            destino_nombre = f"{nombre[:-len(tipo) - 1]}_{sufijo}.{tipo}{EXTENSIONES_COMPRESION[compresion]}"
+        destino = os.path.join(db_utils.BACKUP_DIR, destino_nombre)
+        inicio = time.perf_counter()
+        with open(ruta, 'rb') as f, open(destino + '.parcial', 'wb') as crudo:
+            con_suma = _ArchivoConSuma(crudo)
+            with _abrir_compresor(con_suma, compresion) as compresor:
+                while True:
+                    bloque = f.read(TAMANO_BLOQUE)
+                    if not bloque:
+                        break
+                    compresor.write(bloque)
+        os.replace(destino + '.parcial', destino)
+        _registrar_en_indice({
+            'archivo': destino_nombre, 'tipo': tipo, 'compresion': compresion, 'origen': 'archivado',
+            'fecha': fecha.isoformat(timespec='seconds'),
+            'bytes_origen': os.path.getsize(ruta), 'bytes_archivo': con_suma.bytes,
+            'sha256': con_suma.sha256.hexdigest(), 'duracion_s': round(time.perf_counter() - inicio, 3),
+        })
+        os.remove(ruta)
+        archivados += 1
+    return archivados
+
+def obtener_uso_backups():
+    """Resumen del archivo de backups: cantidad, bytes en disco y bytes sin comprimir."""
+    entradas = listar_backups()
+    return {
+        'backups': len(entradas),
+        'bytes_archivos': sum(e['bytes_archivo'] for e in entradas),
+        'bytes_origen': sum(e['bytes_origen'] for e in entradas),
+        'ultimo': entradas[0] if entradas else None,
+    }
+
+def _verificar_suma(entrada):
+    ruta = os.path.join(db_utils.BACKUP_DIR, entrada['archivo'])
+    suma = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            suma.update(bloque)
+    if suma.hexdigest() != entrada['sha256']:
+        raise ValueError(f"El backup {entrada['archivo']} está dañado (sha256 no coincide con el índice).")
+    return ruta
+
+def _cadena_hasta(entradas, objetivo):
+    """Base y lista ordenada de incrementales necesarios para restaurar `objetivo`."""
+    if objetivo['tipo'] == 'db':
+        return objetivo, []
+    if objetivo['tipo'] != 'incremental':
+        raise ValueError(f"El backup {objetivo['archivo']} es un volcado SQL; se restaura con la importación de base de datos.")
+    base = next((e for e in entradas if e['archivo'] == objetivo['base']), None)
+    if base is None:
+        raise ValueError(f"Falta la base {objetivo['base']} del backup {objetivo['archivo']}.")
+    cadena = sorted((e for e in entradas if e['tipo'] == 'incremental' and e.get('base') == base['archivo']
+                     and e['marca'] <= objetivo['marca']), key=lambda e: e['marca'])
+    marca = base['marca']
+    for entrada in cadena:
+        if entrada['desde'] != marca:
+            raise ValueError(f"Cadena de backups incompleta: falta el incremental entre las marcas {marca} y {entrada['desde']}.")
+        marca = entrada['marca']
+    return base, cadena
+
+def _aplicar_incremental(cursor, ruta, ventas_tocadas):
+    """Aplica un archivo incremental; anota en ventas_tocadas el rango de ids de venta afectados."""
+    filas = borradas = 0
+    with abrir_backup(ruta) as f:
+        for linea in io.TextIOWrapper(f, encoding='utf-8'):
+            bloque = json.loads(linea)
+            if 'formato' in bloque:
+                if bloque['formato'] != FORMATO_INCREMENTAL:
+                    raise ValueError(f"Formato de incremental no soportado: {bloque['formato']}")
+                continue
+            tabla, columnas = bloque['tabla'], bloque['columnas']
+            if tabla not in database_setup.TABLAS_REGISTRO_CAMBIOS:
+                raise ValueError(f"Tabla desconocida en el backup incremental: {tabla}")
+            pos_id = columnas.index('id')
+            sql_select = f"SELECT * FROM {tabla} WHERE id = ?"
+            sql_update = f"UPDATE {tabla} SET {', '.join(f'{c} = ?' for c in columnas if c != 'id')} WHERE id = ?"
+            sql_insert = f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})"
+            for fila_id in bloque['borrados']:
+                cursor.execute(f"DELETE FROM {tabla} WHERE id = ?", (fila_id,))
+            for fila in bloque['filas']:
+                actual = cursor.execute(sql_select, (fila[pos_id],)).fetchone()
+                if actual is None:
+                    cursor.execute(sql_insert, fila)
+                elif list(actual) != fila: # Los movimientos de stock no admiten UPDATE, y nunca cambian
+                    cursor.execute(sql_update, [v for i, v in enumerate(fila) if i != pos_id] + [fila[pos_id]])
+            filas += len(bloque['filas'])
+            borradas += len(bloque['borrados'])
+            if tabla in ('Ventas', 'DetallesVenta'):
+                pos_venta = pos_id if tabla == 'Ventas' else columnas.index('venta_id')
+                ids = [fila[pos_venta] for fila in bloque['filas']]
+                if tabla == 'Ventas' and bloque['borrados']:
+                    ventas_tocadas['todas'] = True
+                if ids:
+                    ventas_tocadas['min'] = min(ids + [ventas_tocadas.get('min', ids[0])])
+                    ventas_tocadas['max'] = max(ids + [ventas_tocadas.get('max', ids[0])])
+    return filas, borradas
+
+def restaurar_backup(destino, archivo=None):
+    """
+    Reconstruye en `destino` (un archivo .db que no debe existir) la base tal como estaba en el
+    backup `archivo` (por defecto el último con marca): descomprime su base completa, aplica en orden
+    los incrementales de la cadena y recalcula los resúmenes de ventas de los días afectados. Verifica
+    el sha256 de cada archivo. No toca la base en uso.
+    Uso: python backup_manager.py --restaurar destino.db [archivo]
+    Retorna {'destino', 'base', 'incrementales', 'filas', 'borradas', 'duracion_s'}; los errores se propagan.
+    """
+    if os.path.exists(destino):
+        raise FileExistsError(f"El destino '{destino}' ya existe; la restauración no sobrescribe bases.")
+    entradas = listar_backups()
+    if archivo:
+        objetivo = next((e for e in entradas if e['archivo'] == archivo), None)
+        if objetivo is None:
+            raise ValueError(f"El backup {archivo} no está en el índice.")
+    else:
+        objetivo = _cabeza_cadena(entradas, incluir_cerradas=True)
+        if objetivo is None:
+            raise ValueError("No hay backups con marca de registro de cambios para restaurar.")
+    base, cadena = _cadena_hasta(entradas, objetivo)
+
+    inicio = time.perf_counter()
+    temporal = destino + '.parcial'
+    try:
+        with abrir_backup(_verificar_suma(base)) as origen, open(temporal, 'wb') as salida:
+            for bloque in iter(lambda: origen.read(TAMANO_BLOQUE), b''):
+                salida.write(bloque)
+        conn = sqlite3.connect(temporal, isolation_level=None)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA foreign_keys = OFF") # Las filas llegan agrupadas por tabla, no en orden de dependencias
+            cursor.execute("BEGIN IMMEDIATE")
+            filas = borradas = 0
+            ventas_tocadas = {}
+            for entrada in cadena:
+                f, b = _aplicar_incremental(cursor, _verificar_suma(entrada), ventas_tocadas)
+                filas += f
+                borradas += b
+            if ventas_tocadas.get('todas'):
+                database_setup._reconstruir_resumenes_ventas(cursor)
+            elif 'min' in ventas_tocadas:
+                primero, ultimo = cursor.execute(
+                    "SELECT MIN(fecha_venta), MAX(fecha_venta) FROM Ventas WHERE id BETWEEN ? AND ?",
+                    (ventas_tocadas['min'], ventas_tocadas['max'])).fetchone()
+                if primero:
+                    hasta = (date.fromisoformat(ultimo[:10]) + timedelta(days=1)).isoformat()
+                    database_setup._reconstruir_resumenes_ventas(cursor, primero[:10], hasta)
+            # La restauración continúa la cadena del backup: los triggers anotaron lo aplicado, se descarta
+            cursor.execute("DELETE FROM RegistroCambios")
+            cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'RegistroCambios'", (objetivo['marca'],))
+            cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    duracion = time.perf_counter() - inicio
+    print(f"Base restaurada en {destino}: {base['archivo']} + {len(cadena)} incrementales "
+          f"({filas} filas, {borradas} borradas, {duracion:.2f} s)")
+    return {'destino': destino, 'base': base['archivo'], 'incrementales': [e['archivo'] for e in cadena],
+            'filas': filas, 'borradas': borradas, 'duracion_s': round(duracion, 3)}
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == '--restaurar':
+        restaurar_backup(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        sys.exit(0)
+    print("Uso: python backup_manager.py --restaurar destino.db [archivo_del_indice]")
+    sys.exit(1)
@@ -1,4 +1,12 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 import models
+import escritor_ventas
+import importador_productos
 
 # Estado de la aplicación (simulado, en una app real esto podría estar en una clase AppState o similar)
 # El ID del usuario logueado y sus permisos se cargarían aquí tras un login exitoso.
@@ -173,12 +181,7 @@ def obtener_permisos_de_usuario_admin(admin_id, usuario_id_objetivo):
         print(f"Controlador: Usuario {admin_id} no tiene permiso para ver permisos.")
         return None
 
-    conn = models.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT nombre_permiso FROM Permisos ORDER BY nombre_permiso")
-    todos_los_permisos_db = [row['nombre_permiso'] for row in cursor.fetchall()]
-    conn.close()
-
+    todos_los_permisos_db = sorted(models.obtener_catalogo_permisos())
     permisos_del_usuario = models.obtener_permisos_usuario(usuario_id_objetivo)
 
     return {
@@ -186,6 +189,17 @@ def obtener_permisos_de_usuario_admin(admin_id, usuario_id_objetivo):
         'permisos_usuario': permisos_del_usuario
     }
 
+def obtener_permisos_todos_usuarios_admin(admin_id):
+    """
+    Admin obtiene los permisos efectivos de todos los usuarios de una vez (una sola consulta).
+    Retorna: un dict {usuario_id: set(...)} o None.
+    """
+    if not models.tiene_permiso(admin_id, 'administrar_usuarios'):
+        print(f"Controlador: Usuario {admin_id} no tiene permiso para ver permisos.")
+        return None
+    mascaras = models.obtener_mascaras_permisos_todos()
+    return {usuario_id: models.permisos_de_mascara(mascara) for usuario_id, mascara in mascaras.items()}
+
 def gestionar_permiso_usuario_admin(admin_id, usuario_id_objetivo, nombre_permiso, otorgar):
     """
     Admin otorga o revoca un permiso específico a un usuario.
@@ -377,7 +391,7 @@ if __name__ == '__main__':
 
 # Categorías
 def crear_nueva_categoria_admin(admin_id, nombre_categoria, descripcion=None):
-    if not models.tiene_permiso(admin_id, 'gestionar_categorias') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_categorias', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     cat_id = models.crear_categoria(nombre_categoria, descripcion)
     if cat_id:
@@ -385,19 +399,19 @@ def crear_nueva_categoria_admin(admin_id, nombre_categoria, descripcion=None):
     return {"error": "Error al crear categoría (posiblemente ya existe)"}
 
 def obtener_todas_las_categorias_usuario(usuario_id): # Puede ser admin o empleado con permiso de ver
-    if not models.tiene_permiso(usuario_id, 'ver_inventario') and not models.tiene_permiso(usuario_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     return models.listar_categorias()
 
 def actualizar_categoria_admin(admin_id, categoria_id, nombre_categoria=None, descripcion=None):
-    if not models.tiene_permiso(admin_id, 'gestionar_categorias') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_categorias', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     if models.actualizar_categoria(categoria_id, nombre_categoria, descripcion):
         return {"success": True, "mensaje": "Categoría actualizada"}
     return {"error": "Error al actualizar categoría"}
 
 def eliminar_categoria_admin(admin_id, categoria_id):
-    if not models.tiene_permiso(admin_id, 'gestionar_categorias') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_categorias', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     # Podríamos verificar si hay productos en esta categoría antes de eliminar
     productos_en_categoria = models.listar_productos(categoria_id=categoria_id, limit=1)
@@ -409,7 +423,7 @@ def eliminar_categoria_admin(admin_id, categoria_id):
 
 # Proveedores
 def crear_nuevo_proveedor_admin(admin_id, nombre_proveedor, contacto=None, telefono=None, email=None, direccion=None):
-    if not models.tiene_permiso(admin_id, 'gestionar_proveedores') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_proveedores', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     prov_id = models.crear_proveedor(nombre_proveedor, contacto, telefono, email, direccion)
     if prov_id:
@@ -417,19 +431,19 @@ def crear_nuevo_proveedor_admin(admin_id, nombre_proveedor, contacto=None, telef
     return {"error": "Error al crear proveedor"}
 
 def obtener_todos_los_proveedores_usuario(usuario_id):
-    if not models.tiene_permiso(usuario_id, 'ver_inventario') and not models.tiene_permiso(usuario_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     return models.listar_proveedores()
 
 def actualizar_proveedor_admin(admin_id, proveedor_id, **kwargs):
-    if not models.tiene_permiso(admin_id, 'gestionar_proveedores') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_proveedores', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     if models.actualizar_proveedor(proveedor_id, **kwargs):
         return {"success": True, "mensaje": "Proveedor actualizado"}
     return {"error": "Error al actualizar proveedor"}
 
 def eliminar_proveedor_admin(admin_id, proveedor_id):
-    if not models.tiene_permiso(admin_id, 'gestionar_proveedores') and not models.tiene_permiso(admin_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(admin_id, 'gestionar_proveedores', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     # Verificar si hay productos asociados
     productos_del_proveedor = models.listar_productos(proveedor_id=proveedor_id, limit=1)
@@ -453,12 +467,11 @@ def crear_nuevo_producto_admin(admin_id, **kwargs):
     return {"error": "Error al crear producto (posiblemente código de barras duplicado o datos faltantes)"}
 
 def obtener_productos_para_vista(usuario_id, page=1, limit=25, nombre_filtro=None, categoria_id_filtro=None):
-    if not models.tiene_permiso(usuario_id, 'ver_inventario') and not models.tiene_permiso(usuario_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
 
     # Determinar si el usuario puede ver el precio de compra
-    puede_ver_costo = models.tiene_permiso(usuario_id, 'ver_precio_compra') or \
-                      models.tiene_permiso(usuario_id, 'gestionar_inventario') # Admin/gestor de inventario siempre ve costo
+    puede_ver_costo = models.tiene_algun_permiso(usuario_id, 'ver_precio_compra', 'gestionar_inventario') # Admin/gestor de inventario siempre ve costo
 
     productos_db = models.listar_productos(
         nombre=nombre_filtro,
@@ -477,6 +490,18 @@ def obtener_productos_para_vista(usuario_id, page=1, limit=25, nombre_filtro=Non
         return productos_vista
     return productos_db # Devolver el error si lo hubo
 
+def buscar_productos_para_venta(usuario_id, termino, limit=5):
+    """Búsqueda del punto de venta: por relevancia en nombre, descripción y código de barras."""
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
+        return {"error": "Permiso denegado"}
+    puede_ver_costo = models.tiene_algun_permiso(usuario_id, 'ver_precio_compra', 'gestionar_inventario')
+
+    productos = models.buscar_productos_texto(termino, limit=limit)
+    if not puede_ver_costo:
+        for prod in productos:
+            prod.pop('precio_compra', None)
+    return productos
+
 
 def obtener_detalles_producto_admin(admin_id, producto_id):
     if not models.tiene_permiso(admin_id, 'gestionar_inventario'): # Solo admin/gestor puede ver todos los detalles para editar
@@ -501,11 +526,11 @@ def eliminar_producto_admin(admin_id, producto_id): # Eliminación suave por def
     return {"error": "Error al eliminar producto"}
 
 def registrar_entrada_stock_usuario(usuario_id, producto_id, cantidad, notas=None):
-    if not models.tiene_permiso(usuario_id, 'ajustar_stock') and not models.tiene_permiso(usuario_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(usuario_id, 'ajustar_stock', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     if cantidad <=0: return {"error": "La cantidad debe ser positiva."}
 
-    if models.registrar_movimiento_stock(producto_id, cantidad, 'entrada', notas):
+    if models.registrar_movimiento_stock(producto_id, cantidad, 'entrada', notas, usuario_id=usuario_id):
         nuevo_stock_info = models.obtener_producto_por_id(producto_id)
         return {"success": True, "mensaje": "Entrada de stock registrada.", "nuevo_stock": nuevo_stock_info['stock_actual'] if nuevo_stock_info else "N/A"}
     return {"error": "Error al registrar entrada de stock."}
@@ -513,7 +538,7 @@ def registrar_entrada_stock_usuario(usuario_id, producto_id, cantidad, notas=Non
 # Nota: La salida de stock se manejará principalmente a través del módulo de Ventas.
 # Una función para ajuste manual de salida podría ser:
 def registrar_ajuste_salida_stock_usuario(usuario_id, producto_id, cantidad, notas):
-    if not models.tiene_permiso(usuario_id, 'ajustar_stock') and not models.tiene_permiso(usuario_id, 'gestionar_inventario'):
+    if not models.tiene_algun_permiso(usuario_id, 'ajustar_stock', 'gestionar_inventario'):
         return {"error": "Permiso denegado"}
     if cantidad <=0: return {"error": "La cantidad debe ser positiva."}
     if not notas: return {"error": "Se requiere una nota o justificación para el ajuste de salida."}
@@ -522,12 +547,104 @@ def registrar_ajuste_salida_stock_usuario(usuario_id, producto_id, cantidad, not
     if not producto_actual: return {"error": "Producto no encontrado."}
     if producto_actual['stock_actual'] < cantidad: return {"error": f"Stock insuficiente. Disponible: {producto_actual['stock_actual']}"}
 
-    if models.registrar_movimiento_stock(producto_id, cantidad, 'salida', f"AJUSTE MANUAL: {notas}"):
+    if models.registrar_movimiento_stock(producto_id, -cantidad, 'ajuste', f"AJUSTE MANUAL: {notas}", usuario_id=usuario_id):
         nuevo_stock_info = models.obtener_producto_por_id(producto_id)
         return {"success": True, "mensaje": "Ajuste de salida de stock registrado.", "nuevo_stock": nuevo_stock_info['stock_actual'] if nuevo_stock_info else "N/A"}
     return {"error": "Error al registrar ajuste de salida de stock."}
 
+def obtener_movimientos_stock_usuario(usuario_id, producto_id=None, **filtros):
+    """Historial de movimientos de stock. filtros: fecha_inicio, fecha_fin, tipo, limit."""
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
+        return {"error": "Permiso denegado"}
+    if not _fechas_validas(filtros.get('fecha_inicio'), filtros.get('fecha_fin')):
+        return {"error": "Formato de fecha inválido. Use YYYY-MM-DD."}
+    return models.listar_movimientos_stock(producto_id=producto_id, **filtros)
+
+def obtener_stock_a_fecha_usuario(usuario_id, fecha, producto_id=None):
+    if not models.tiene_algun_permiso(usuario_id, 'ver_inventario', 'gestionar_inventario'):
+        return {"error": "Permiso denegado"}
+    if not _fechas_validas(fecha, None):
+        return {"error": "Formato de fecha inválido. Use YYYY-MM-DD."}
+    return {"fecha": fecha, "stock": models.obtener_stock_a_fecha(fecha, producto_id)}
+
 # --- Controladores para Ventas ---
+def _precio_por_cantidad(producto, cantidad):
+    """Precio unitario según el nivel de precio (mayoreo si la cantidad alcanza el mínimo)."""
+    if (producto.get('cantidad_para_mayoreo') and cantidad >= producto['cantidad_para_mayoreo']
+            and producto.get('precio_venta_mayoreo') is not None):
+        return producto['precio_venta_mayoreo']
+    return producto['precio_venta_menudeo']
+
+def agregar_al_carrito(carrito_items, producto, cantidad=1):
+    """
+    Suma `cantidad` del producto a su línea del carrito (o crea la línea) y recalcula el nivel de precio
+    con la cantidad resultante: al cruzar cantidad_para_mayoreo la línea pasa a precio de mayoreo,
+    el mismo que exige _validar_carrito al cobrar. cantidad negativa resta; la línea se quita al llegar a 0.
+    Retorna la línea modificada o None si se quitó.
+    """
+    item = next((i for i in carrito_items if i['producto_id'] == producto['id']), None)
+    if item is None:
+        if cantidad <= 0:
+            return None
+        item = {'producto_id': producto['id'], 'nombre_producto': producto['nombre_producto'], 'cantidad': 0,
+                'stock_disponible_inicial': producto['stock_actual']}
+        carrito_items.append(item)
+    item['cantidad'] += cantidad
+    if item['cantidad'] <= 0:
+        carrito_items.remove(item)
+        return None
+    item['precio_unitario_actual'] = _precio_por_cantidad(producto, item['cantidad'])
+    item['subtotal'] = item['cantidad'] * item['precio_unitario_actual']
+    return item
+
+def _validar_carrito(carrito_items):
+    """
+    Valida todo el carrito con una sola lectura de productos (models.obtener_productos_por_ids):
+    existencia, stock para la cantidad total de cada producto (aunque aparezca en varias líneas)
+    y que el precio de cada línea corresponda a su nivel de precio actual.
+    Retorna {"detalles": [...]} listo para registrar_nueva_venta, o {"error": ...} con todas las líneas con problemas.
+    """
+    productos_db = models.obtener_productos_por_ids(item['producto_id'] for item in carrito_items)
+
+    cantidades_totales = {}
+    for item in carrito_items:
+        cantidades_totales[item['producto_id']] = cantidades_totales.get(item['producto_id'], 0) + item['cantidad']
+
+    no_encontrados, sin_stock, precios_cambiados = [], [], []
+    for producto_id, cantidad_total in cantidades_totales.items():
+        producto_db = productos_db.get(producto_id)
+        if producto_db and producto_db['stock_actual'] < cantidad_total:
+            sin_stock.append(f"'{producto_db['nombre_producto']}' (Disponible: {producto_db['stock_actual']}, Solicitado: {cantidad_total})")
+
+    detalles = []
+    for item in carrito_items:
+        producto_db = productos_db.get(item['producto_id'])
+        if not producto_db:
+            no_encontrados.append(f"'{item.get('nombre_producto', 'Desconocido')}'")
+            continue
+        precio_venta_final = item['precio_unitario_actual']
+        precio_vigente = _precio_por_cantidad(producto_db, cantidades_totales[item['producto_id']])
+        if abs(precio_vigente - precio_venta_final) > 0.005:
+            precios_cambiados.append(f"'{producto_db['nombre_producto']}' (Carrito: ${precio_venta_final:.2f}, Vigente: ${precio_vigente:.2f})")
+        detalles.append({
+            'producto_id': item['producto_id'],
+            'cantidad': item['cantidad'],
+            'precio_unitario_venta': precio_venta_final, # Precio al que se vende realmente
+            'subtotal_linea': item['cantidad'] * precio_venta_final,
+            # 'descuento_linea': 0 # Asumir 0 por ahora, se podría añadir lógica
+        })
+
+    errores = []
+    if no_encontrados:
+        errores.append("Productos no encontrados en la base de datos: " + ", ".join(no_encontrados) + ".")
+    if sin_stock:
+        errores.append("Stock insuficiente para: " + "; ".join(sin_stock) + ".")
+    if precios_cambiados:
+        errores.append("El precio cambió para: " + "; ".join(precios_cambiados) + ". Actualice el carrito.")
+    if errores:
+        return {"error": " ".join(errores)}
+    return {"detalles": detalles}
+
 def procesar_nueva_venta_usuario(usuario_id, carrito_items, total_calculado_carrito, **kwargs):
     """
     Procesa una nueva venta.
@@ -540,32 +657,10 @@ def procesar_nueva_venta_usuario(usuario_id, carrito_items, total_calculado_carr
     if not carrito_items:
         return {"error": "El carrito está vacío."}
 
-    detalles_para_db = []
-    subtotal_general = 0
-
-    # Validar stock y preparar detalles para la base de datos
-    for item_carrito in carrito_items:
-        producto_db = models.obtener_producto_por_id(item_carrito['producto_id'])
-        if not producto_db:
-            return {"error": f"Producto '{item_carrito.get('nombre_producto', 'Desconocido')}' no encontrado en la base de datos."}
-        if producto_db['stock_actual'] < item_carrito['cantidad']:
-            return {"error": f"Stock insuficiente para '{producto_db['nombre_producto']}'. Disponible: {producto_db['stock_actual']}, Solicitado: {item_carrito['cantidad']}."}
-
-        precio_venta_final = item_carrito['precio_unitario_actual'] # Podría incluir lógica de mayoreo aquí si se desea
-        # Ejemplo de lógica de mayoreo (si no se manejó al agregar al carrito):
-        # if producto_db.get('cantidad_para_mayoreo') and item_carrito['cantidad'] >= producto_db['cantidad_para_mayoreo'] and producto_db.get('precio_venta_mayoreo'):
-        #     precio_venta_final = producto_db['precio_venta_mayoreo']
-
-        subtotal_linea_calculado = item_carrito['cantidad'] * precio_venta_final
-        subtotal_general += subtotal_linea_calculado
-
-        detalles_para_db.append({
-            'producto_id': item_carrito['producto_id'],
-            'cantidad': item_carrito['cantidad'],
-            'precio_unitario_venta': precio_venta_final, # Precio al que se vende realmente
-            'subtotal_linea': subtotal_linea_calculado,
-            # 'descuento_linea': 0 # Asumir 0 por ahora, se podría añadir lógica
-        })
+    validacion = _validar_carrito(carrito_items)
+    if validacion.get("error"):
+        return validacion
+    detalles_para_db = validacion["detalles"]
 
     # Verificar si el total_calculado_carrito (que podría tener descuentos generales) coincide con el subtotal_general
     # Por ahora, usaremos el total_calculado_carrito que viene de la UI.
@@ -582,7 +677,7 @@ def procesar_nueva_venta_usuario(usuario_id, carrito_items, total_calculado_carr
         except ValueError:
             return {"error": "Monto recibido inválido."}
 
-    venta_id = models.registrar_nueva_venta(
+    resultado_venta = escritor_ventas.registrar_venta( # Confirmación agrupada si el escritor está iniciado
         usuario_id=usuario_id,
         detalles_productos=detalles_para_db,
         total_venta=total_calculado_carrito, # Usar el total que ya podría incluir descuentos globales
@@ -595,11 +690,14 @@ def procesar_nueva_venta_usuario(usuario_id, carrito_items, total_calculado_carr
         notas=kwargs.get('notas')
     )
 
-    if venta_id:
-        return {"success": True, "venta_id": venta_id, "cambio": cambio_entregado, "mensaje": "Venta registrada exitosamente."}
-    else:
-        # El modelo ya imprime el error específico de SQLite, aquí un mensaje genérico.
-        return {"error": "Error al registrar la venta en la base de datos. Verifique el stock o contacte al administrador."}
+    if resultado_venta.get("success"):
+        return {"success": True, "venta_id": resultado_venta["venta_id"], "cambio": cambio_entregado, "mensaje": "Venta registrada exitosamente."}
+    if resultado_venta.get("pendiente"): # Agotó la espera mientras se escribía: puede quedar registrada
+        return {"pendiente": True, "mensaje": resultado_venta["mensaje"], "futuro": resultado_venta["futuro"]}
+    if resultado_venta.get("faltantes"): # El stock cambió entre la validación y el registro (otra caja vendió)
+        return {"error": resultado_venta["error"], "faltantes": resultado_venta["faltantes"]}
+    # El modelo ya imprime el error específico de SQLite, aquí un mensaje genérico.
+    return {"error": "Error al registrar la venta en la base de datos. Verifique el stock o contacte al administrador."}
 
 
 def obtener_historial_ventas_usuario(usuario_id_solicitante, **kwargs_filtros):
@@ -607,20 +705,25 @@ def obtener_historial_ventas_usuario(usuario_id_solicitante, **kwargs_filtros):
     Obtiene el historial de ventas.
     Si el usuario tiene permiso 'ver_historial_ventas_todas', puede ver todas.
     Sino, solo sus propias ventas (si tiene 'ver_historial_ventas_propias').
-    kwargs_filtros: fecha_inicio, fecha_fin, cliente_filtro, page, limit, usuario_id_filtro (este último solo si tiene permiso_todas)
+    kwargs_filtros: fecha_inicio, fecha_fin, cliente_filtro, page, limit, cursor_pagina, contar_total,
+                    usuario_id_filtro (este último solo si tiene permiso_todas)
     """
     puede_ver_todas = models.tiene_permiso(usuario_id_solicitante, 'ver_historial_ventas_todas')
     puede_ver_propias = models.tiene_permiso(usuario_id_solicitante, 'ver_historial_ventas_propias')
 
     if not puede_ver_todas and not puede_ver_propias:
         return {"error": "Permiso denegado para ver historial de ventas."}
+    if not _fechas_validas(kwargs_filtros.get('fecha_inicio'), kwargs_filtros.get('fecha_fin')):
+        return {"error": "Formato de fecha inválido. Use YYYY-MM-DD."}
 
     filtros_modelo = {
         "fecha_inicio": kwargs_filtros.get('fecha_inicio'),
         "fecha_fin": kwargs_filtros.get('fecha_fin'),
         "cliente_filtro": kwargs_filtros.get('cliente_filtro'),
         "page": kwargs_filtros.get('page', 1),
-        "limit": kwargs_filtros.get('limit', 25)
+        "limit": kwargs_filtros.get('limit', 25),
+        "cursor_pagina": kwargs_filtros.get('cursor_pagina'), # (fecha_venta, id) devuelto como 'siguiente_cursor'
+        "contar_total": kwargs_filtros.get('contar_total', True)
     }
 
     if puede_ver_todas:
@@ -657,105 +760,334 @@ def obtener_detalles_venta_usuario(usuario_id_solicitante, venta_id_buscada):
 
     return venta_detalle
 
+def cancelar_venta_usuario(usuario_id, venta_id, motivo):
+    """Cancela una venta completada y reingresa su mercancía al stock."""
+    if not models.tiene_permiso(usuario_id, 'cancelar_ventas'):
+        return {"error": "Permiso denegado para cancelar ventas."}
+    if not motivo:
+        return {"error": "Se requiere el motivo de la cancelación."}
+    resultado = models.cancelar_venta(venta_id, usuario_id=usuario_id, motivo=motivo)
+    if resultado.get("success"):
+        return {"success": True, "mensaje": f"Venta #{venta_id} cancelada y stock reingresado."}
+    return resultado
+
 # --- Controladores para Reportes ---
-def generar_reporte_ventas_periodo_ctrl(usuario_id, fecha_inicio, fecha_fin):
-    if not models.tiene_permiso(usuario_id, 'generar_reportes_ventas'):
-        return {"error": "Permiso denegado para generar reportes."}
+def _fechas_validas(fecha_inicio, fecha_fin):
+    """True si ambas fechas (opcionales) tienen formato YYYY-MM-DD."""
+    try:
+        models.rango_fechas_semiabierto(fecha_inicio, fecha_fin)
+        return True
+    except ValueError:
+        return False
+
+# Caché de reportes: datos de cada reporte por (tipo, fecha_inicio, fecha_fin, parámetros) con expulsión LRU,
+# y los archivos ya generados a partir de ellos. Un período cerrado (terminó antes de hoy, en UTC como
+# Ventas.fecha_venta) no caduca: se invalida cuando se confirman o cancelan ventas de alguno de sus días
+# en este proceso (models.registrar_oyente_cambios_ventas) o cuando cambia la huella de sus ventas, que se
+# comprueba en cada acierto (cubre las otras terminales). Los períodos que incluyen hoy caducan además
+# tras REPORTES_CACHE_TTL_ABIERTO_S, porque otras terminales también venden y no nos notifican.
+REPORTES_CACHE_MAX = 64
+REPORTES_CACHE_TTL_ABIERTO_S = 60
+_cache_reportes = OrderedDict() # clave -> {'datos', 'archivos': {formato: ruta}, 'cerrado', 'huella', 'instante'}
+_cache_reportes_lock = threading.Lock()
+_cache_reportes_stats = {'aciertos': 0, 'fallos': 0, 'invalidaciones': 0, 'expulsiones': 0,
+                         'archivos_reutilizados': 0} # aciertos/fallos: uno por petición, en _reporte_cacheado
+_invalidaciones_reportes = deque(maxlen=256) # (número de invalidación, días) para no guardar datos calculados durante una venta
+_contador_invalidaciones_reportes = {'valor': 0}
+
+def _rango_incluye_dias(clave, dias):
+    """clave[1:3] son fecha_inicio y fecha_fin; dias None equivale a 'cualquier día'."""
+    return dias is None or any(clave[1][:10] <= dia <= clave[2][:10] for dia in dias)
+
+def _invalidar_reportes_por_dias(dias):
+    """Oyente de models: descarta los reportes cuyo rango incluye alguno de los días con ventas nuevas o canceladas."""
+    with _cache_reportes_lock:
+        _contador_invalidaciones_reportes['valor'] += 1
+        _invalidaciones_reportes.append((_contador_invalidaciones_reportes['valor'], dias))
+        for clave in [c for c in _cache_reportes if _rango_incluye_dias(c, dias)]:
+            del _cache_reportes[clave]
+            _cache_reportes_stats['invalidaciones'] += 1
+
+models.registrar_oyente_cambios_ventas(_invalidar_reportes_por_dias)
+
+def invalidar_cache_reportes():
+    """Vacía la caché de reportes (p. ej. tras importar o restaurar la base de datos)."""
+    _invalidar_reportes_por_dias(None)
+
+def obtener_estadisticas_cache_reportes():
+    with _cache_reportes_lock:
+        return dict(_cache_reportes_stats, entradas=len(_cache_reportes), maximo=REPORTES_CACHE_MAX)
+
+def _entrada_reporte_vigente(clave):
+    """Retorna la entrada de la caché si sigue vigente (y la marca como usada), o None. Requiere el lock."""
+    entrada = _cache_reportes.get(clave)
+    if entrada is None:
+        return None
+    if not entrada['cerrado'] and time.monotonic() - entrada['instante'] >= REPORTES_CACHE_TTL_ABIERTO_S:
+        del _cache_reportes[clave]
+        return None
+    _cache_reportes.move_to_end(clave)
+    return entrada
+
+def _huella_reporte(clave):
+    """Huella de las ventas del rango de la clave (models.huella_ventas_periodo)."""
+    return models.huella_ventas_periodo(clave[1], clave[2])
+
+def _reporte_cacheado(clave, calcular):
+    """
+    Retorna (datos, desde_cache). Solo se guardan resultados sin 'error'. Cada llamador recibe su propia
+    copia de los datos, para que modificarla no altere la caché.
+    Un período cerrado guarda la huella de sus ventas y se comprueba en cada acierto: el oyente de models
+    solo se entera de las ventas de este proceso, no de las canceladas o registradas con fecha pasada en
+    otra terminal.
+    """
+    with _cache_reportes_lock:
+        entrada = _entrada_reporte_vigente(clave)
+    if entrada is not None and entrada['cerrado'] and _huella_reporte(clave) != entrada['huella']:
+        with _cache_reportes_lock:
+            if _cache_reportes.get(clave) is entrada:
+                del _cache_reportes[clave]
+                _cache_reportes_stats['invalidaciones'] += 1
+        entrada = None
+    with _cache_reportes_lock:
+        if entrada is not None:
+            _cache_reportes_stats['aciertos'] += 1
+            return copy.deepcopy(entrada['datos']), True
+        _cache_reportes_stats['fallos'] += 1
+        invalidacion_inicial = _contador_invalidaciones_reportes['valor']
+
+    cerrado = clave[2][:10] < datetime.now(timezone.utc).date().isoformat()
+    huella = _huella_reporte(clave) if cerrado else None # Antes de calcular: un cambio intermedio solo descarta la entrada
+    datos = calcular()
+    if isinstance(datos, dict) and "error" in datos:
+        return datos, False
+
+    with _cache_reportes_lock:
+        # Si mientras se calculaba se confirmó una venta de algún día del rango, los datos pueden no incluirla
+        posteriores = [dias for n, dias in _invalidaciones_reportes if n > invalidacion_inicial]
+        completas = _contador_invalidaciones_reportes['valor'] - invalidacion_inicial <= len(_invalidaciones_reportes)
+        if completas and not any(_rango_incluye_dias(clave, dias) for dias in posteriores):
+            _cache_reportes[clave] = {'datos': copy.deepcopy(datos), 'archivos': {}, 'cerrado': cerrado,
+                                      'huella': huella, 'instante': time.monotonic()}
+            _cache_reportes.move_to_end(clave)
+            while len(_cache_reportes) > REPORTES_CACHE_MAX:
+                _cache_reportes.popitem(last=False)
+                _cache_reportes_stats['expulsiones'] += 1
+    return datos, False
+
+def _preparar_reporte(tipo_reporte, usuario_id, fecha_inicio, fecha_fin, top_n=10, metricas=('cantidad', 'valor')):
+    """
+    Valida permisos y parámetros de un reporte.
+    Retorna (clave de caché, función que calcula los datos) o {'error': mensaje}.
+    """
+    if tipo_reporte == 'ventas_por_usuario':
+        # Este reporte podría ser sensible, así que el permiso 'generar_reportes_ventas' es clave.
+        # Adicionalmente, si no es un admin global, podría limitarse a sus propias ventas si tuviera sentido,
+        # pero usualmente los reportes de "ventas por usuario" son para supervisión.
+        if not models.tiene_todos_los_permisos(usuario_id, 'generar_reportes_ventas', 'ver_historial_ventas_todas'): # Requiere ver todas las ventas
+            return {"error": "Permiso denegado para generar este reporte."}
+    elif tipo_reporte in ('ventas_periodo', 'productos_mas_vendidos'):
+        if not models.tiene_permiso(usuario_id, 'generar_reportes_ventas'):
+            return {"error": "Permiso denegado para generar reportes." if tipo_reporte == 'ventas_periodo' else "Permiso denegado."}
+    else:
+        return {"error": "Tipo de reporte no soportado."}
 
     # Validar fechas (básico)
     if not fecha_inicio or not fecha_fin:
         return {"error": "Fechas de inicio y fin son requeridas."}
-    # Aquí podrían ir validaciones más complejas de formato de fecha.
+    if not _fechas_validas(fecha_inicio, fecha_fin):
+        return {"error": "Formato de fecha inválido. Use YYYY-MM-DD."}
 
-    datos_reporte = models.obtener_resumen_ventas_periodo(fecha_inicio, fecha_fin)
-    # El controlador podría enriquecer o transformar estos datos si fuera necesario
-    # antes de pasarlos al generador de archivos.
-    return datos_reporte
+    if tipo_reporte == 'ventas_periodo':
+        return (tipo_reporte, fecha_inicio, fecha_fin), lambda: models.obtener_resumen_ventas_periodo(fecha_inicio, fecha_fin)
+    if tipo_reporte == 'ventas_por_usuario':
+        return (tipo_reporte, fecha_inicio, fecha_fin), lambda: models.obtener_ventas_agrupadas_por_usuario(fecha_inicio, fecha_fin)
 
-def generar_reporte_productos_mas_vendidos_ctrl(usuario_id, fecha_inicio, fecha_fin, top_n=10):
-    if not models.tiene_permiso(usuario_id, 'generar_reportes_ventas'):
-        return {"error": "Permiso denegado."}
-    if not fecha_inicio or not fecha_fin:
-        return {"error": "Fechas de inicio y fin son requeridas."}
     try:
         top_n_int = int(top_n)
         if top_n_int <= 0: raise ValueError()
     except ValueError:
         return {"error": "Top N debe ser un número positivo."}
+    metricas = tuple(metricas)
+    def calcular():
+        try:
+            return models.obtener_productos_mas_vendidos(fecha_inicio, fecha_fin, top_n_int, metricas=metricas)
+        except ValueError as e:
+            return {"error": str(e)}
+    return (tipo_reporte, fecha_inicio, fecha_fin, top_n_int, metricas), calcular
+
+def _datos_reporte(tipo_reporte, usuario_id, fecha_inicio, fecha_fin, **parametros):
+    """Retorna (clave, datos, desde_cache); clave None si hubo error (datos es {'error': ...})."""
+    preparado = _preparar_reporte(tipo_reporte, usuario_id, fecha_inicio, fecha_fin, **parametros)
+    if isinstance(preparado, dict):
+        return None, preparado, False
+    clave, calcular = preparado
+    datos, desde_cache = _reporte_cacheado(clave, calcular)
+    return (clave if not (isinstance(datos, dict) and "error" in datos) else None), datos, desde_cache
+
+def generar_reporte_ventas_periodo_ctrl(usuario_id, fecha_inicio, fecha_fin):
+    # El controlador podría enriquecer o transformar estos datos si fuera necesario
+    # antes de pasarlos al generador de archivos.
+    return _datos_reporte('ventas_periodo', usuario_id, fecha_inicio, fecha_fin)[1]
 
-    datos_reporte = models.obtener_productos_mas_vendidos(fecha_inicio, fecha_fin, top_n_int)
-    return datos_reporte
+def generar_reporte_productos_mas_vendidos_ctrl(usuario_id, fecha_inicio, fecha_fin, top_n=10, metricas=('cantidad', 'valor')):
+    """metricas: cualquier combinación de 'cantidad', 'valor', 'margen', 'tickets' (una sola pasada sobre las ventas)."""
+    return _datos_reporte('productos_mas_vendidos', usuario_id, fecha_inicio, fecha_fin, top_n=top_n, metricas=metricas)[1]
 
 def generar_reporte_ventas_por_usuario_ctrl(usuario_id_solicitante, fecha_inicio, fecha_fin):
-    # Este reporte podría ser sensible, así que el permiso 'generar_reportes_ventas' es clave.
-    # Adicionalmente, si no es un admin global, podría limitarse a sus propias ventas si tuviera sentido,
-    # pero usualmente los reportes de "ventas por usuario" son para supervisión.
-    if not models.tiene_permiso(usuario_id_solicitante, 'generar_reportes_ventas') or \
-       not models.tiene_permiso(usuario_id_solicitante, 'ver_historial_ventas_todas'): # Requiere ver todas las ventas
-        return {"error": "Permiso denegado para generar este reporte."}
-    if not fecha_inicio or not fecha_fin:
-        return {"error": "Fechas de inicio y fin son requeridas."}
+    return _datos_reporte('ventas_por_usuario', usuario_id_solicitante, fecha_inicio, fecha_fin)[1]
+
+def obtener_reporte_ctrl(usuario_id, tipo_reporte, fecha_inicio, fecha_fin, top_n=10):
+    """Retorna {'success', 'datos', 'desde_cache'} o {'error'}."""
+    _, datos, desde_cache = _datos_reporte(tipo_reporte, usuario_id, fecha_inicio, fecha_fin,
+                                           **({'top_n': top_n} if tipo_reporte == 'productos_mas_vendidos' else {}))
+    if isinstance(datos, dict) and "error" in datos:
+        return datos
+    return {"success": True, "datos": datos, "desde_cache": desde_cache}
 
-    datos_reporte = models.obtener_ventas_agrupadas_por_usuario(fecha_inicio, fecha_fin)
-    return datos_reporte
+def exportar_reporte_ctrl(usuario_id, tipo_reporte, formato, fecha_inicio, fecha_fin, top_n=10):
+    """
+    Genera el archivo ('excel' o 'pdf') de un reporte, o reutiliza el ya generado si sus datos siguen en caché.
+    Retorna {'success', 'filepath', 'desde_cache'} (desde_cache: archivo reutilizado) o {'error'}.
+    """
+    if formato not in ('excel', 'pdf'):
+        return {"error": "Formato de exportación no soportado."}
+    parametros = {'top_n': top_n} if tipo_reporte == 'productos_mas_vendidos' else {}
+    clave, datos, _ = _datos_reporte(tipo_reporte, usuario_id, fecha_inicio, fecha_fin, **parametros)
+    if clave is None:
+        return datos
+    with _cache_reportes_lock:
+        entrada = _cache_reportes.get(clave)
+        ruta = entrada['archivos'].get(formato) if entrada is not None and entrada['datos'] == datos else None
+    if ruta and os.path.exists(ruta):
+        with _cache_reportes_lock:
+            _cache_reportes_stats['archivos_reutilizados'] += 1 # El acierto de datos ya se contó en _datos_reporte
+        return {"success": True, "filepath": ruta, "desde_cache": True}
+
+    if tipo_reporte == 'ventas_periodo':
+        generar = report_generator.generar_excel_ventas_periodo if formato == 'excel' else report_generator.generar_pdf_ventas_periodo
+        ruta = generar(datos, fecha_inicio, fecha_fin)
+    elif tipo_reporte == 'productos_mas_vendidos':
+        generar = report_generator.generar_excel_productos_mas_vendidos if formato == 'excel' else report_generator.generar_pdf_productos_mas_vendidos
+        ruta = generar(datos, fecha_inicio, fecha_fin, clave[3])
+    else:
+        generar = report_generator.generar_excel_ventas_por_usuario if formato == 'excel' else report_generator.generar_pdf_ventas_por_usuario
+        ruta = generar(datos, fecha_inicio, fecha_fin)
+    if not ruta:
+        return {"error": "Ocurrió un error al generar el archivo del reporte."}
+    with _cache_reportes_lock:
+        entrada = _cache_reportes.get(clave)
+        if entrada is not None and entrada['datos'] == datos: # Solo si los datos no cambiaron entretanto
+            entrada['archivos'][formato] = ruta
+    return {"success": True, "filepath": ruta, "desde_cache": False}
 
 # --- Controladores para Importación/Exportación ---
 import db_utils # Importar el nuevo módulo
+import backup_manager
+import verificador_backups
 import report_generator # Añadido para exportar productos
 
-def exportar_database_completa_ctrl(usuario_id):
+def exportar_database_completa_ctrl(usuario_id, formato='sql', progreso=None):
+    """
+    formato 'sql': volcado de texto portable; formato 'db': backup en línea página a página, sin detener
+    las ventas (progreso(paginas_copiadas, paginas_totales) opcional). Ambos pasan por crear_backup_ctrl:
+    quedan comprimidos, en el índice y bajo la retención como cualquier otro backup de BACKUP_DIR.
+    """
+    return crear_backup_ctrl(usuario_id, tipo=formato, progreso=progreso)
+
+def crear_backup_ctrl(usuario_id, tipo='db', compresion=backup_manager.COMPRESION_POR_DEFECTO, progreso=None, origen='manual'):
+    """
+    Backup comprimido (gzip/lzma) registrado en el índice de backups, con retención abuelo-padre-hijo.
+    tipo 'db': copia en línea de la base; tipo 'sql': volcado de texto portable;
+    tipo 'incremental': solo las filas cambiadas desde el último backup (crea una base 'db' si hace falta).
+    Cada backup nuevo se verifica después en el proceso verificador (verificador_backups).
+    """
     if not models.tiene_permiso(usuario_id, 'exportar_bd'):
         return {"error": "Permiso denegado para exportar la base de datos."}
+    try:
+        if tipo == 'incremental':
+            entrada = backup_manager.crear_backup_incremental(compresion=compresion, origen=origen)
+        else:
+            entrada = backup_manager.crear_backup(tipo=tipo, compresion=compresion, progreso=progreso, origen=origen)
+    except ValueError as e:
+        return {"error": str(e)}
+    if not entrada:
+        return {"error": "Ocurrió un error durante el backup de la base de datos."}
+    filepath = os.path.join(db_utils.BACKUP_DIR, entrada['archivo'])
+    if entrada.get('sin_cambios'):
+        return {"success": True, "filepath": filepath, "entrada": entrada,
+                "mensaje": f"Sin cambios desde el último backup ({entrada['archivo']})."}
+    verificador_backups.solicitar_verificacion(entrada['archivo'])
+    if entrada['tipo'] == 'incremental':
+        return {"success": True, "filepath": filepath, "entrada": entrada,
+                "mensaje": f"Backup incremental creado en {filepath} ({entrada['filas']} filas, {entrada['borradas']} borradas, {entrada['bytes_archivo'] / 1024:.1f} KB)"}
+    proporcion = entrada['bytes_origen'] / entrada['bytes_archivo'] if entrada['bytes_archivo'] else 0
+    return {"success": True, "filepath": filepath, "entrada": entrada,
+            "mensaje": f"Backup creado en {filepath} ({entrada['bytes_archivo'] / 1e6:.1f} MB, {proporcion:.1f}x comprimido, {entrada['duracion_s']} s)"}
+
+def listar_backups_ctrl(usuario_id):
+    if not models.tiene_permiso(usuario_id, 'exportar_bd'):
+        return {"error": "Permiso denegado para ver los backups."}
+    return {"success": True, "backups": backup_manager.listar_backups(), "uso": backup_manager.obtener_uso_backups()}
 
-    filepath = db_utils.export_database_to_sql()
-    if filepath:
-        return {"success": True, "filepath": filepath, "mensaje": f"Base de datos exportada a {filepath}"}
-    else:
-        return {"error": "Ocurrió un error durante la exportación de la base de datos."}
-
-def importar_database_desde_sql_ctrl(usuario_id, sql_filepath):
+def verificar_backup_ctrl(usuario_id, archivo, completo=True):
+    """
+    Encola la verificación de un backup (integrity_check completo por defecto). El resultado queda
+    en la entrada del índice ('verificacion'), visible con listar_backups_ctrl.
+    """
+    if not models.tiene_permiso(usuario_id, 'exportar_bd'):
+        return {"error": "Permiso denegado para verificar los backups."}
+    if not any(e['archivo'] == archivo for e in backup_manager.listar_backups()):
+        return {"error": f"El backup {archivo} no está en el índice."}
+    if verificador_backups.solicitar_verificacion(archivo, completo) is None:
+        return {"success": True, "mensaje": f"La verificación de {archivo} ya está en curso."}
+    return {"success": True, "mensaje": f"Verificación de {archivo} iniciada en segundo plano."}
+
+def importar_database_desde_sql_ctrl(usuario_id, sql_filepath, progreso=None):
+    """
+    Restaura la base desde un volcado .sql / .sql.gz / .sql.xz (db_utils.import_database_from_sql):
+    se carga y verifica en un archivo temporal y solo entonces reemplaza a la base en uso.
+    progreso(bytes_leidos, bytes_totales, filas) opcional.
+    """
     if not models.tiene_permiso(usuario_id, 'importar_bd'):
         return {"error": "Permiso denegado para importar la base de datos."}
 
-    # Aquí se podría añadir lógica para hacer un backup antes de importar, si se desea.
-    # Por ejemplo, llamar a exportar_database_completa_ctrl y guardar la ruta del backup.
-
-    success = db_utils.import_database_from_sql(sql_filepath)
-    if success:
+    resultado = db_utils.import_database_from_sql(sql_filepath, progreso=progreso)
+    if resultado:
+        models.invalidar_cache_permisos() # Usuarios y permisos pueden haber cambiado por completo
+        models.invalidar_indice_productos()
+        invalidar_cache_reportes()
+        backup_manager.cerrar_cadena_backups() # El próximo incremental necesita una base de la nueva base de datos
         # IMPORTANTE: Después de una importación, especialmente si cambia la estructura o datos críticos,
         # la aplicación podría necesitar reiniciarse o recargar ciertos datos en memoria.
         # Esta lógica no se maneja aquí, pero es una consideración para la app completa.
-        return {"success": True, "mensaje": f"Base de datos importada desde {sql_filepath}. Se recomienda reiniciar la aplicación."}
+        return {"success": True, "estadisticas": resultado,
+                "mensaje": f"Base de datos importada desde {sql_filepath} ({resultado['filas']} filas, {resultado['filas_por_s']} filas/s). Se recomienda reiniciar la aplicación."}
     else:
-        # Si se hizo backup, aquí se podría ofrecer restaurarlo o informar al usuario.
-        return {"error": "Ocurrió un error durante la importación de la base de datos."}
+        return {"error": "Ocurrió un error durante la importación de la base de datos. La base de datos actual no se modificó."}
 
 def exportar_productos_a_excel_ctrl(usuario_id):
     if not models.tiene_permiso(usuario_id, 'exportar_datos_productos'):
         return {"error": "Permiso denegado para exportar datos de productos."}
 
-    # Obtener todos los productos. Usar un límite muy alto o modificar listar_productos para no tener límite.
-    # Por ahora, asumimos que listar_productos sin 'limit' devuelve todos, o usamos un límite grande.
-    productos_data = models.listar_productos(limit=None, solo_activos=False) # Exportar activos e inactivos
-
-    if isinstance(productos_data, list): # Asegurarse de que no es un dict de error
-        # Llamar a la función de report_generator para crear el Excel
-        # (Esta función se creará en el siguiente paso del plan para report_generator.py)
-        try:
-            # Asumimos que report_generator.generar_excel_productos existirá
-            filepath = report_generator.generar_excel_productos(productos_data)
-            if filepath:
-                return {"success": True, "filepath": filepath, "mensaje": f"Datos de productos exportados a {filepath}"}
-            else:
-                return {"error": "Error al generar el archivo Excel de productos."}
-        except AttributeError: # Si generar_excel_productos aún no existe en report_generator
-            return {"error": "Funcionalidad de exportación de productos a Excel no implementada completamente en report_generator."}
-        except Exception as e:
-            return {"error": f"Error inesperado al exportar productos: {e}"}
-    else:
-        return {"error": "No se pudieron obtener los datos de los productos para exportar."}
+    # Exportar activos e inactivos. El catálogo se recorre con un cursor y se escribe en streaming:
+    # ni la lista de productos ni el libro completo llegan a estar en memoria.
+    try:
+        filepath = report_generator.generar_excel_productos(models.iterar_productos(solo_activos=False))
+        if filepath:
+            return {"success": True, "filepath": filepath, "mensaje": f"Datos de productos exportados a {filepath}"}
+        else:
+            return {"error": "Error al generar el archivo Excel de productos."}
+    except Exception as e:
+        return {"error": f"Error inesperado al exportar productos: {e}"}
 
-def importar_productos_desde_excel_ctrl(usuario_id, excel_filepath):
+def importar_productos_desde_excel_ctrl(usuario_id, excel_filepath, progreso=None, simular=False):
+    """
+    Crea o actualiza productos desde un Excel con el motor por lotes (importador_productos).
+    Solo se escriben las altas y las filas con algún valor distinto del actual.
+    progreso: función opcional progreso(filas_leidas, total_filas) (total None si el archivo no lo indica).
+    simular: True para obtener la vista previa (qué se crearía, qué columnas cambiarían, qué filas fallan) sin escribir.
+    """
     if not models.tiene_permiso(usuario_id, 'importar_datos_productos'):
         return {"error": "Permiso denegado para importar datos de productos."}
 
@@ -763,53 +1095,22 @@ def importar_productos_desde_excel_ctrl(usuario_id, excel_filepath):
         return {"error": f"Archivo Excel no encontrado en: {excel_filepath}"}
 
     try:
-        workbook = openpyxl.load_workbook(excel_filepath)
-        sheet = workbook.active # Asumir la primera hoja activa
-
-        headers = [cell.value for cell in sheet[1]] # Primera fila como cabeceras
-        # Validar cabeceras esperadas (ejemplo básico)
-        expected_headers = ['Nombre Producto', 'Código Barras', 'Precio Venta'] # Mínimo esperado
-        if not all(h in headers for h in expected_headers):
-            return {"error": f"Cabeceras faltantes o incorrectas. Se esperan al menos: {', '.join(expected_headers)}"}
-
-        resultados_importacion = []
-        productos_creados = 0
-        productos_actualizados = 0
-        errores_filas = 0
-
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            if all(cell is None for cell in row): # Saltar filas completamente vacías
-                continue
-
-            fila_dict = dict(zip(headers, row))
-
-            # Limpiar Nones explícitos que openpyxl podría leer de celdas vacías
-            fila_dict_clean = {k: v for k, v in fila_dict.items() if v is not None}
-
-            if not fila_dict_clean.get('Nombre Producto'): # Si no hay nombre, es probable fin de datos o fila inválida
-                # print(f"Fila {row_idx} sin nombre de producto, omitiendo.")
-                continue
-
-            resultado_fila = models.procesar_fila_producto_excel(fila_dict_clean)
-            resultados_importacion.append({
-                "fila": row_idx,
-                "nombre_original": fila_dict_clean.get('Nombre Producto', 'N/A'),
-                "status": resultado_fila.get('status'),
-                "mensaje": resultado_fila.get('mensaje')
-            })
-            if resultado_fila.get('status') == 'creado':
-                productos_creados += 1
-            elif resultado_fila.get('status') == 'actualizado':
-                productos_actualizados += 1
-            elif resultado_fila.get('status') == 'error':
-                errores_filas +=1
-
-        resumen = f"Importación completada. Creados: {productos_creados}, Actualizados: {productos_actualizados}, Errores: {errores_filas}."
-        return {"success": True, "mensaje": resumen, "detalles": resultados_importacion}
-
+        resultado = importador_productos.importar_productos_excel(excel_filepath, usuario_id=usuario_id, progreso=progreso, simular=simular)
+    except ValueError as e: # Cabeceras faltantes
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"Error al procesar el archivo Excel: {e}"}
 
+    if simular:
+        resumen = (f"Vista previa (no se escribió nada). Se crearían: {resultado['creados']}, Se actualizarían: {resultado['actualizados']}, "
+                   f"Sin cambios: {resultado['sin_cambios']}, Errores: {resultado['errores']}.")
+    else:
+        resumen = (f"Importación completada. Creados: {resultado['creados']}, Actualizados: {resultado['actualizados']}, "
+                   f"Sin cambios: {resultado['sin_cambios']}, Errores: {resultado['errores']}.")
+    return {"success": True, "mensaje": resumen, "simulacion": simular, "creados": resultado['creados'],
+            "actualizados": resultado['actualizados'], "sin_cambios": resultado['sin_cambios'],
+            "errores": resultado['errores'], "detalles": resultado['detalles']}
+
 
 if __name__ == '__main__':
     # ... (pruebas existentes) ...
@@ -1,7 +1,11 @@
 import sqlite3
+import sys
+from datetime import date, timedelta
+import db_pool
 
 def crear_tablas():
     conn = sqlite3.connect('pos_database.db')
+    db_pool.aplicar_perfil(conn) # WAL, synchronous, cache, etc. según el perfil activo
     cursor = conn.cursor()
 
     # Tabla Usuarios
@@ -183,6 +187,318 @@ def crear_tablas():
     conn.commit()
     conn.close()
 
+    # Índices y cambios posteriores al esquema base se aplican como migraciones versionadas
+    aplicar_migraciones('pos_database.db')
+
+# --- Resúmenes diarios de ventas ---
+def _reconstruir_resumenes_ventas(cursor, desde=None, hasta=None):
+    """Recalcula los resúmenes desde Ventas/DetallesVenta para los días en [desde, hasta) (todos si no se indican)."""
+    filtro_dia = ""
+    params = []
+    if desde:
+        filtro_dia += " AND dia >= ?"
+        params.append(desde)
+    if hasta:
+        filtro_dia += " AND dia < ?"
+        params.append(hasta)
+    filtro_venta = filtro_dia.replace("dia", "v.fecha_venta")
+    for tabla in ('ResumenVentasDiaPago', 'ResumenVentasDiaUsuario', 'ResumenVentasDiaProducto'):
+        cursor.execute(f"DELETE FROM {tabla} WHERE 1 = 1{filtro_dia}", params)
+    cursor.execute(f'''
+        INSERT INTO ResumenVentasDiaPago (dia, tipo_pago, num_ventas, total)
+        SELECT substr(v.fecha_venta, 1, 10), COALESCE(v.tipo_pago, ''), COUNT(*), SUM(v.total_venta)
+        FROM Ventas v
+        WHERE v.estado_venta = 'completada'{filtro_venta}
+        GROUP BY 1, 2
+    ''', params)
+    cursor.execute(f'''
+        INSERT INTO ResumenVentasDiaUsuario (dia, usuario_id, num_ventas, total)
+        SELECT substr(v.fecha_venta, 1, 10), v.usuario_id, COUNT(*), SUM(v.total_venta)
+        FROM Ventas v
+        WHERE v.estado_venta = 'completada'{filtro_venta}
+        GROUP BY 1, 2
+    ''', params)
+    cursor.execute(f'''
+        INSERT INTO ResumenVentasDiaProducto (dia, producto_id, num_tickets, cantidad, total)
+        SELECT substr(v.fecha_venta, 1, 10), dv.producto_id, COUNT(DISTINCT dv.venta_id), SUM(dv.cantidad), SUM(dv.subtotal_linea)
+        FROM DetallesVenta dv
+        JOIN Ventas v ON dv.venta_id = v.id
+        WHERE v.estado_venta = 'completada'{filtro_venta}
+        GROUP BY 1, 2
+    ''', params)
+
+def reconstruir_resumenes_ventas(ruta_db='pos_database.db', fecha_inicio=None, fecha_fin=None):
+    """
+    Recalcula los resúmenes diarios (carga inicial o corrección) para el rango de días indicado
+    ('YYYY-MM-DD', ambos inclusivos; todo el historial si no se indican), en una sola transacción.
+    Uso: python database_setup.py --reconstruir-resumenes [fecha_inicio fecha_fin]
+    """
+    desde = date.fromisoformat(fecha_inicio).isoformat() if fecha_inicio else None
+    hasta = (date.fromisoformat(fecha_fin) + timedelta(days=1)).isoformat() if fecha_fin else None
+    conn = sqlite3.connect(ruta_db, isolation_level=None)
+    db_pool.aplicar_perfil(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            _reconstruir_resumenes_ventas(cursor, desde, hasta)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+# --- Migraciones de esquema ---
+# CREATE ... IF NOT EXISTS no permite evolucionar bases ya instaladas, así que cada cambio posterior
+# al esquema base es una migración numerada. PRAGMA user_version guarda la última aplicada.
+# Reglas: nunca modificar una migración ya publicada (se añade una nueva), y cada migración debe
+# ser idempotente (IF NOT EXISTS) por si la base ya tenía el objeto creado a mano.
+
+def _migracion_001_indices_ventas(cursor):
+    # Reportes e historial por rango de fechas (fecha_venta >= ? AND fecha_venta < ?)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_estado_fecha ON Ventas (estado_venta, fecha_venta)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_usuario_fecha ON Ventas (usuario_id, fecha_venta)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON Ventas (fecha_venta)") # Historial sin filtro de estado
+
+def _migracion_002_indices_claves_foraneas(cursor):
+    # Joins de detalles de venta y filtro por proveedor.
+    # UsuariosPermisos.usuario_id y RolesPermisos.rol no necesitan índice propio: ya son la primera
+    # columna de los índices automáticos de sus restricciones UNIQUE (usuario_id, permiso_id) y (rol, permiso_id).
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_detallesventa_venta_id ON DetallesVenta (venta_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_detallesventa_producto_id ON DetallesVenta (producto_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_proveedor_id ON Productos (proveedor_id)")
+
+def _migracion_003_busqueda_productos_fts(cursor):
+    # Índice de texto completo (trigramas) para búsquedas por subcadena en el catálogo.
+    # Es una tabla de contenido externo: no duplica los textos, solo el índice, y se mantiene
+    # sincronizada con Productos mediante triggers. El trigger de UPDATE solo se dispara al cambiar
+    # columnas indexadas, así los descuentos de stock de cada venta no tocan el índice.
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ProductosFTS USING fts5(
+                nombre_producto, descripcion, codigo_barras,
+                content='Productos', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite sin FTS5 o anterior a 3.34 (sin tokenizador trigram): la búsqueda sigue usando LIKE.
+        # La migración queda aplicada igual; models._fts_productos_disponible crea el índice más adelante
+        # si el SQLite en uso ya lo soporta.
+        print(f"Advertencia: No se pudo crear el índice de búsqueda de productos ({e}). Se usará búsqueda simple.")
+        return
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_insert AFTER INSERT ON Productos BEGIN
+            INSERT INTO ProductosFTS (rowid, nombre_producto, descripcion, codigo_barras)
+            VALUES (new.id, new.nombre_producto, new.descripcion, new.codigo_barras);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_delete AFTER DELETE ON Productos BEGIN
+            INSERT INTO ProductosFTS (ProductosFTS, rowid, nombre_producto, descripcion, codigo_barras)
+            VALUES ('delete', old.id, old.nombre_producto, old.descripcion, old.codigo_barras);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_productos_fts_update
+        AFTER UPDATE OF nombre_producto, descripcion, codigo_barras ON Productos BEGIN
+            INSERT INTO ProductosFTS (ProductosFTS, rowid, nombre_producto, descripcion, codigo_barras)
+            VALUES ('delete', old.id, old.nombre_producto, old.descripcion, old.codigo_barras);
+            INSERT INTO ProductosFTS (rowid, nombre_producto, descripcion, codigo_barras)
+            VALUES (new.id, new.nombre_producto, new.descripcion, new.codigo_barras);
+        END
+    ''')
+    cursor.execute("INSERT INTO ProductosFTS (ProductosFTS) VALUES ('rebuild')") # Indexa el catálogo existente
+
+def _migracion_004_indice_modificacion_productos(cursor):
+    # Refresco incremental del índice en memoria del POS (productos modificados desde una marca)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_productos_fecha_modificacion ON Productos (fecha_ultima_modificacion)")
+
+def _migracion_005_movimientos_stock(cursor):
+    # Libro de movimientos de stock de solo inserción. cantidad lleva signo (+ entra, - sale) y
+    # stock_resultante es el stock del producto justo después del movimiento.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS MovimientosStock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id INTEGER NOT NULL,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            tipo TEXT NOT NULL CHECK(tipo IN ('inicial', 'entrada', 'salida', 'ajuste', 'venta', 'devolucion')),
+            cantidad INTEGER NOT NULL,
+            stock_resultante INTEGER,
+            venta_id INTEGER,
+            usuario_id INTEGER,
+            notas TEXT,
+            FOREIGN KEY (producto_id) REFERENCES Productos(id),
+            FOREIGN KEY (venta_id) REFERENCES Ventas(id),
+            FOREIGN KEY (usuario_id) REFERENCES Usuarios(id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_producto_fecha ON MovimientosStock (producto_id, fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON MovimientosStock (fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_venta_id ON MovimientosStock (venta_id)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_movimientos_stock_sin_update BEFORE UPDATE ON MovimientosStock BEGIN
+            SELECT RAISE(ABORT, 'MovimientosStock es de solo inserción');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_movimientos_stock_sin_delete BEFORE DELETE ON MovimientosStock BEGIN
+            SELECT RAISE(ABORT, 'MovimientosStock es de solo inserción');
+        END
+    ''')
+    # Fotos periódicas del stock: el stock a una fecha es la foto anterior más los movimientos posteriores
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS SnapshotsStock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha_corte TIMESTAMP NOT NULL,
+            producto_id INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            ultimo_movimiento_id INTEGER NOT NULL DEFAULT 0, -- Movimientos con id mayor no están incluidos
+            UNIQUE (fecha_corte, producto_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_producto_fecha ON SnapshotsStock (producto_id, fecha_corte)")
+    # Saldo de apertura: el historial empieza con el stock que había al aplicar la migración
+    cursor.execute('''
+        INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, notas)
+        SELECT id, 'inicial', stock_actual, stock_actual, 'Saldo al crear el registro de movimientos'
+        FROM Productos
+        WHERE stock_actual != 0 AND NOT EXISTS (SELECT 1 FROM MovimientosStock)
+    ''')
+
+def _migracion_006_resumenes_ventas_diarios(cursor):
+    # Acumulados diarios de ventas completadas para los reportes. Se mantienen al confirmar o
+    # cancelar cada venta (models._acumular_resumenes_venta); tipo_pago NULL se guarda como ''.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ResumenVentasDiaPago (
+            dia TEXT NOT NULL, -- 'YYYY-MM-DD' de fecha_venta
+            tipo_pago TEXT NOT NULL,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, tipo_pago)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ResumenVentasDiaUsuario (
+            dia TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, usuario_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ResumenVentasDiaProducto (
+            dia TEXT NOT NULL,
+            producto_id INTEGER NOT NULL,
+            num_tickets INTEGER NOT NULL DEFAULT 0, -- Ventas en las que aparece el producto
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, producto_id)
+        ) WITHOUT ROWID
+    ''')
+    _reconstruir_resumenes_ventas(cursor)
+
+# Tablas con registro de cambios para los backups incrementales (backup_manager). Quedan fuera los
+# datos derivados que se recalculan al restaurar: ProductosFTS (lo mantienen sus triggers) y los
+# resúmenes diarios de ventas.
+TABLAS_REGISTRO_CAMBIOS = [
+    'Usuarios', 'Permisos', 'RolesPermisos', 'UsuariosPermisos', 'Categorias', 'Proveedores',
+    'Productos', 'Ventas', 'DetallesVenta', 'MovimientosStock', 'SnapshotsStock',
+]
+
+def _migracion_007_registro_cambios(cursor):
+    # Cada INSERT/UPDATE/DELETE anota (tabla, id) con un número de secuencia creciente. Un backup
+    # incremental copia el estado actual de las filas anotadas después de su marca (id) y borra del
+    # registro lo que ya quedó respaldado, así la tabla solo crece entre backup y backup.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS RegistroCambios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, -- La secuencia de AUTOINCREMENT es la marca del backup
+            tabla TEXT NOT NULL,
+            fila_id INTEGER NOT NULL
+        )
+    ''')
+    for tabla in TABLAS_REGISTRO_CAMBIOS:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabla.lower()}_cambios_insert AFTER INSERT ON {tabla} BEGIN
+                INSERT INTO RegistroCambios (tabla, fila_id) VALUES ('{tabla}', new.id);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabla.lower()}_cambios_update AFTER UPDATE ON {tabla} BEGIN
+                INSERT INTO RegistroCambios (tabla, fila_id) VALUES ('{tabla}', new.id);
+                INSERT INTO RegistroCambios (tabla, fila_id) SELECT '{tabla}', old.id WHERE old.id != new.id;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabla.lower()}_cambios_delete AFTER DELETE ON {tabla} BEGIN
+                INSERT INTO RegistroCambios (tabla, fila_id) VALUES ('{tabla}', old.id);
+            END
+        ''')
+
+MIGRACIONES = [
+    (1, "Índices de Ventas por estado/usuario y fecha", _migracion_001_indices_ventas),
+    (2, "Índices de DetallesVenta y Productos.proveedor_id", _migracion_002_indices_claves_foraneas),
+    (3, "Índice de texto completo ProductosFTS (trigramas)", _migracion_003_busqueda_productos_fts),
+    (4, "Índice de Productos.fecha_ultima_modificacion", _migracion_004_indice_modificacion_productos),
+    (5, "Tablas MovimientosStock y SnapshotsStock", _migracion_005_movimientos_stock),
+    (6, "Resúmenes diarios de ventas por tipo de pago, usuario y producto", _migracion_006_resumenes_ventas_diarios),
+    (7, "Registro de cambios para backups incrementales", _migracion_007_registro_cambios),
+]
+
+def obtener_version_esquema(ruta_db='pos_database.db'):
+    conn = sqlite3.connect(ruta_db)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def aplicar_migraciones(ruta_db='pos_database.db'):
+    """
+    Aplica en orden las migraciones pendientes. Es seguro ejecutarla con la tienda en marcha:
+    - cada migración corre en su propia transacción BEGIN IMMEDIATE junto con el cambio de
+      user_version, así que o se aplica completa o no se aplica;
+    - si otra terminal está migrando a la vez, busy_timeout hace esperar y la versión se vuelve
+      a comprobar dentro del bloqueo para no aplicar dos veces el mismo paso;
+    - los pasos son cortos (un índice cada uno) para no retener el bloqueo de escritura mucho tiempo.
+    Retorna la lista de versiones aplicadas.
+    """
+    conn = sqlite3.connect(ruta_db, isolation_level=None) # Transacciones controladas manualmente
+    db_pool.aplicar_perfil(conn)
+    cursor = conn.cursor()
+    aplicadas = []
+    try:
+        for version, descripcion, migracion in MIGRACIONES:
+            if cursor.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if cursor.execute("PRAGMA user_version").fetchone()[0] >= version: # Ya la aplicó otra terminal
+                    cursor.execute("ROLLBACK")
+                    continue
+                migracion(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                print(f"Error al aplicar la migración {version} ({descripcion}). La base queda en la versión anterior.")
+                raise
+            aplicadas.append(version)
+            print(f"Migración {version} aplicada: {descripcion}")
+        if aplicadas:
+            cursor.execute("PRAGMA optimize") # Actualiza estadísticas del planificador para los índices nuevos
+    finally:
+        conn.close()
+    return aplicadas
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--reconstruir-resumenes':
+        aplicar_migraciones('pos_database.db')
+        reconstruir_resumenes_ventas('pos_database.db', *sys.argv[2:4])
+        print("Resúmenes diarios de ventas reconstruidos.")
+        sys.exit(0)
     crear_tablas()
     print("Base de datos y tablas creadas/verificadas exitosamente en 'pos_database.db'")
+    print(f"Versión de esquema: {obtener_version_esquema('pos_database.db')}")
+    config_db = db_pool.reportar_configuracion('pos_database.db')
+    print(f"Perfil de base de datos '{config_db['perfil']}': {config_db['efectivos']}")
@@ -0,0 +1,271 @@
+import sqlite3
+import threading
+import time
+import queue
+import os
+
+# Pool de conexiones SQLite reutilizables.
+# Cada función de models.py abre y cierra una conexión por operación; con este pool
+# `close()` no cierra la conexión real sino que la devuelve al pool, de modo que
+# la siguiente llamada reutiliza una conexión ya configurada (PRAGMAs aplicados una sola vez).
+
+TAMANO_MAXIMO_POOL = 8      # Conexiones simultáneas máximas (incluye las prestadas)
+TIEMPO_ESPERA_MAXIMO = 30   # Segundos que se espera una conexión libre antes de fallar
+
+
+class ConexionReutilizable(sqlite3.Connection):
+    """
+    Conexión que, al llamar a close(), vuelve al pool en lugar de cerrarse.
+    Si quedó una transacción abierta se hace rollback antes de devolverla.
+    """
+    _pool = None
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            return super().close()
+        pool.devolver(self)
+
+    def cerrar_definitivamente(self):
+        super().close()
+
+
+class PoolConexiones:
+    def __init__(self, ruta_db, tamano_maximo=TAMANO_MAXIMO_POOL, tiempo_espera_maximo=TIEMPO_ESPERA_MAXIMO):
+        self.ruta_db = ruta_db
+        self.tamano_maximo = tamano_maximo
+        self.tiempo_espera_maximo = tiempo_espera_maximo
+        self._libres = queue.LifoQueue() # LIFO: la conexión más reciente tiene la caché "caliente"
+        self._lock = threading.Lock()
+        self._creadas = 0
+        self._cerrado = False
+        # Contadores
+        self.aperturas = 0
+        self.reutilizaciones = 0
+        self.esperas = 0
+        self.tiempo_espera_total = 0.0
+
+    def _crear_conexion(self):
+        conn = sqlite3.connect(self.ruta_db, factory=ConexionReutilizable, check_same_thread=False)
+        configurar_conexion(conn)
+        conn._pool = self
+        return conn
+
+    def obtener(self):
+        try:
+            conn = self._libres.get_nowait()
+            with self._lock:
+                self.reutilizaciones += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            puede_crear = self._creadas < self.tamano_maximo
+            if puede_crear:
+                self._creadas += 1
+        if puede_crear:
+            try:
+                conn = self._crear_conexion()
+            except Exception:
+                with self._lock:
+                    self._creadas -= 1
+                raise
+            with self._lock:
+                self.aperturas += 1
+            return conn
+
+        # Pool agotado: esperar a que otra operación devuelva su conexión
+        inicio = time.perf_counter()
+        try:
+            conn = self._libres.get(timeout=self.tiempo_espera_maximo)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"No hay conexiones libres en el pool tras {self.tiempo_espera_maximo}s de espera.")
+        espera = time.perf_counter() - inicio
+        with self._lock:
+            self.esperas += 1
+            self.tiempo_espera_total += espera
+            self.reutilizaciones += 1
+        return conn
+
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row # Por si algún llamador lo cambió
+        except sqlite3.Error:
+            self._descartar(conn)
+            return
+        if self._cerrado:
+            self._descartar(conn)
+            return
+        self._libres.put(conn)
+
+    def _descartar(self, conn):
+        try:
+            conn.cerrar_definitivamente()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._creadas -= 1
+
+    def cerrar(self):
+        """Cierra las conexiones libres; las prestadas se cierran al devolverse."""
+        self._cerrado = True
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'ruta_db': self.ruta_db,
+                'aperturas': self.aperturas,
+                'reutilizaciones': self.reutilizaciones,
+                'esperas': self.esperas,
+                'tiempo_espera_total_s': round(self.tiempo_espera_total, 6),
+                'conexiones_creadas': self._creadas,
+                'conexiones_libres': self._libres.qsize(),
+                'tamano_maximo': self.tamano_maximo,
+            }
+
+
+# --- Perfiles de rendimiento (PRAGMAs) ---
+# Con journal_mode=WAL los lectores (reportes, historial) no bloquean al escritor (registrar_nueva_venta)
+# y synchronous=NORMAL evita un fsync por commit (solo se sincroniza en los checkpoints).
+# 'compatibilidad' conserva el comportamiento clásico para carpetas de red donde WAL no funciona.
+PERFILES_RENDIMIENTO = {
+    'seguro': {
+        'busy_timeout': 5000, 'journal_mode': 'WAL', 'synchronous': 'FULL',
+        'cache_size': -8000, 'mmap_size': 0, 'temp_store': 'DEFAULT',
+    },
+    'equilibrado': {
+        'busy_timeout': 5000, 'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+        'cache_size': -20000, 'mmap_size': 64 * 1024 * 1024, 'temp_store': 'MEMORY',
+    },
+    'alto_rendimiento': {
+        'busy_timeout': 10000, 'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+        'cache_size': -64000, 'mmap_size': 256 * 1024 * 1024, 'temp_store': 'MEMORY',
+    },
+    'compatibilidad': {
+        'busy_timeout': 5000, 'journal_mode': 'DELETE', 'synchronous': 'FULL',
+        'cache_size': -2000, 'mmap_size': 0, 'temp_store': 'DEFAULT',
+    },
+}
+PERFIL_POR_DEFECTO = 'equilibrado'
+# busy_timeout va primero para que el cambio de journal_mode espere si la base está ocupada.
+ORDEN_PRAGMAS = ['busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store']
+
+def _leer_ajustes_entorno():
+    """
+    Perfil elegido por instalación mediante variables de entorno:
+      POS_DB_PERFIL=alto_rendimiento
+      POS_DB_PRAGMAS="cache_size=-32000;mmap_size=0"   (ajustes individuales sobre el perfil)
+    """
+    nombre = os.environ.get('POS_DB_PERFIL', PERFIL_POR_DEFECTO).strip() or PERFIL_POR_DEFECTO
+    if nombre not in PERFILES_RENDIMIENTO:
+        print(f"Advertencia: Perfil de base de datos '{nombre}' desconocido. Se usa '{PERFIL_POR_DEFECTO}'.")
+        nombre = PERFIL_POR_DEFECTO
+    ajustes = {}
+    for par in os.environ.get('POS_DB_PRAGMAS', '').replace(',', ';').split(';'):
+        if '=' in par:
+            clave, valor = (x.strip() for x in par.split('=', 1))
+            if clave in ORDEN_PRAGMAS:
+                ajustes[clave] = valor
+            else:
+                print(f"Advertencia: PRAGMA '{clave}' no soportado en POS_DB_PRAGMAS, se ignora.")
+    return nombre, ajustes
+
+_perfil_activo = {}
+
+def _fijar_perfil(nombre, ajustes):
+    """Valida y guarda el perfil activo sin tocar las conexiones existentes."""
+    if nombre is None:
+        nombre, ajustes_entorno = _leer_ajustes_entorno()
+        ajustes = {**ajustes_entorno, **ajustes}
+    if nombre not in PERFILES_RENDIMIENTO:
+        raise ValueError(f"Perfil '{nombre}' no existe. Opciones: {', '.join(PERFILES_RENDIMIENTO)}")
+    for clave, valor in ajustes.items():
+        if clave not in ORDEN_PRAGMAS:
+            raise ValueError(f"PRAGMA '{clave}' no soportado.")
+        if not str(valor).lstrip('-').isalnum(): # Los valores se interpolan en la sentencia PRAGMA
+            raise ValueError(f"Valor inválido para PRAGMA {clave}: '{valor}'")
+    _perfil_activo.clear()
+    _perfil_activo.update({'nombre': nombre, 'pragmas': {**PERFILES_RENDIMIENTO[nombre], **ajustes}})
+
+def establecer_perfil(nombre=None, **ajustes):
+    """
+    Selecciona el perfil de PRAGMAs (y ajustes individuales opcionales).
+    Las conexiones en pool se cierran para que las nuevas usen la configuración.
+    """
+    _fijar_perfil(nombre, ajustes)
+    cerrar_pools()
+    return obtener_perfil_activo()
+
+def obtener_perfil_activo():
+    if not _perfil_activo:
+        # Primera consulta: se carga el perfil por defecto/del entorno sin cerrar los pools. Toda
+        # conexión pasa por aquí antes de configurarse, así que ninguna usa otro perfil; cerrarlos
+        # descartaría el pool que está creando justo esta conexión.
+        _fijar_perfil(None, {})
+    return {'nombre': _perfil_activo['nombre'], 'pragmas': dict(_perfil_activo['pragmas'])}
+
+def aplicar_perfil(conn):
+    """Aplica los PRAGMAs del perfil activo a una conexión recién abierta."""
+    pragmas = obtener_perfil_activo()['pragmas']
+    for clave in ORDEN_PRAGMAS:
+        if clave in pragmas and pragmas[clave] is not None:
+            conn.execute(f"PRAGMA {clave} = {pragmas[clave]}")
+
+def reportar_configuracion(ruta_db):
+    """
+    Devuelve los valores efectivos de los PRAGMAs en la base (p. ej. para mostrarlos al iniciar).
+    journal_mode puede no cambiar a WAL si el sistema de archivos no lo soporta.
+    """
+    perfil = obtener_perfil_activo()
+    conn = obtener_conexion(ruta_db)
+    try:
+        efectivos = {clave: conn.execute(f"PRAGMA {clave}").fetchone()[0] for clave in ORDEN_PRAGMAS}
+    finally:
+        conn.close()
+    return {'perfil': perfil['nombre'], 'solicitados': perfil['pragmas'], 'efectivos': efectivos}
+
+def configurar_conexion(conn):
+    """Configuración que se aplica una única vez al crear cada conexión."""
+    aplicar_perfil(conn)
+    conn.row_factory = sqlite3.Row # Para acceder a las columnas por nombre
+
+
+# --- Pools por archivo de base de datos ---
+_pools = {}
+_pools_lock = threading.Lock()
+
+def obtener_pool(ruta_db):
+    with _pools_lock:
+        pool = _pools.get(ruta_db)
+        if pool is None:
+            pool = PoolConexiones(ruta_db)
+            _pools[ruta_db] = pool
+        return pool
+
+def obtener_conexion(ruta_db):
+    return obtener_pool(ruta_db).obtener()
+
+def cerrar_pools(ruta_db=None):
+    """
+    Cierra las conexiones en pool (todas, o solo las de ruta_db).
+    Necesario antes de reemplazar el archivo de la base de datos (p. ej. tras una importación).
+    """
+    with _pools_lock:
+        rutas = [ruta_db] if ruta_db is not None else list(_pools.keys())
+        pools = [_pools.pop(r) for r in rutas if r in _pools]
+    for pool in pools:
+        pool.cerrar()
+
+def obtener_estadisticas_conexiones(ruta_db=None):
+    with _pools_lock:
+        pools = [_pools[ruta_db]] if ruta_db in _pools else ([] if ruta_db is not None else list(_pools.values()))
+    return [pool.estadisticas() for pool in pools]
@@ -1,9 +1,21 @@
+import gzip
+import io
+import lzma
+import re
 import sqlite3
 import os
+import time
 from datetime import datetime
+import db_pool
 
 DATABASE_NAME = 'pos_database.db'
 BACKUP_DIR = "backup"
+# Backup en línea (API de backup de SQLite): páginas copiadas por paso y pausa entre pasos.
+# Con páginas de 4 KB son ~1 MB por paso; la pausa deja el disco libre para las cajas.
+BACKUP_PAGINAS_POR_PASO = 256
+BACKUP_PAUSA_ENTRE_PASOS_S = 0.02
+# Restauración desde volcado SQL: texto acumulado antes de ejecutar cada bloque en la base temporal
+RESTAURACION_BYTES_POR_BLOQUE = 4 * 1024 * 1024
 
 def _ensure_backup_dir():
     if not os.path.exists(BACKUP_DIR):
@@ -24,9 +36,12 @@ def export_database_to_sql():
 
     try:
         conn = sqlite3.connect(DATABASE_NAME)
+        db_pool.aplicar_perfil(conn) # En WAL el volcado no bloquea a las cajas que están vendiendo
         with open(backup_filename, 'w', encoding='utf-8') as f:
             for line in conn.iterdump():
                 f.write('%s\n' % line)
+            # iterdump no incluye la versión del esquema; sin ella la restauración repetiría las migraciones
+            f.write('PRAGMA user_version = %d;\n' % conn.execute("PRAGMA user_version").fetchone()[0])
         conn.close()
         print(f"Base de datos exportada exitosamente a: {backup_filename}")
         return backup_filename
@@ -34,6 +49,79 @@ def export_database_to_sql():
         print(f"Error al exportar la base de datos: {e}")
         return None
 
+def copiar_base_online(conn_destino, paginas_por_paso=BACKUP_PAGINAS_POR_PASO, pausa_s=BACKUP_PAUSA_ENTRE_PASOS_S, progreso=None):
+    """
+    Copia la base de datos en conn_destino (archivo o :memory:) con la API de backup de SQLite:
+    copia `paginas_por_paso` páginas, espera `pausa_s` y sigue, así las cajas siguen vendiendo
+    mientras dura. La copia es una foto consistente del inicio del backup (se mantiene una
+    transacción de lectura; en WAL no bloquea a los escritores y el backup no se reinicia).
+    progreso: función opcional progreso(paginas_copiadas, paginas_totales).
+    Retorna el tamaño de página; los errores de SQLite se propagan.
+    """
+    origen = sqlite3.connect(DATABASE_NAME)
+    try:
+        db_pool.aplicar_perfil(origen)
+        origen.execute("BEGIN")
+        origen.execute("SELECT COUNT(*) FROM sqlite_master").fetchone() # Fija la foto de lectura
+        tamano_pagina = origen.execute("PRAGMA page_size").fetchone()[0]
+
+        def _paso(estado, restantes, totales):
+            if progreso:
+                progreso(totales - restantes, totales)
+            if restantes and pausa_s:
+                time.sleep(pausa_s)
+
+        origen.backup(conn_destino, pages=paginas_por_paso, progress=_paso)
+        origen.rollback()
+        # Mientras duró la foto de lectura el WAL no pudo volcarse; si lo hiciera el autocheckpoint,
+        # le tocaría al commit de la próxima venta (>100 ms tras una copia de pocos segundos)
+        origen.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return tamano_pagina
+    finally:
+        origen.close()
+
+def backup_database_online(destino=None, paginas_por_paso=BACKUP_PAGINAS_POR_PASO, pausa_s=BACKUP_PAUSA_ENTRE_PASOS_S, progreso=None):
+    """
+    Copia la base de datos a un archivo .db listo para abrir sin detener las ventas (ver copiar_base_online).
+    Retorna {'filepath', 'paginas', 'bytes', 'duracion_s', 'mb_por_s'} o None en caso de error.
+    """
+    if not os.path.exists(DATABASE_NAME):
+        print(f"Error: La base de datos '{DATABASE_NAME}' no existe.")
+        return None
+
+    if destino is None:
+        _ensure_backup_dir()
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        destino = os.path.join(BACKUP_DIR, f"pos_backup_{timestamp}.db")
+    temporal = destino + ".parcial" # Un backup a medias nunca queda con el nombre final
+
+    inicio = time.perf_counter()
+    conn_destino = None
+    try:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        conn_destino = sqlite3.connect(temporal)
+        tamano_pagina = copiar_base_online(conn_destino, paginas_por_paso, pausa_s, progreso)
+        # La copia hereda el modo WAL del original; en DELETE el archivo .db es autosuficiente
+        conn_destino.execute("PRAGMA journal_mode = DELETE")
+        paginas = conn_destino.execute("PRAGMA page_count").fetchone()[0]
+        conn_destino.close(); conn_destino = None
+        os.replace(temporal, destino)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error en el backup en línea de la base de datos: {e}")
+        if conn_destino is not None:
+            conn_destino.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+
+    duracion = time.perf_counter() - inicio
+    total_bytes = paginas * tamano_pagina
+    mb_por_s = total_bytes / 1e6 / duracion if duracion else 0
+    print(f"Backup en línea completado: {destino} ({paginas} páginas, {total_bytes / 1e6:.1f} MB en {duracion:.2f} s, {mb_por_s:.1f} MB/s)")
+    return {'filepath': destino, 'paginas': paginas, 'bytes': total_bytes,
+            'duracion_s': round(duracion, 3), 'mb_por_s': round(mb_por_s, 2)}
+
 if __name__ == '__main__':
     print("Probando la exportación de la base de datos...")
     filepath = export_database_to_sql()
@@ -42,52 +130,159 @@ if __name__ == '__main__':
     else:
         print("Prueba de exportación fallida.")
 
-def import_database_from_sql(sql_filepath):
+def abrir_archivo_backup(ruta):
+    """Abre un backup para lectura binaria; los .gz y .xz se descomprimen al vuelo."""
+    if ruta.endswith('.gz'):
+        return gzip.open(ruta, 'rb')
+    if ruta.endswith('.xz'):
+        return lzma.open(ruta, 'rb')
+    return open(ruta, 'rb')
+
+def _iterar_sentencias_sql(lineas):
+    """Agrupa las líneas de un volcado en sentencias completas, una a la vez (memoria constante)."""
+    sentencia = []
+    for linea in lineas:
+        sentencia.append(linea)
+        texto = ''.join(sentencia)
+        if sqlite3.complete_statement(texto):
+            sentencia = []
+            yield texto.strip()
+    if ''.join(sentencia).strip():
+        raise sqlite3.DatabaseError("El volcado termina con una sentencia incompleta")
+
+_RE_TABLA_VIRTUAL_VOLCADO = re.compile(r"VALUES\('table','([^']+)'")
+_RE_TABLA_SENTENCIA = re.compile(r"""^(?:INSERT INTO|CREATE TABLE) ["']?([^"'\s(]+)""")
+
+def _es_de_tabla_virtual(sentencia, virtuales):
+    """True si la sentencia crea o llena una tabla virtual del volcado o una de sus tablas internas (nombre_*)."""
+    coincidencia = _RE_TABLA_SENTENCIA.match(sentencia)
+    if not coincidencia:
+        return False
+    tabla = coincidencia.group(1)
+    return any(tabla == v or tabla.startswith(v + '_') for v in virtuales)
+
+def cargar_volcado_sql(sql_filepath, destino, progreso=None):
+    """
+    Carga un volcado SQL (.sql, .sql.gz o .sql.xz) en el archivo `destino`, que se crea de cero:
+    lo lee sentencia a sentencia y lo ejecuta por bloques de RESTAURACION_BYTES_POR_BLOQUE (la memoria
+    no depende del tamaño del volcado), reconstruye ProductosFTS y aplica las migraciones pendientes.
+    progreso: función opcional progreso(bytes_leidos, bytes_totales, filas).
+    Retorna (filas, sentencias); los errores se propagan.
+    """
+    import database_setup # database_setup depende de db_pool, no de este módulo
+
+    for sufijo in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(destino + sufijo):
+            os.remove(destino + sufijo)
+    bytes_totales = os.path.getsize(sql_filepath)
+    filas = sentencias = 0
+    virtuales = set()
+    conn = sqlite3.connect(destino, isolation_level=None)
+    try:
+        # Archivo desechable: sin diario ni fsync, si la carga falla se borra entero
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        with open(sql_filepath, 'rb') as crudo:
+            if sql_filepath.endswith('.gz'):
+                binario = gzip.GzipFile(fileobj=crudo)
+            elif sql_filepath.endswith('.xz'):
+                binario = lzma.LZMAFile(crudo)
+            else:
+                binario = crudo
+            bloque, tamano_bloque = [], 0
+            for sentencia in _iterar_sentencias_sql(io.TextIOWrapper(binario, encoding='utf-8')):
+                if sentencia.upper() in ('BEGIN TRANSACTION;', 'BEGIN;', 'COMMIT;', 'END TRANSACTION;'):
+                    continue # Las transacciones del volcado se sustituyen por las de cada bloque
+                inicio_sentencia = sentencia[:32].upper()
+                if inicio_sentencia.startswith('PRAGMA WRITABLE_SCHEMA'):
+                    continue
+                if inicio_sentencia.startswith('INSERT INTO SQLITE_MASTER'):
+                    # iterdump vuelca las tablas virtuales (FTS5) escribiendo en sqlite_master y en sus
+                    # tablas internas, algo que no se puede reproducir en la misma conexión. Son índices
+                    # derivados: se omiten y se reconstruyen al final desde las tablas de datos.
+                    coincidencia = _RE_TABLA_VIRTUAL_VOLCADO.search(sentencia)
+                    if coincidencia:
+                        virtuales.add(coincidencia.group(1))
+                    continue
+                if virtuales and _es_de_tabla_virtual(sentencia, virtuales):
+                    continue
+                bloque.append(sentencia)
+                tamano_bloque += len(sentencia)
+                sentencias += 1
+                if sentencia[:6].upper() == 'INSERT':
+                    filas += 1
+                if tamano_bloque >= RESTAURACION_BYTES_POR_BLOQUE:
+                    conn.executescript("BEGIN;\n" + "\n".join(bloque) + "\nCOMMIT;")
+                    bloque, tamano_bloque = [], 0
+                    if progreso:
+                        progreso(crudo.tell(), bytes_totales, filas)
+            if bloque:
+                conn.executescript("BEGIN;\n" + "\n".join(bloque) + "\nCOMMIT;")
+        if progreso:
+            progreso(bytes_totales, bytes_totales, filas)
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Usuarios'").fetchone():
+            raise sqlite3.DatabaseError("El volcado no contiene una base de datos del sistema (falta la tabla Usuarios)")
+        for tabla in virtuales:
+            if tabla == 'ProductosFTS':
+                cursor = conn.cursor()
+                cursor.execute("BEGIN")
+                database_setup._migracion_003_busqueda_productos_fts(cursor) # Crea la tabla y reindexa el catálogo
+                cursor.execute("COMMIT")
+            else:
+                print(f"Advertencia: Se omitió la tabla virtual '{tabla}' del volcado.")
+    finally:
+        conn.close()
+
+    database_setup.aplicar_migraciones(destino) # Volcados de versiones anteriores del esquema
+    return filas, sentencias
+
+def import_database_from_sql(sql_filepath, progreso=None):
     """
-    Importa datos desde un archivo SQL a la base de datos actual.
-    ADVERTENCIA: Esta operación puede ser destructiva y reemplazar datos existentes.
-    Se recomienda hacer un backup antes.
-    Retorna True si la importación fue exitosa, False en caso de error.
+    Restaura la base de datos desde un volcado SQL (.sql, .sql.gz o .sql.xz) sin riesgo para la actual:
+    1. carga el volcado en un archivo temporal (cargar_volcado_sql, memoria constante);
+    2. verifica la copia con PRAGMA integrity_check;
+    3. la copia sobre la base en uso con la API de backup de SQLite en una sola transacción de
+       escritura: las demás conexiones ven la base anterior o la nueva, nunca una mezcla.
+    Si algo falla antes del paso 3, la base en uso queda intacta.
+    progreso: función opcional progreso(bytes_leidos, bytes_totales, filas).
+    Retorna {'filas', 'sentencias', 'duracion_s', 'filas_por_s'} o None en caso de error.
     """
     if not os.path.exists(sql_filepath):
         print(f"Error: El archivo SQL '{sql_filepath}' no existe.")
-        return False
-
-    # Opcional: Hacer un backup automático antes de importar
-    # backup_path_auto = export_database_to_sql()
-    # if not backup_path_auto:
-    #     print("Error: No se pudo crear el backup automático antes de la importación. Operación cancelada.")
-    #     return False
-    # print(f"Backup automático creado en: {backup_path_auto}")
+        return None
 
+    temporal = DATABASE_NAME + ".restaurando"
+    inicio = time.perf_counter()
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        with open(sql_filepath, 'r', encoding='utf-8') as f:
-            sql_script = f.read()
-            # SQLite3 puede ejecutar múltiples sentencias con executescript
-            # Sin embargo, iterdump() genera COMMITs. Si el script de importación
-            # ya tiene BEGIN TRANSACTION / COMMIT, podríamos tener problemas con executescript anidando transacciones.
-            # Una forma más segura podría ser cerrar la conexión actual, renombrar/borrar la DB
-            # y recrearla desde el script. Pero para una importación simple, executescript suele funcionar.
-            # Por ahora, asumimos que el script SQL es un volcado estándar.
-
-            # Para una restauración más limpia, podríamos borrar las tablas existentes primero,
-            # pero esto debe hacerse con mucho cuidado y usualmente el script de dump
-            # ya incluye sentencias DROP TABLE IF EXISTS.
-
-            cursor.executescript(sql_script)
-        conn.commit() # Asegurar que todos los cambios de executescript se guarden
-        conn.close()
-        print(f"Base de datos importada exitosamente desde: {sql_filepath}")
-        return True
-    except sqlite3.Error as e:
-        print(f"Error al importar la base de datos desde SQL: {e}")
-        # Considerar restaurar el backup automático si se implementó y la importación falló.
-        return False
-    except Exception as e:
-        print(f"Error inesperado durante la importación: {e}")
-        return False
+        filas, sentencias = cargar_volcado_sql(sql_filepath, temporal, progreso)
+
+        conn = sqlite3.connect(temporal)
+        try:
+            resultado = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if resultado != 'ok':
+                raise sqlite3.DatabaseError(f"La base restaurada no pasó integrity_check: {resultado}")
+            destino = sqlite3.connect(DATABASE_NAME)
+            try:
+                db_pool.aplicar_perfil(destino)
+                conn.backup(destino) # Una sola transacción de escritura sobre la base en uso
+            finally:
+                destino.close()
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError, UnicodeDecodeError, EOFError, lzma.LZMAError) as e:
+        print(f"Error al importar la base de datos desde SQL: {e}. La base de datos actual no se modificó.")
+        return None
+    finally:
+        for sufijo in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(temporal + sufijo):
+                os.remove(temporal + sufijo)
+
+    db_pool.cerrar_pools(DATABASE_NAME) # Las conexiones nuevas arrancan sin estado de la base anterior
+    duracion = time.perf_counter() - inicio
+    filas_por_s = filas / duracion if duracion > 0 else 0
+    print(f"Base de datos importada exitosamente desde: {sql_filepath} "
+          f"({filas} filas, {sentencias} sentencias en {duracion:.2f} s, {filas_por_s:.0f} filas/s)")
+    return {'filas': filas, 'sentencias': sentencias, 'duracion_s': round(duracion, 3), 'filas_por_s': round(filas_por_s)}
 
 if __name__ == '__main__':
     print("Probando la exportación de la base de datos...")
@@ -0,0 +1,381 @@
+import functools
+import sqlite3
+import time
+import openpyxl
+import models
+
+# Motor de importación masiva de productos desde Excel.
+# Antes cada fila llamaba a listar_categorias()/listar_proveedores() y buscaba con un recorrido lineal,
+# abría conexiones aparte para buscar por ID o código de barras y confirmaba cada alta o cambio por
+# separado. Aquí el libro se lee en modo read_only (fila a fila, sin cargarlo entero), las categorías,
+# proveedores y los IDs/códigos de barras existentes se cargan una vez en diccionarios, y las filas
+# se escriben en lotes: un executemany de altas y otro de cambios por transacción. Entre lote y lote
+# se suelta el bloqueo de escritura, así las cajas pueden seguir vendiendo durante una importación larga.
+# Una celda vacía deja el valor actual del producto sin cambios (una lista de precios del proveedor
+# no pone a cero el stock ni borra la descripción).
+# Cada fila se compara con una copia en memoria de Productos: solo se escriben las altas y las filas
+# con algún valor distinto (y solo sus columnas distintas), así reimportar un archivo casi igual toca
+# unos cientos de filas. Con simular=True se obtiene esa misma comparación sin escribir nada.
+
+TAMANO_LOTE_IMPORTACION = 1000 # Filas por transacción
+
+# Cabecera del Excel -> (columna de Productos, conversión)
+COLUMNAS_NUMERICAS_EXCEL = {
+    'Precio Compra': ('precio_compra', float),
+    'Precio Venta': ('precio_venta_menudeo', float),
+    'Precio Mayoreo': ('precio_venta_mayoreo', float),
+    'Cant. Mayoreo': ('cantidad_para_mayoreo', int),
+    'Stock Actual': ('stock_actual', int),
+    'Stock Mínimo': ('stock_minimo', int),
+}
+COLUMNAS_TEXTO_EXCEL = {
+    'Nombre Producto': 'nombre_producto',
+    'Código Barras': 'codigo_barras',
+    'Descripción': 'descripcion',
+    'Unidad Medida': 'unidad_medida',
+}
+CABECERAS_MINIMAS_EXCEL = ['Nombre Producto', 'Código Barras', 'Precio Venta']
+VALORES_ACTIVO = ('sí', 'si', 'true', '1', 'yes')
+
+COLUMNAS_IMPORTACION = ('codigo_barras', 'nombre_producto', 'descripcion', 'categoria_id', 'proveedor_id',
+                        'precio_compra', 'precio_venta_menudeo', 'precio_venta_mayoreo', 'cantidad_para_mayoreo',
+                        'stock_actual', 'stock_minimo', 'unidad_medida', 'activo')
+VALORES_POR_DEFECTO_ALTA = {'precio_compra': 0, 'stock_actual': 0, 'stock_minimo': 0, 'unidad_medida': 'unidad', 'activo': True}
+
+_SQL_ALTA = f'''
+    INSERT INTO Productos ({', '.join(COLUMNAS_IMPORTACION)}, fecha_ultima_modificacion)
+    VALUES ({', '.join('?' for _ in COLUMNAS_IMPORTACION)}, CURRENT_TIMESTAMP)
+'''
+# None en un parámetro = conservar el valor actual
+_SQL_CAMBIO = f'''
+    UPDATE Productos SET {', '.join(f'{c} = COALESCE(?, {c})' for c in COLUMNAS_IMPORTACION)},
+        fecha_ultima_modificacion = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+
+def _texto_celda(valor):
+    """Texto de una celda: los códigos numéricos que Excel guarda como 7501234.0 vuelven a '7501234'."""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor).strip()
+    return texto or None
+
+def leer_filas_excel(ruta_excel):
+    """
+    Lee la hoja activa en modo read_only (memoria constante) y produce (número de fila, dict cabecera -> valor)
+    sin las celdas vacías. Lanza ValueError si faltan las cabeceras mínimas.
+    """
+    libro = openpyxl.load_workbook(ruta_excel, read_only=True, data_only=True)
+    try:
+        hoja = libro.active
+        filas = hoja.iter_rows(values_only=True)
+        cabeceras = [str(c).strip() if c is not None else None for c in next(filas, ())]
+        if not all(h in cabeceras for h in CABECERAS_MINIMAS_EXCEL):
+            raise ValueError(f"Cabeceras faltantes o incorrectas. Se esperan al menos: {', '.join(CABECERAS_MINIMAS_EXCEL)}")
+        for numero_fila, fila in enumerate(filas, start=2):
+            datos = {c: v for c, v in zip(cabeceras, fila) if c is not None and v is not None and v != ''}
+            if datos:
+                yield numero_fila, datos
+    finally:
+        libro.close()
+
+def contar_filas_excel(ruta_excel):
+    """Filas de datos según la dimensión guardada en el archivo (None si el archivo no la indica)."""
+    libro = openpyxl.load_workbook(ruta_excel, read_only=True)
+    try:
+        maximo = libro.active.max_row
+        return maximo - 1 if maximo else None
+    finally:
+        libro.close()
+
+
+class ImportadorProductos:
+    def __init__(self, usuario_id=None, tamano_lote=TAMANO_LOTE_IMPORTACION, simular=False):
+        self.usuario_id = usuario_id
+        self.tamano_lote = tamano_lote
+        self.simular = simular # Solo calcular la comparación, sin escribir
+        self.categorias = {}  # nombre en minúsculas -> id
+        self.proveedores = {}
+        self.actuales = {}    # id -> dict de COLUMNAS_IMPORTACION: copia de Productos (activos o no)
+        self.id_por_codigo = {}
+        self.detalles = []
+        self.creados = 0
+        self.actualizados = 0
+        self.sin_cambios = 0
+        self.errores = 0
+        self.filas_leidas = 0
+        self._ultimo_id_simulado = 0 # Las altas simuladas reciben IDs negativos
+
+    def cargar_mapas(self, cursor):
+        """Carga una vez las categorías, proveedores y la copia en memoria de Productos."""
+        cursor.execute("SELECT id, nombre_categoria FROM Categorias")
+        self.categorias = {nombre.lower(): id_ for id_, nombre in cursor.fetchall()}
+        cursor.execute("SELECT id, nombre_proveedor FROM Proveedores")
+        self.proveedores = {nombre.lower(): id_ for id_, nombre in cursor.fetchall()}
+        cursor.execute(f"SELECT id, {', '.join(COLUMNAS_IMPORTACION)} FROM Productos")
+        self.actuales = {fila[0]: dict(zip(COLUMNAS_IMPORTACION, fila[1:])) for fila in cursor.fetchall()}
+        self.id_por_codigo = {p['codigo_barras']: id_ for id_, p in self.actuales.items() if p['codigo_barras'] is not None}
+
+    def diferencias(self, producto_id, valores):
+        """Columnas que la fila cambiaría en el producto: {columna: (valor actual, valor nuevo)}."""
+        actual = self.actuales[producto_id]
+        cambios = {}
+        for columna, nuevo in valores.items():
+            anterior = actual[columna]
+            if columna == 'activo':
+                distinto = bool(anterior) != bool(nuevo)
+            elif isinstance(nuevo, (int, float)) and isinstance(anterior, (int, float)):
+                distinto = anterior != nuevo
+            else:
+                distinto = anterior is None or str(anterior) != str(nuevo)
+            if distinto:
+                cambios[columna] = (anterior, nuevo)
+        return cambios
+
+    def preparar_fila(self, datos):
+        """
+        Valida y convierte una fila (dict cabecera -> valor) sin tocar la base de datos.
+        Retorna (producto_id o None si es alta, dict columna -> valor solo con las celdas presentes)
+        o lanza ValueError con el mensaje para el usuario.
+        """
+        nombre = _texto_celda(datos['Nombre Producto']) if 'Nombre Producto' in datos else None
+        if not nombre:
+            raise ValueError('Falta Nombre Producto')
+        valores = {}
+        for cabecera, columna in COLUMNAS_TEXTO_EXCEL.items():
+            if cabecera in datos:
+                valores[columna] = _texto_celda(datos[cabecera])
+        try:
+            for cabecera, (columna, convertir) in COLUMNAS_NUMERICAS_EXCEL.items():
+                if cabecera in datos:
+                    valores[columna] = convertir(datos[cabecera])
+        except (TypeError, ValueError):
+            raise ValueError(f"Error de formato numérico en precios o stock para '{nombre}'")
+        # Categoría y proveedor por nombre; si no existen se ignoran (no se crean)
+        if 'Categoría' in datos and str(datos['Categoría']).strip().lower() in self.categorias:
+            valores['categoria_id'] = self.categorias[str(datos['Categoría']).strip().lower()]
+        if 'Proveedor' in datos and str(datos['Proveedor']).strip().lower() in self.proveedores:
+            valores['proveedor_id'] = self.proveedores[str(datos['Proveedor']).strip().lower()]
+        if 'Activo' in datos:
+            valores['activo'] = str(datos['Activo']).strip().lower() in VALORES_ACTIVO
+        valores = {c: v for c, v in valores.items() if v is not None}
+
+        # Producto existente: primero por ID (activo o no), después por código de barras
+        producto_id = None
+        if 'ID' in datos:
+            try:
+                producto_id = int(datos['ID'])
+            except (TypeError, ValueError):
+                raise ValueError(f"ID '{datos['ID']}' inválido para producto '{nombre}'")
+            if producto_id not in self.actuales:
+                producto_id = None
+        codigo = valores.get('codigo_barras')
+        if producto_id is None and codigo:
+            producto_id = self.id_por_codigo.get(codigo)
+
+        if producto_id is None and not valores.get('precio_venta_menudeo'):
+            raise ValueError(f"Precio Venta Menudeo requerido para nuevo producto '{nombre}'")
+        if codigo and self.id_por_codigo.get(codigo, producto_id) != producto_id:
+            raise ValueError(f"El código de barras '{codigo}' ya pertenece a otro producto")
+        return producto_id, valores
+
+    def procesar(self, filas, progreso=None, total_filas=None):
+        """
+        Importa filas (número de fila, dict cabecera -> valor) en lotes de tamano_lote.
+        progreso: función opcional progreso(filas_leidas, total_filas) llamada cada tamano_lote filas.
+        Retorna el resumen {'creados', 'actualizados', 'sin_cambios', 'errores', 'simulacion', 'detalles': [...]};
+        cada detalle de una actualización incluye 'cambios': {columna: (valor actual, valor nuevo)}.
+        """
+        inicio = time.perf_counter()
+        conn = models.get_db_connection()
+        try:
+            self.cargar_mapas(conn.cursor())
+            altas, cambios = [], []
+            # Productos y códigos de barras con escrituras pendientes en el lote: la copia en memoria solo
+            # se actualiza al confirmar, así que una fila que los vuelva a tocar confirma antes el lote
+            ids_lote, codigos_lote = set(), set()
+            for numero_fila, datos in filas:
+                self.filas_leidas += 1
+                if progreso and self.filas_leidas % self.tamano_lote == 0:
+                    progreso(self.filas_leidas, total_filas)
+                nombre = datos.get('Nombre Producto', 'N/A')
+                if 'Código Barras' in datos and _texto_celda(datos['Código Barras']) in codigos_lote:
+                    self._confirmar_lote(conn, altas, cambios)
+                    altas, cambios, ids_lote, codigos_lote = [], [], set(), set()
+                try:
+                    producto_id, valores = self.preparar_fila(datos)
+                except ValueError as e:
+                    self._anotar(numero_fila, nombre, 'error', str(e))
+                    continue
+                if producto_id in ids_lote:
+                    self._confirmar_lote(conn, altas, cambios)
+                    altas, cambios, ids_lote, codigos_lote = [], [], set(), set()
+                codigo = valores.get('codigo_barras')
+
+                if producto_id is None:
+                    if self.simular:
+                        self._ultimo_id_simulado -= 1
+                        self._registrar_alta(valores, self._ultimo_id_simulado)
+                        self._anotar(numero_fila, nombre, 'creado', 'Se creará')
+                        continue
+                    altas.append((numero_fila, nombre, valores))
+                    if codigo:
+                        codigos_lote.add(codigo)
+                else:
+                    diferencias = self.diferencias(producto_id, valores)
+                    if not diferencias:
+                        self._anotar(numero_fila, nombre, 'sin_cambios', 'Sin cambios', producto_id)
+                        continue
+                    if self.simular:
+                        self._aplicar_cambio(producto_id, diferencias)
+                        self._anotar(numero_fila, nombre, 'actualizado', "Cambiará: " + ", ".join(diferencias),
+                                     producto_id if producto_id > 0 else None, diferencias)
+                        continue
+                    cambios.append((numero_fila, nombre, {c: nuevo for c, (_, nuevo) in diferencias.items()}, producto_id, diferencias))
+                    ids_lote.add(producto_id)
+                    if 'codigo_barras' in diferencias:
+                        codigos_lote.update(c for c in diferencias['codigo_barras'] if c)
+                if len(altas) + len(cambios) >= self.tamano_lote:
+                    self._confirmar_lote(conn, altas, cambios)
+                    altas, cambios, ids_lote, codigos_lote = [], [], set(), set()
+            self._confirmar_lote(conn, altas, cambios)
+        finally:
+            conn.close()
+        if (self.creados or self.actualizados) and not self.simular:
+            models._marcar_indice_productos_pendiente()
+        if progreso:
+            progreso(self.filas_leidas, total_filas)
+
+        duracion = time.perf_counter() - inicio
+        print(f"{'Vista previa de importación' if self.simular else 'Importación'} de productos: {self.filas_leidas} filas "
+              f"en {duracion:.2f} s ({self.filas_leidas / duracion if duracion else 0:.0f} filas/s). "
+              f"Creados: {self.creados}, Actualizados: {self.actualizados}, Sin cambios: {self.sin_cambios}, Errores: {self.errores}")
+        return {'creados': self.creados, 'actualizados': self.actualizados, 'sin_cambios': self.sin_cambios,
+                'errores': self.errores, 'simulacion': self.simular, 'detalles': self.detalles}
+
+    def _anotar(self, numero_fila, nombre, status, mensaje, producto_id=None, cambios=None):
+        detalle = {"fila": numero_fila, "nombre_original": nombre, "status": status, "mensaje": mensaje, "id": producto_id}
+        if cambios:
+            detalle["cambios"] = cambios
+        self.detalles.append(detalle)
+        if status == 'creado':
+            self.creados += 1
+        elif status == 'actualizado':
+            self.actualizados += 1
+        elif status == 'sin_cambios':
+            self.sin_cambios += 1
+        else:
+            self.errores += 1
+
+    def _confirmar_lote(self, conn, altas, cambios):
+        """Escribe un lote en una transacción; si algo falla, lo repite fila a fila para aislar las que fallan."""
+        if not altas and not cambios:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            nuevos_ids = self._escribir(cursor, altas, cambios)
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Error en lote de importación, se reintenta fila a fila: {e}")
+            self._confirmar_fila_a_fila(conn, altas, cambios)
+            return
+        for (numero_fila, nombre, valores), producto_id in zip(altas, nuevos_ids):
+            self._registrar_alta(valores, producto_id)
+            self._anotar(numero_fila, nombre, 'creado', 'Creado correctamente', producto_id)
+        for numero_fila, nombre, _, producto_id, diferencias in cambios:
+            self._aplicar_cambio(producto_id, diferencias)
+            self._anotar(numero_fila, nombre, 'actualizado', 'Actualizado correctamente', producto_id, diferencias)
+
+    def _confirmar_fila_a_fila(self, conn, altas, cambios):
+        # Como en _confirmar_lote, la copia en memoria y el resumen se actualizan solo tras el commit
+        resultados = [] # (argumentos de _anotar, cambio para la copia en memoria o None), en orden de fila
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        for alta in altas:
+            cursor.execute("SAVEPOINT fila")
+            try:
+                producto_id = self._escribir(cursor, [alta], [])[0]
+                resultados.append(((alta[0], alta[1], 'creado', 'Creado correctamente', producto_id),
+                                   functools.partial(self._registrar_alta, alta[2], producto_id)))
+            except sqlite3.Error as e:
+                cursor.execute("ROLLBACK TO fila")
+                resultados.append(((alta[0], alta[1], 'error', f"Error al crear (posiblemente código de barras ya existe o datos faltantes): {e}"), None))
+            cursor.execute("RELEASE fila")
+        for cambio in cambios:
+            cursor.execute("SAVEPOINT fila")
+            try:
+                self._escribir(cursor, [], [cambio])
+                resultados.append(((cambio[0], cambio[1], 'actualizado', 'Actualizado correctamente', cambio[3], cambio[4]),
+                                   functools.partial(self._aplicar_cambio, cambio[3], cambio[4])))
+            except sqlite3.Error as e:
+                cursor.execute("ROLLBACK TO fila")
+                resultados.append(((cambio[0], cambio[1], 'error', f"Error al actualizar (posiblemente código de barras duplicado con otro producto): {e}", cambio[3]), None))
+            cursor.execute("RELEASE fila")
+        conn.commit()
+        for anotacion, aplicar in resultados:
+            if aplicar is not None:
+                aplicar()
+            self._anotar(*anotacion)
+
+    def _aplicar_cambio(self, producto_id, diferencias):
+        """Lleva a la copia en memoria un cambio ya escrito (o simulado)."""
+        if 'codigo_barras' in diferencias:
+            anterior, nuevo = diferencias['codigo_barras']
+            if self.id_por_codigo.get(anterior) == producto_id:
+                del self.id_por_codigo[anterior]
+            if nuevo:
+                self.id_por_codigo[nuevo] = producto_id
+        self.actuales[producto_id].update((c, nuevo) for c, (_, nuevo) in diferencias.items())
+
+    def _registrar_alta(self, valores, producto_id):
+        self.actuales[producto_id] = {c: valores.get(c, VALORES_POR_DEFECTO_ALTA.get(c)) for c in COLUMNAS_IMPORTACION}
+        codigo = valores.get('codigo_barras')
+        if codigo:
+            self.id_por_codigo[codigo] = producto_id
+
+    def _escribir(self, cursor, altas, cambios):
+        """Sentencias del lote dentro de la transacción del llamador. Retorna los IDs de las altas, en orden."""
+        nuevos_ids = []
+        if altas:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM Productos")
+            ultimo_id = cursor.fetchone()[0]
+            cursor.executemany(_SQL_ALTA, [
+                tuple(valores.get(c, VALORES_POR_DEFECTO_ALTA.get(c)) for c in COLUMNAS_IMPORTACION)
+                for _, _, valores in altas])
+            # Con el bloqueo de escritura tomado, los IDs mayores que el último son las altas de este lote, en orden
+            cursor.execute("SELECT id FROM Productos WHERE id > ? ORDER BY id", (ultimo_id,))
+            nuevos_ids = [fila[0] for fila in cursor.fetchall()]
+            cursor.execute('''
+                INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, usuario_id, notas)
+                SELECT id, 'inicial', stock_actual, stock_actual, ?, 'Stock al importar el producto'
+                FROM Productos WHERE id > ? AND stock_actual != 0
+            ''', (self.usuario_id, ultimo_id))
+        if cambios:
+            # El stock fijado por el archivo queda en el libro como ajuste (igual que actualizar_producto)
+            ajustes = [(v['stock_actual'], v['stock_actual'], self.usuario_id, producto_id, v['stock_actual'])
+                       for _, _, v, producto_id, _ in cambios if 'stock_actual' in v]
+            if ajustes:
+                cursor.executemany('''
+                    INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, usuario_id, notas)
+                    SELECT id, 'ajuste', ? - stock_actual, ?, ?, 'Stock fijado por importación'
+                    FROM Productos WHERE id = ? AND stock_actual != ?
+                ''', ajustes)
+            cursor.executemany(_SQL_CAMBIO, [
+                tuple(valores.get(c) for c in COLUMNAS_IMPORTACION) + (producto_id,)
+                for _, _, valores, producto_id, _ in cambios])
+        return nuevos_ids
+
+
+def importar_productos_excel(ruta_excel, usuario_id=None, progreso=None, simular=False, tamano_lote=TAMANO_LOTE_IMPORTACION):
+    """
+    Importa (crea o actualiza) los productos de un archivo Excel; con simular=True solo calcula qué se
+    crearía, qué columnas cambiarían y qué filas fallan, sin escribir.
+    Retorna el resumen de ImportadorProductos.procesar; lanza ValueError si faltan cabeceras.
+    """
+    total = contar_filas_excel(ruta_excel) if progreso else None
+    importador = ImportadorProductos(usuario_id, tamano_lote, simular=simular)
+    return importador.procesar(leer_filas_excel(ruta_excel), progreso=progreso, total_filas=total)
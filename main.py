@@ -2,6 +2,10 @@ import flet as ft
 import controllers
 import models
 import report_generator
+import db_pool
+import database_setup
+import escritor_ventas
+import programador_backups
 from datetime import datetime, timedelta
 import os # Import faltante añadido
 
@@ -146,7 +150,7 @@ def create_dashboard_view(page: ft.Page, view_manager):
                 if user_role == "administrador": content_to_load = create_admin_users_view(page, view_manager)
                 else: content_to_load = ft.Column([ft.Icon(ft.icons.LOCK_OUTLINE, size=48, color=APP_ERROR_COLOR), ft.Text("Acceso Denegado", size=24, color=APP_ERROR_COLOR)], horizontal_alignment=ft.CrossAxisAlignment.CENTER, alignment=ft.MainAxisAlignment.CENTER, expand=True)
             elif selected_label == "Inventario":
-                if models.tiene_permiso(user_id,'ver_inventario')or models.tiene_permiso(user_id,'gestionar_inventario'): content_to_load = create_inventory_main_view(page, view_manager)
+                if models.tiene_algun_permiso(user_id,'ver_inventario','gestionar_inventario'): content_to_load = create_inventory_main_view(page, view_manager)
                 else: content_to_load = ft.Column([ft.Icon(ft.icons.LOCK_OUTLINE,size=48,color=APP_ERROR_COLOR),ft.Text("Acceso Denegado",size=24,color=APP_ERROR_COLOR)],horizontal_alignment=ft.CrossAxisAlignment.CENTER,alignment=ft.MainAxisAlignment.CENTER,expand=True)
             elif selected_label == "Ventas":
                 if models.tiene_permiso(user_id,'realizar_ventas'): content_to_load = create_pos_view(page, view_manager)
@@ -257,7 +261,7 @@ def create_admin_users_view(page: ft.Page, view_manager):
 def create_inventory_main_view(page: ft.Page, view_manager):
     # ... (código de create_inventory_main_view sin cambios significativos, usa close_dialog_global) ...
     inventory_tab_content_area = ft.Ref[ft.Container](); current_user_id = page.session.get("user_id")
-    can_manage_inventory=models.tiene_permiso(current_user_id,'gestionar_inventario'); can_manage_categories=models.tiene_permiso(current_user_id,'gestionar_categorias')or can_manage_inventory; can_manage_providers=models.tiene_permiso(current_user_id,'gestionar_proveedores')or can_manage_inventory; can_adjust_stock=models.tiene_permiso(current_user_id,'ajustar_stock')or can_manage_inventory; can_see_purchase_price=models.tiene_permiso(current_user_id,'ver_precio_compra')or can_manage_inventory
+    can_manage_inventory=models.tiene_permiso(current_user_id,'gestionar_inventario'); can_manage_categories=models.tiene_algun_permiso(current_user_id,'gestionar_categorias','gestionar_inventario'); can_manage_providers=models.tiene_algun_permiso(current_user_id,'gestionar_proveedores','gestionar_inventario'); can_adjust_stock=models.tiene_algun_permiso(current_user_id,'ajustar_stock','gestionar_inventario'); can_see_purchase_price=models.tiene_algun_permiso(current_user_id,'ver_precio_compra','gestionar_inventario')
     def get_products_view():
         products_datatable_ref=ft.Ref[ft.DataTable]();prod_search_field_ref=ft.Ref[ft.TextField]();_prod_dialog_title_ref=ft.Ref[ft.Text]();_prod_name_ref=ft.Ref[ft.TextField]();_prod_code_ref=ft.Ref[ft.TextField]();_prod_desc_ref=ft.Ref[ft.TextField]();_prod_cat_dd_ref=ft.Ref[ft.Dropdown]();_prod_prov_dd_ref=ft.Ref[ft.Dropdown]();_prod_pcompra_ref=ft.Ref[ft.TextField]();_prod_pmenudeo_ref=ft.Ref[ft.TextField]();_prod_pmayoreo_ref=ft.Ref[ft.TextField]();_prod_cantmayoreo_ref=ft.Ref[ft.TextField]();_prod_stock_ref=ft.Ref[ft.TextField]();_prod_stockmin_ref=ft.Ref[ft.TextField]();_prod_unidad_ref=ft.Ref[ft.TextField]();_prod_error_ref=ft.Ref[ft.Text]();_current_edit_prod_id_holder={"id":None};cat_options_prod_dialog=[];prov_options_prod_dialog=[]
         def load_products_table(search_term=None):
@@ -390,6 +394,7 @@ def create_inventory_main_view(page: ft.Page, view_manager):
 def create_pos_view(page: ft.Page, view_manager):
     # ... (código de create_pos_view sin cambios significativos, usa close_dialog_global) ...
     current_user_id = page.session.get("user_id")
+    models.refrescar_indice_productos() # Primera apertura: carga el índice de códigos de barras en memoria
     carrito_items_ref = ft.Ref[ft.Column](); carrito_data = []
     total_venta_ref = ft.Ref[ft.Text](); cambio_ref = ft.Ref[ft.Text]()
     monto_recibido_field_ref = ft.Ref[ft.TextField](); cliente_nombre_field_ref = ft.Ref[ft.TextField]()
@@ -407,21 +412,15 @@ def create_pos_view(page: ft.Page, view_manager):
             actualizar_total_carrito(); carrito_items_ref.current.update()
     def anadir_producto_al_carrito(producto_data, cantidad_a_anadir=1):
         if not producto_data or cantidad_a_anadir <= 0: return
-        for item in carrito_data:
-            if item['producto_id'] == producto_data['id']: item['cantidad'] += cantidad_a_anadir; item['subtotal'] = item['cantidad'] * item['precio_unitario_actual']; actualizar_vista_carrito(); return
-        precio_venta = producto_data['precio_venta_menudeo']
-        if producto_data.get('cantidad_para_mayoreo') and cantidad_a_anadir >= producto_data['cantidad_para_mayoreo'] and producto_data.get('precio_venta_mayoreo') is not None: precio_venta = producto_data['precio_venta_mayoreo']
-        carrito_data.append({'producto_id':producto_data['id'],'nombre_producto':producto_data['nombre_producto'],'cantidad':cantidad_a_anadir,'precio_unitario_actual':precio_venta,'subtotal':cantidad_a_anadir*precio_venta,'stock_disponible_inicial':producto_data['stock_actual']})
+        controllers.agregar_al_carrito(carrito_data, producto_data, cantidad_a_anadir) # Recalcula menudeo/mayoreo con la cantidad acumulada
         actualizar_vista_carrito()
     def modificar_cantidad_carrito(index_carrito, delta_cantidad):
-        item=carrito_data[index_carrito]; nueva_cantidad=item['cantidad']+delta_cantidad
-        if nueva_cantidad <=0: eliminar_item_carrito(index_carrito); return
-        item['cantidad']=nueva_cantidad; producto_db_info=models.obtener_producto_por_id(item['producto_id'])
-        if producto_db_info:
-            precio_actualizado=producto_db_info['precio_venta_menudeo']
-            if producto_db_info.get('cantidad_para_mayoreo')and nueva_cantidad>=producto_db_info['cantidad_para_mayoreo']and producto_db_info.get('precio_venta_mayoreo')is not None: precio_actualizado=producto_db_info['precio_venta_mayoreo']
-            item['precio_unitario_actual']=precio_actualizado
-        item['subtotal']=item['cantidad']*item['precio_unitario_actual']; actualizar_vista_carrito()
+        item=carrito_data[index_carrito]
+        if item['cantidad']+delta_cantidad <=0: eliminar_item_carrito(index_carrito); return
+        producto_db_info=models.obtener_producto_indexado_por_id(item['producto_id'])
+        if producto_db_info: controllers.agregar_al_carrito(carrito_data, producto_db_info, delta_cantidad)
+        else: item['cantidad']+=delta_cantidad; item['subtotal']=item['cantidad']*item['precio_unitario_actual']
+        actualizar_vista_carrito()
     def eliminar_item_carrito(index_carrito):
         if 0<=index_carrito<len(carrito_data): del carrito_data[index_carrito]; actualizar_vista_carrito()
     def buscar_producto_pos_handler(e):
@@ -430,8 +429,8 @@ def create_pos_view(page: ft.Page, view_manager):
         if len(termino) < 1:
             if search_results_col_ref.current: search_results_col_ref.current.update(); return
         producto_cb=None
-        if termino.isdigit()and len(termino)>5: producto_cb=models.obtener_producto_por_codigo_barras(termino)
-        productos_encontrados=([producto_cb]if producto_cb else controllers.obtener_productos_para_vista(current_user_id,nombre_filtro=termino,limit=5))
+        if termino.isdigit()and len(termino)>5: producto_cb=models.obtener_producto_indexado_por_codigo(termino)
+        productos_encontrados=([producto_cb]if producto_cb else controllers.buscar_productos_para_venta(current_user_id,termino,limit=5))
         if isinstance(productos_encontrados,list)and productos_encontrados:
             for prod in productos_encontrados: search_results_col_ref.current.controls.append(ft.ListTile(title=ft.Text(prod['nombre_producto'],size=13),subtitle=ft.Text(f"Stock:{prod['stock_actual']}|${prod['precio_venta_menudeo']:.2f}",size=11),leading=ft.Icon(ft.icons.ADD_SHOPPING_CART,color=ft.colors.GREEN_300),on_click=lambda _,p=prod:anadir_producto_al_carrito(p),dense=True,content_padding=ft.padding.symmetric(horizontal=8,vertical=0)))
         else: search_results_col_ref.current.controls.append(ft.Text("No encontrado.",size=12,color=APP_TEXT_COLOR_SECONDARY))
@@ -467,6 +466,7 @@ def create_pos_view(page: ft.Page, view_manager):
             if tipo_pago_dd_ref.current:tipo_pago_dd_ref.current.value="efectivo";tipo_pago_dd_ref.current.update()
             if search_results_col_ref.current:search_results_col_ref.current.controls.clear();search_results_col_ref.current.update()
             if search_field_ref.current:search_field_ref.current.focus()
+        elif res_venta.get("pendiente"): page.show_snack_bar(ft.SnackBar(ft.Text(res_venta['mensaje']),open=True,bgcolor=ft.colors.AMBER_800,duration=6000))
         else: page.show_snack_bar(ft.SnackBar(ft.Text(f"Error:{res_venta.get('error','Desconocido')}"),open=True,bgcolor=APP_ERROR_COLOR,duration=4000))
     panel_busqueda = ft.Container(ft.Column([ft.Text("Buscar Producto",weight=ft.FontWeight.BOLD,size=16), create_custom_textfield("Nombre o Código...",ref=search_field_ref,width=None,on_submit=buscar_producto_pos_handler,height=40,dense=True), ft.Container(ft.Column(ref=search_results_col_ref,scroll=ft.ScrollMode.ADAPTIVE,spacing=1),expand=True,border=ft.border.all(0.5,FROSTED_GLASS_BORDER_COLOR),border_radius=8,padding=3,bgcolor=ft.colors.with_opacity(0.03,ft.colors.WHITE))],spacing=6),padding=10,border_radius=10,width=260)
     panel_carrito = ft.Container(ft.Column([ft.Text("Carrito",weight=ft.FontWeight.BOLD,size=18),ft.Divider(height=5),ft.Container(ft.Column(ref=carrito_items_ref,scroll=ft.ScrollMode.ADAPTIVE,spacing=3),expand=True,padding=ft.padding.only(top=3)),ft.Divider(height=5),ft.Text(ref=total_venta_ref,value="Total: $0.00",weight=ft.FontWeight.BOLD,size=20,text_align=ft.TextAlign.RIGHT)],spacing=5),padding=10,border_radius=10,expand=True)
@@ -487,26 +487,19 @@ def create_reports_view(page: ft.Page, view_manager):
         report_type = report_type_dd_ref.current.value; fecha_inicio = date_from_ref.current.value; fecha_fin = date_to_ref.current.value
         if feedback_area_ref.current: feedback_area_ref.current.controls.clear(); feedback_area_ref.current.update()
         page.show_snack_bar(ft.SnackBar(ft.Text(f"Generando reporte {report_type} en {export_format}..."),open=True, duration=2000)); filepath = None; error_msg = None
+        desde_cache = False
         try:
-            if report_type == "ventas_periodo":
-                data = controllers.generar_reporte_ventas_periodo_ctrl(current_user_id, fecha_inicio, fecha_fin)
-                if "error" in data: error_msg = data["error"]
-                else: filepath = report_generator.generar_excel_ventas_periodo(data, fecha_inicio, fecha_fin) if export_format == 'excel' else report_generator.generar_pdf_ventas_periodo(data, fecha_inicio, fecha_fin)
-            elif report_type == "productos_mas_vendidos":
+            top_n_val = 10
+            if report_type == "productos_mas_vendidos":
                 top_n_val = top_n_field_ref.current.value
                 if not top_n_val or not top_n_val.isdigit() or int(top_n_val) <= 0: error_msg = "Top N debe ser un número positivo."; raise ValueError(error_msg)
-                data = controllers.generar_reporte_productos_mas_vendidos_ctrl(current_user_id, fecha_inicio, fecha_fin, int(top_n_val))
-                if "error" in data: error_msg = data["error"]
-                else: filepath = report_generator.generar_excel_productos_mas_vendidos(data, fecha_inicio, fecha_fin, int(top_n_val)) if export_format == 'excel' else report_generator.generar_pdf_productos_mas_vendidos(data, fecha_inicio, fecha_fin, int(top_n_val))
-            elif report_type == "ventas_por_usuario":
-                data = controllers.generar_reporte_ventas_por_usuario_ctrl(current_user_id, fecha_inicio, fecha_fin)
-                if "error" in data: error_msg = data["error"]
-                else: filepath = report_generator.generar_excel_ventas_por_usuario(data, fecha_inicio, fecha_fin) if export_format == 'excel' else report_generator.generar_pdf_ventas_por_usuario(data, fecha_inicio, fecha_fin)
-            else: error_msg = "Tipo de reporte no soportado."
-        except Exception as ex: error_msg = f"Error inesperado: {ex}"; print(f"Excepción en reporte: {ex}")
+            resultado = controllers.exportar_reporte_ctrl(current_user_id, report_type, export_format, fecha_inicio, fecha_fin, int(top_n_val))
+            if "error" in resultado: error_msg = resultado["error"]
+            else: filepath = resultado["filepath"]; desde_cache = resultado["desde_cache"]
+        except Exception as ex: error_msg = error_msg or f"Error inesperado: {ex}"; print(f"Excepción en reporte: {ex}")
         if error_msg: page.show_snack_bar(ft.SnackBar(ft.Text(error_msg),open=True,bgcolor=APP_ERROR_COLOR,duration=4000))
         elif filepath:
-            page.show_snack_bar(ft.SnackBar(ft.Text(f"Reporte generado: {filepath}"),open=True,bgcolor=ft.colors.GREEN_ACCENT_700,duration=5000))
+            page.show_snack_bar(ft.SnackBar(ft.Text(f"Reporte {'reutilizado (sin cambios desde la última vez)' if desde_cache else 'generado'}: {filepath}"),open=True,bgcolor=ft.colors.GREEN_ACCENT_700,duration=5000))
             if feedback_area_ref.current: feedback_area_ref.current.controls.append(ft.Text(f"Guardado en: {os.path.abspath(filepath)}",color=APP_TEXT_COLOR_SECONDARY,selectable=True)); feedback_area_ref.current.update()
         else: page.show_snack_bar(ft.SnackBar(ft.Text("Error desconocido al generar."),open=True,bgcolor=APP_ERROR_COLOR,duration=4000))
     hoy_default = datetime.now().strftime("%Y-%m-%d"); hace_7_dias_default = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
@@ -528,13 +521,48 @@ def create_settings_view(page: ft.Page, view_manager):
     # --- Exportar DB ---
     def export_db_click(e):
         results_text_area.value = "Exportando base de datos..." ; results_text_area.update()
-        result = controllers.exportar_database_completa_ctrl(current_user_id)
+        result = controllers.crear_backup_ctrl(current_user_id, tipo='sql') # Comprimido, indexado y con retención
+        if result.get("success"):
+            results_text_area.value = f"Éxito: {result.get('mensaje')}\nRuta: {os.path.abspath(result.get('filepath'))}"
+        else:
+            results_text_area.value = f"Error: {result.get('error')}"
+        results_text_area.update()
+
+    def backup_db_click(e):
+        results_text_area.value = "Creando backup de la base de datos..." ; results_text_area.update()
+        def mostrar_progreso(copiadas, totales):
+            results_text_area.value = f"Creando backup de la base de datos... {copiadas * 100 // totales if totales else 100}%"; results_text_area.update()
+        result = controllers.crear_backup_ctrl(current_user_id, tipo='db', progreso=mostrar_progreso)
         if result.get("success"):
             results_text_area.value = f"Éxito: {result.get('mensaje')}\nRuta: {os.path.abspath(result.get('filepath'))}"
         else:
             results_text_area.value = f"Error: {result.get('error')}"
         results_text_area.update()
 
+    def backup_incremental_click(e):
+        results_text_area.value = "Creando backup incremental..." ; results_text_area.update()
+        result = controllers.crear_backup_ctrl(current_user_id, tipo='incremental')
+        if result.get("success"):
+            results_text_area.value = f"Éxito: {result.get('mensaje')}"
+        else:
+            results_text_area.value = f"Error: {result.get('error')}"
+        results_text_area.update()
+
+    def verificar_ultimo_backup_click(e):
+        lista = controllers.listar_backups_ctrl(current_user_id)
+        if lista.get("error") or not lista.get("backups"):
+            results_text_area.value = f"Error: {lista.get('error', 'No hay backups para verificar.')}"; results_text_area.update()
+            return
+        ultimo = lista["backups"][0]
+        anterior = ultimo.get("verificacion")
+        estado = "sin verificar" if not anterior else ("correcta" if anterior["ok"] else "FALLIDA: " + "; ".join(anterior["errores"]))
+        result = controllers.verificar_backup_ctrl(current_user_id, ultimo["archivo"], completo=True)
+        if result.get("success"):
+            results_text_area.value = f"{result.get('mensaje')}\nÚltima verificación de {ultimo['archivo']}: {estado}"
+        else:
+            results_text_area.value = f"Error: {result.get('error')}"
+        results_text_area.update()
+
     # --- Importar DB ---
     def on_import_db_dialog_result(e: ft.FilePickerResultEvent):
         if e.files and len(e.files) > 0:
@@ -544,14 +572,19 @@ def create_settings_view(page: ft.Page, view_manager):
                 close_dialog_global(page, page.dialog) # Cerrar diálogo de confirmación
                 results_text_area.value = f"Importando base de datos desde {sql_filepath}..." ; results_text_area.update()
                 # Realizar un backup ANTES de importar
-                backup_before_import = db_utils.export_database_to_sql()
+                backup_result = controllers.crear_backup_ctrl(current_user_id, tipo='sql', origen='pre_importacion')
+                backup_before_import = backup_result.get('filepath')
                 if backup_before_import:
                     results_text_area.value += f"\nBackup previo realizado en: {backup_before_import}"
                 else:
                     results_text_area.value += f"\nADVERTENCIA: No se pudo crear backup previo."
                 results_text_area.update()
 
-                import_result = controllers.importar_database_desde_sql_ctrl(current_user_id, sql_filepath)
+                texto_previo = results_text_area.value
+                def mostrar_progreso(leidos, totales, filas):
+                    results_text_area.value = f"{texto_previo}\nRestaurando... {leidos * 100 // totales if totales else 100}% ({filas} filas)"; results_text_area.update()
+                import_result = controllers.importar_database_desde_sql_ctrl(current_user_id, sql_filepath, progreso=mostrar_progreso)
+                results_text_area.value = texto_previo
                 if import_result.get("success"):
                     results_text_area.value += f"\nÉxito: {import_result.get('mensaje')}"
                     page.show_snack_bar(ft.SnackBar(ft.Text("Importación de DB completada. REINICIE LA APLICACIÓN."), open=True, duration=7000, bgcolor=ft.colors.GREEN_ACCENT_700))
@@ -585,22 +618,49 @@ def create_settings_view(page: ft.Page, view_manager):
         results_text_area.update()
 
     # --- Importar Productos ---
+    MAX_LINEAS_VISTA_PREVIA = 200 # Un archivo grande puede tener decenas de miles de filas
+    def describir_importacion(import_result):
+        summary_msg = import_result.get('mensaje') or import_result.get('error', 'Error desconocido en importación.')
+        lineas = [summary_msg]
+        for detalle_fila in import_result.get('detalles') or []: # Sin las filas sin cambios
+            if detalle_fila['status'] == 'sin_cambios': continue
+            if len(lineas) > MAX_LINEAS_VISTA_PREVIA: lineas.append("  ..."); break
+            linea = f"  Fila {detalle_fila['fila']}: {detalle_fila['nombre_original']} - {detalle_fila['status']} - {detalle_fila['mensaje']}"
+            if detalle_fila.get('cambios'): linea += " (" + "; ".join(f"{c}: {antes} -> {despues}" for c, (antes, despues) in detalle_fila['cambios'].items()) + ")"
+            lineas.append(linea)
+        return summary_msg, "\n".join(lineas)
+
     def on_import_products_dialog_result(e: ft.FilePickerResultEvent):
         if e.files and len(e.files) > 0:
             excel_filepath = e.files[0].path
-            results_text_area.value = f"Importando productos desde {excel_filepath}..." ; results_text_area.update()
-            import_result = controllers.importar_productos_desde_excel_ctrl(current_user_id, excel_filepath)
-
-            summary_msg = import_result.get('mensaje', 'Error desconocido en importación.')
-            full_feedback = summary_msg
-            if import_result.get('detalles'):
-                for detalle_fila in import_result.get('detalles'):
-                    full_feedback += f"\n  Fila {detalle_fila['fila']}: {detalle_fila['nombre_original']} - {detalle_fila['status']} - {detalle_fila['mensaje']}"
-            results_text_area.value = full_feedback
-            page.show_snack_bar(ft.SnackBar(ft.Text(summary_msg), open=True, duration=5000, bgcolor=ft.colors.GREEN_ACCENT_700 if import_result.get("success") else APP_ERROR_COLOR))
+            def mostrar_progreso(filas_leidas, total_filas):
+                results_text_area.value = f"Procesando productos desde {excel_filepath}... {filas_leidas}" + (f" de {total_filas} filas" if total_filas else " filas"); results_text_area.update()
+            results_text_area.value = f"Calculando cambios de {excel_filepath}..." ; results_text_area.update()
+            vista_previa = controllers.importar_productos_desde_excel_ctrl(current_user_id, excel_filepath, progreso=mostrar_progreso, simular=True)
+            summary_msg, full_feedback = describir_importacion(vista_previa)
+            results_text_area.value = full_feedback; results_text_area.update()
+            if not vista_previa.get("success") or not (vista_previa['creados'] or vista_previa['actualizados']):
+                page.show_snack_bar(ft.SnackBar(ft.Text(summary_msg), open=True, duration=5000, bgcolor=ft.colors.GREEN_ACCENT_700 if vista_previa.get("success") else APP_ERROR_COLOR))
+                return
+
+            def confirm_import_products(ev):
+                close_dialog_global(page, confirm_dialog)
+                import_result = controllers.importar_productos_desde_excel_ctrl(current_user_id, excel_filepath, progreso=mostrar_progreso)
+                summary_msg, full_feedback = describir_importacion(import_result)
+                results_text_area.value = full_feedback; results_text_area.update()
+                page.show_snack_bar(ft.SnackBar(ft.Text(summary_msg), open=True, duration=5000, bgcolor=ft.colors.GREEN_ACCENT_700 if import_result.get("success") else APP_ERROR_COLOR))
+
+            confirm_dialog = ft.AlertDialog(
+                modal=True, title=ft.Text("Confirmar Importación de Productos", color=APP_TEXT_COLOR_PRIMARY),
+                content=ft.Text(f"Se crearán {vista_previa['creados']} productos y se actualizarán {vista_previa['actualizados']} "
+                                f"({vista_previa['sin_cambios']} filas sin cambios, {vista_previa['errores']} con errores). Revise el detalle antes de aplicar.", color=APP_TEXT_COLOR_SECONDARY),
+                actions=[ft.TextButton("Cancelar", on_click=lambda ev: close_dialog_global(page, confirm_dialog)), ft.ElevatedButton("Aplicar cambios", on_click=confirm_import_products)],
+                shape=ft.RoundedRectangleBorder(radius=15), bgcolor=DIALOG_BG_COLOR
+            )
+            page.dialog = confirm_dialog; confirm_dialog.open = True; page.update()
         else:
             results_text_area.value = "Importación de productos cancelada o sin archivo."
-        results_text_area.update()
+            results_text_area.update()
 
     file_picker_import_prods = ft.FilePicker(on_result=on_import_products_dialog_result)
     page.overlay.append(file_picker_import_prods)
@@ -613,8 +673,11 @@ def create_settings_view(page: ft.Page, view_manager):
 
             ft.Text("Base de Datos Completa:", weight=ft.FontWeight.BOLD, size=18, color=APP_TEXT_COLOR_PRIMARY),
             ft.Row([
-                ft.ElevatedButton("Exportar DB (.sql)", icon=ft.icons.UPLOAD_FILE, on_click=export_db_click, disabled=not can_export_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
-                ft.ElevatedButton("Importar DB (.sql)", icon=ft.icons.DOWNLOAD_ROUNDED, on_click=lambda _: file_picker_import_db.pick_files(allow_multiple=False, allowed_extensions=["sql"]), disabled=not can_import_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), bgcolor=APP_ERROR_COLOR if can_import_db else ft.colors.GREY_700)),
+                ft.ElevatedButton("Exportar DB (.sql.gz)", icon=ft.icons.UPLOAD_FILE, on_click=export_db_click, disabled=not can_export_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
+                ft.ElevatedButton("Backup en línea (.db.gz)", icon=ft.icons.BACKUP, on_click=backup_db_click, disabled=not can_export_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
+                ft.ElevatedButton("Backup incremental", icon=ft.icons.BACKUP_OUTLINED, on_click=backup_incremental_click, disabled=not can_export_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
+                ft.ElevatedButton("Verificar último backup", icon=ft.icons.VERIFIED, on_click=verificar_ultimo_backup_click, disabled=not can_export_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
+                ft.ElevatedButton("Importar DB (.sql)", icon=ft.icons.DOWNLOAD_ROUNDED, on_click=lambda _: file_picker_import_db.pick_files(allow_multiple=False, allowed_extensions=["sql", "gz", "xz"]), disabled=not can_import_db, height=40, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), bgcolor=APP_ERROR_COLOR if can_import_db else ft.colors.GREY_700)),
             ], spacing=15),
             ft.Text("Nota: La importación de base de datos reemplazará todos los datos actuales. Haga un backup primero.", size=11, color=APP_TEXT_COLOR_SECONDARY, italic=True),
             ft.Container(height=20),
@@ -684,6 +747,12 @@ class ViewManager:
         else: print(f"Error: Vista '{view_name}' no encontrada.")
 
 def main(page: ft.Page):
+    database_setup.aplicar_migraciones(models.DATABASE_NAME) # Lleva bases existentes a la versión de esquema actual
+    config_db = db_pool.reportar_configuracion(models.DATABASE_NAME)
+    print(f"Base de datos '{models.DATABASE_NAME}' con perfil '{config_db['perfil']}': {config_db['efectivos']}")
+    escritor_ventas.iniciar_escritor() # Las ventas de todas las cajas se confirman en lotes
+    programador_backups.iniciar_programador() # Backups completos e incrementales en segundo plano
+    models.asegurar_snapshot_stock_periodico() # Foto semanal del stock para consultas de stock a una fecha
     page.title = "Punto de Venta Moderno"; page.window_width=1320; page.window_height=780; page.window_resizable=True; page.padding=0
     view_mgr = ViewManager(page)
     view_mgr.add_view("login", create_login_view)
@@ -1,12 +1,30 @@
 import sqlite3
 import hashlib
+import threading
+import time
+import heapq
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+import db_pool
+import database_setup
 
 DATABASE_NAME = 'pos_database.db'
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row # Para acceder a las columnas por nombre
-    return conn
+    # La conexión sale de un pool: conn.close() la devuelve para reutilizarla en lugar de cerrarla.
+    # Ya viene configurada con row_factory = sqlite3.Row (acceso a columnas por nombre).
+    return db_pool.obtener_conexion(DATABASE_NAME)
+
+def obtener_estadisticas_conexiones():
+    """Contadores del pool: aperturas, reutilizaciones, esperas y tiempo total de espera."""
+    estadisticas = db_pool.obtener_estadisticas_conexiones(DATABASE_NAME)
+    return estadisticas[0] if estadisticas else None
+
+def cerrar_conexiones():
+    """Cierra las conexiones en pool (p. ej. antes de reemplazar el archivo de la base de datos)."""
+    db_pool.cerrar_pools(DATABASE_NAME)
+    _estado_fts_productos.clear() # La base nueva puede tener o no el índice de búsqueda
+    invalidar_indice_productos()
 
 def _hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -99,6 +117,7 @@ def actualizar_info_usuario(usuario_id, nombre_usuario=None, rol=None, pregunta_
     try:
         cursor.execute(query, tuple(params))
         conn.commit()
+        invalidar_cache_permisos(usuario_id) # Un cambio de rol cambia sus permisos
         return cursor.rowcount > 0
     except sqlite3.IntegrityError: # En caso de que se intente cambiar a un nombre_usuario que ya existe
         return False
@@ -145,6 +164,7 @@ def eliminar_usuario(usuario_id):
         # También eliminamos sus permisos individuales
         cursor.execute("DELETE FROM UsuariosPermisos WHERE usuario_id = ?", (usuario_id,))
         conn.commit()
+        invalidar_cache_permisos(usuario_id)
         return cursor.rowcount > 0
     finally:
         conn.close()
@@ -172,6 +192,7 @@ def asignar_permiso_usuario(usuario_id, nombre_permiso, otorgado=True):
         VALUES (?, ?, ?)
         ''', (usuario_id, permiso_id, otorgado))
         conn.commit()
+        invalidar_cache_permisos(usuario_id)
         return True
     except sqlite3.Error as e:
         print(f"Error al asignar permiso: {e}")
@@ -195,40 +216,157 @@ def obtener_permisos_por_rol_base(rol):
     conn.close()
     return set(permisos)
 
-def obtener_permisos_usuario(usuario_id):
-    usuario = obtener_usuario_por_id(usuario_id)
-    if not usuario:
-        return set()
-
-    permisos_del_rol = obtener_permisos_por_rol_base(usuario['rol'])
-
+# --- Permisos compilados como máscaras de bits ---
+# Cada permiso del catálogo (tabla Permisos) ocupa el bit igual a su id: los ids son AUTOINCREMENT,
+# no se reutilizan, así que la posición de cada permiso es estable.
+# Los permisos efectivos de un usuario (rol + concesiones/revocaciones de UsuariosPermisos)
+# se resuelven con una sola consulta y se guardan como un entero.
+_CONSULTA_PERMISOS_EFECTIVOS = '''
+    SELECT u.id AS usuario_id, p.id AS permiso_id
+    FROM Usuarios u
+    CROSS JOIN Permisos p
+    LEFT JOIN RolesPermisos rp ON rp.rol = u.rol AND rp.permiso_id = p.id
+    LEFT JOIN UsuariosPermisos up ON up.usuario_id = u.id AND up.permiso_id = p.id
+    WHERE COALESCE(up.otorgado, rp.permiso_id IS NOT NULL) {filtro_usuario}
+'''
+
+# Caché de permisos por usuario:
+# tiene_permiso se llama varias veces por acción; las máscaras efectivas se guardan por usuario
+# y se invalidan explícitamente cuando cambian (asignaciones, roles, datos del usuario).
+# El TTL es una red de seguridad para cambios hechos desde otro proceso/terminal.
+PERMISOS_CACHE_TTL_S = 300
+_cache_permisos = {} # usuario_id -> (máscara de permisos, instante de carga)
+_cache_permisos_lock = threading.Lock()
+_cache_permisos_stats = {'aciertos': 0, 'fallos': 0, 'invalidaciones': 0}
+
+CATALOGO_PERMISOS_RECARGA_MIN_S = 5 # Recargas por nombre desconocido: como mucho una cada tantos segundos
+_catalogo_permisos = {'mapa': MappingProxyType({}), 'cargado': False, 'recarga_por_fallo_en': None}
+
+def obtener_catalogo_permisos(recargar=False):
+    """
+    Devuelve {nombre_permiso: bit} de solo lectura. Se carga una vez y cada recarga lo reemplaza
+    entero, así se puede devolver sin copiar en cada comprobación de permisos.
+    """
+    with _cache_permisos_lock:
+        if _catalogo_permisos['cargado'] and not recargar:
+            return _catalogo_permisos['mapa']
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Obtener permisos individuales
-    cursor.execute('''
-    SELECT p.nombre_permiso, up.otorgado
-    FROM Permisos p
-    JOIN UsuariosPermisos up ON p.id = up.permiso_id
-    WHERE up.usuario_id = ?
-    ''', (usuario_id,))
+    cursor.execute("SELECT id, nombre_permiso FROM Permisos")
+    catalogo = MappingProxyType({row['nombre_permiso']: row['id'] for row in cursor.fetchall()})
+    conn.close()
+    with _cache_permisos_lock:
+        _catalogo_permisos.update(mapa=catalogo, cargado=True)
+    return catalogo
 
-    permisos_individuales = cursor.fetchall()
+def _catalogo_con_permisos(nombres_permiso):
+    """
+    Catálogo que incluye los permisos pedidos si existen: un nombre desconocido puede ser un permiso
+    creado por otra terminal o por una migración posterior a la carga, así que recarga el catálogo
+    (limitado a una vez cada CATALOGO_PERMISOS_RECARGA_MIN_S para nombres que de verdad no existen).
+    """
+    catalogo = obtener_catalogo_permisos()
+    if all(nombre in catalogo for nombre in nombres_permiso):
+        return catalogo
+    ahora = time.monotonic()
+    with _cache_permisos_lock:
+        ultima = _catalogo_permisos['recarga_por_fallo_en']
+        if ultima is not None and ahora - ultima < CATALOGO_PERMISOS_RECARGA_MIN_S:
+            return catalogo
+        _catalogo_permisos['recarga_por_fallo_en'] = ahora
+    return obtener_catalogo_permisos(recargar=True)
+
+def mascara_de_permisos(*nombres_permiso):
+    """Máscara con los bits de los permisos indicados. Los permisos inexistentes no aportan bits."""
+    catalogo = _catalogo_con_permisos(nombres_permiso)
+    mascara = 0
+    for nombre in nombres_permiso:
+        bit = catalogo.get(nombre)
+        if bit is not None:
+            mascara |= 1 << bit
+    return mascara
+
+def permisos_de_mascara(mascara):
+    """Convierte una máscara en el conjunto de nombres de permiso."""
+    return {nombre for nombre, bit in obtener_catalogo_permisos().items() if mascara >> bit & 1}
+
+def _calcular_mascaras_permisos(usuario_id=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if usuario_id is None:
+        cursor.execute(_CONSULTA_PERMISOS_EFECTIVOS.format(filtro_usuario=""))
+    else:
+        cursor.execute(_CONSULTA_PERMISOS_EFECTIVOS.format(filtro_usuario="AND u.id = ?"), (usuario_id,))
+    mascaras = {}
+    for row in cursor.fetchall():
+        mascaras[row['usuario_id']] = mascaras.get(row['usuario_id'], 0) | (1 << row['permiso_id'])
     conn.close()
+    return mascaras
 
-    permisos_finales = set(permisos_del_rol) # Empezamos con los permisos del rol
+def obtener_permisos_usuario(usuario_id):
+    return permisos_de_mascara(obtener_mascara_permisos_usuario(usuario_id))
+
+def obtener_mascara_permisos_usuario(usuario_id):
+    ahora = time.monotonic()
+    with _cache_permisos_lock:
+        entrada = _cache_permisos.get(usuario_id)
+        if entrada and ahora - entrada[1] < PERMISOS_CACHE_TTL_S:
+            _cache_permisos_stats['aciertos'] += 1
+            return entrada[0]
+        _cache_permisos_stats['fallos'] += 1
+    mascara = _calcular_mascaras_permisos(usuario_id).get(usuario_id, 0)
+    with _cache_permisos_lock:
+        _cache_permisos[usuario_id] = (mascara, ahora)
+    return mascara
+
+def obtener_mascaras_permisos_todos():
+    """
+    Resuelve las máscaras de todos los usuarios con una sola consulta (pantallas de administración).
+    Retorna {usuario_id: máscara} y aprovecha para refrescar la caché.
+    """
+    mascaras = _calcular_mascaras_permisos()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM Usuarios")
+    for row in cursor.fetchall():
+        mascaras.setdefault(row['id'], 0) # Usuarios sin ningún permiso efectivo
+    conn.close()
+    ahora = time.monotonic()
+    with _cache_permisos_lock:
+        for usuario_id, mascara in mascaras.items():
+            _cache_permisos[usuario_id] = (mascara, ahora)
+    return mascaras
 
-    for permiso_individual in permisos_individuales:
-        if permiso_individual['otorgado']:
-            permisos_finales.add(permiso_individual['nombre_permiso'])
-        else: # Si está explícitamente revocado (otorgado=0)
-            if permiso_individual['nombre_permiso'] in permisos_finales:
-                permisos_finales.remove(permiso_individual['nombre_permiso'])
+def invalidar_cache_permisos(usuario_id=None):
+    """
+    Invalida la máscara cacheada de un usuario, o de todos si usuario_id es None
+    (en ese caso también se recarga el catálogo de permisos).
+    """
+    with _cache_permisos_lock:
+        if usuario_id is None:
+            _cache_permisos.clear()
+            _catalogo_permisos.update(cargado=False, recarga_por_fallo_en=None)
+        else:
+            _cache_permisos.pop(usuario_id, None)
+        _cache_permisos_stats['invalidaciones'] += 1
 
-    return permisos_finales
+def obtener_estadisticas_cache_permisos():
+    with _cache_permisos_lock:
+        return {**_cache_permisos_stats, 'usuarios_en_cache': len(_cache_permisos)}
 
 def tiene_permiso(usuario_id, nombre_permiso):
-    permisos_usuario = obtener_permisos_usuario(usuario_id)
-    return nombre_permiso in permisos_usuario
+    return tiene_algun_permiso(usuario_id, nombre_permiso)
+
+def tiene_algun_permiso(usuario_id, *nombres_permiso):
+    """True si el usuario tiene al menos uno de los permisos (un único AND sobre la máscara)."""
+    return obtener_mascara_permisos_usuario(usuario_id) & mascara_de_permisos(*nombres_permiso) != 0
+
+def tiene_todos_los_permisos(usuario_id, *nombres_permiso):
+    catalogo = _catalogo_con_permisos(nombres_permiso)
+    if not nombres_permiso or any(nombre not in catalogo for nombre in nombres_permiso):
+        return False
+    requerida = mascara_de_permisos(*nombres_permiso)
+    return obtener_mascara_permisos_usuario(usuario_id) & requerida == requerida
 
 # --- Funciones de RolesPermisos ---
 def asignar_permiso_a_rol(rol, nombre_permiso):
@@ -242,6 +380,8 @@ def asignar_permiso_a_rol(rol, nombre_permiso):
     try:
         cursor.execute("INSERT OR IGNORE INTO RolesPermisos (rol, permiso_id) VALUES (?, ?)", (rol, permiso_id))
         conn.commit()
+        if cursor.rowcount > 0:
+            invalidar_cache_permisos() # Afecta a todos los usuarios con ese rol
         return True
     finally:
         conn.close()
@@ -256,6 +396,7 @@ def revocar_permiso_de_rol(rol, nombre_permiso):
     try:
         cursor.execute("DELETE FROM RolesPermisos WHERE rol = ? AND permiso_id = ?", (rol, permiso_id))
         conn.commit()
+        invalidar_cache_permisos() # Afecta a todos los usuarios con ese rol
         return cursor.rowcount > 0
     finally:
         conn.close()
@@ -534,8 +675,11 @@ def crear_producto(nombre_producto, precio_venta_menudeo, codigo_barras=None, de
         ''', (codigo_barras, nombre_producto, descripcion, categoria_id, proveedor_id,
               precio_compra, precio_venta_menudeo, precio_venta_mayoreo, cantidad_para_mayoreo,
               stock_actual, stock_minimo, unidad_medida))
+        producto_id = cursor.lastrowid
+        if stock_actual:
+            _insertar_movimiento(cursor, producto_id, 'inicial', stock_actual, notas="Stock al crear el producto")
         conn.commit()
-        return cursor.lastrowid
+        return producto_id
     except sqlite3.IntegrityError as e: # Por codigo_barras UNIQUE
         print(f"Error de integridad al crear producto: {e}")
         return None
@@ -571,7 +715,45 @@ def obtener_producto_por_codigo_barras(codigo_barras):
     conn.close()
     return dict(producto) if producto else None
 
-def listar_productos(nombre=None, categoria_id=None, proveedor_id=None, stock_bajo=False, solo_activos=True, page=1, limit=25):
+TAMANO_LOTE_IDS = 500 # Por debajo del límite de parámetros de SQLite (999 en versiones antiguas)
+
+def obtener_productos_por_ids(ids_productos, solo_activos=True):
+    """
+    Obtiene varios productos en una sola consulta por cada lote de IDs (WHERE id IN (...)).
+    Retorna dict {producto_id: producto}; los IDs inexistentes (o inactivos) no aparecen.
+    """
+    ids = list(dict.fromkeys(ids_productos)) # Sin duplicados, conservando el orden
+    productos = {}
+    if not ids:
+        return productos
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for inicio in range(0, len(ids), TAMANO_LOTE_IDS):
+            lote = ids[inicio:inicio + TAMANO_LOTE_IDS]
+            query = f'''
+                SELECT p.*, c.nombre_categoria, pr.nombre_proveedor
+                FROM Productos p
+                LEFT JOIN Categorias c ON p.categoria_id = c.id
+                LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+                WHERE p.id IN ({", ".join("?" * len(lote))})
+            '''
+            if solo_activos:
+                query += " AND p.activo = TRUE"
+            cursor.execute(query, tuple(lote))
+            for fila in cursor.fetchall():
+                productos[fila['id']] = dict(fila)
+    finally:
+        conn.close()
+    return productos
+
+def listar_productos(nombre=None, categoria_id=None, proveedor_id=None, stock_bajo=False, solo_activos=True, page=1, limit=25, despues_de=None):
+    """
+    Lista productos ordenados por (nombre_producto, id).
+    despues_de: cursor (nombre_producto, id) del último producto de la página anterior. Si se indica,
+                la página se obtiene por clave (keyset) y `page` se ignora: cuesta lo mismo que la primera
+                página en lugar de recorrer y descartar todas las anteriores con OFFSET.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -586,8 +768,17 @@ def listar_productos(nombre=None, categoria_id=None, proveedor_id=None, stock_ba
         conditions.append("p.activo = TRUE")
 
     if nombre:
-        conditions.append("p.nombre_producto LIKE ?")
-        params.append(f"%{nombre}%")
+        expresion_fts, terminos_cortos = _expresion_busqueda_fts(nombre, columna='nombre_producto', por_palabras=False)
+        if expresion_fts and _fts_productos_disponible():
+            # Subcadena resuelta por el índice de trigramas en lugar de recorrer todo el catálogo
+            conditions.append("p.id IN (SELECT rowid FROM ProductosFTS WHERE ProductosFTS MATCH ?)")
+            params.append(expresion_fts)
+            for termino in terminos_cortos:
+                conditions.append("p.nombre_producto LIKE ?")
+                params.append(f"%{termino}%")
+        else:
+            conditions.append("p.nombre_producto LIKE ?")
+            params.append(f"%{nombre}%")
     if categoria_id:
         conditions.append("p.categoria_id = ?")
         params.append(categoria_id)
@@ -596,20 +787,65 @@ def listar_productos(nombre=None, categoria_id=None, proveedor_id=None, stock_ba
         params.append(proveedor_id)
     if stock_bajo:
         conditions.append("p.stock_actual <= p.stock_minimo")
+    if despues_de:
+        conditions.append("(p.nombre_producto, p.id) > (?, ?)")
+        params.extend(despues_de)
 
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
 
-    query += " ORDER BY p.nombre_producto"
+    query += " ORDER BY p.nombre_producto, p.id" # id desempata nombres repetidos para que el cursor sea estable
     if limit:
-        query += " LIMIT ? OFFSET ?"
-        params.extend([limit, (page - 1) * limit])
+        if despues_de:
+            query += " LIMIT ?"
+            params.append(limit)
+        else:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([limit, (page - 1) * limit])
 
     cursor.execute(query, tuple(params))
     productos = cursor.fetchall()
     conn.close()
     return [dict(prod) for prod in productos]
 
+def listar_productos_paginado(cursor=None, limit=25, **filtros):
+    """
+    Paginación por cursor de listar_productos.
+    Retorna: {'productos': [...], 'siguiente_cursor': (nombre_producto, id) o None si no hay más}
+    """
+    productos = listar_productos(despues_de=cursor, limit=limit, **filtros)
+    siguiente = None
+    if limit and len(productos) == limit:
+        siguiente = (productos[-1]['nombre_producto'], productos[-1]['id'])
+    return {'productos': productos, 'siguiente_cursor': siguiente}
+
+TAMANO_LOTE_EXPORTACION = 1000 # Filas por fetchmany al recorrer el catálogo completo
+
+def iterar_productos(solo_activos=False, tamano_lote=TAMANO_LOTE_EXPORTACION):
+    """
+    Recorre el catálogo completo (mismas columnas y orden que listar_productos) con un cursor,
+    de tamano_lote en tamano_lote, en lugar de materializar una lista de dicts: la memoria no
+    depende del número de productos. Produce filas sqlite3.Row (acceso por nombre de columna).
+    La conexión queda tomada hasta agotar o cerrar el generador; en WAL no bloquea a las cajas.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # idx_productos_nombre ya está ordenado por (nombre_producto, rowid): no hace falta ordenar aparte
+        cursor.execute(f'''SELECT p.*, c.nombre_categoria, pr.nombre_proveedor
+                          FROM Productos p
+                          LEFT JOIN Categorias c ON p.categoria_id = c.id
+                          LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+                          {"WHERE p.activo = TRUE" if solo_activos else ""}
+                          ORDER BY p.nombre_producto, p.id''')
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+            yield from filas
+    finally:
+        conn.close()
+
 def actualizar_producto(producto_id, **kwargs):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -636,9 +872,19 @@ def actualizar_producto(producto_id, **kwargs):
     query = f"UPDATE Productos SET {', '.join(fields_to_update)} WHERE id = ?"
 
     try:
+        if 'stock_actual' in kwargs:
+            # Fijar el stock directamente (edición del producto) queda en el libro como ajuste
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, notas)
+                SELECT id, 'ajuste', ? - stock_actual, ?, 'Stock fijado al editar el producto'
+                FROM Productos WHERE id = ? AND stock_actual != ?
+            ''', (kwargs['stock_actual'], kwargs['stock_actual'], producto_id, kwargs['stock_actual']))
         cursor.execute(query, tuple(params))
+        actualizado = cursor.rowcount > 0
         conn.commit()
-        return cursor.rowcount > 0
+        _marcar_indice_productos_pendiente()
+        return actualizado
     except sqlite3.IntegrityError as e: # Ej. codigo_barras duplicado
         print(f"Error de integridad al actualizar producto: {e}")
         return False
@@ -654,6 +900,8 @@ def eliminar_producto(producto_id, suave=True): # Por defecto, eliminación suav
         try:
             cursor.execute("DELETE FROM Productos WHERE id = ?", (producto_id,))
             conn.commit()
+            with _indice_productos_lock: # Un borrado físico no deja marca de modificación que refrescar
+                _indexar_fila_producto({'id': producto_id, 'activo': False, 'fecha_ultima_modificacion': None})
             return cursor.rowcount > 0
         except sqlite3.Error as e:
             print(f"Error al eliminar físicamente producto: {e}")
@@ -661,107 +909,693 @@ def eliminar_producto(producto_id, suave=True): # Por defecto, eliminación suav
         finally:
             conn.close()
 
+# --- Índice en memoria de productos vendibles (ruta de escaneo del POS) ---
+# Cada escaneo resolvía el código de barras con una consulta y tres tablas unidas. El índice se
+# carga una vez (solo productos activos y solo las columnas que usa la caja, como tuplas para que
+# 60k productos ocupen pocos MB) y se refresca de forma incremental leyendo las filas con
+# fecha_ultima_modificacion reciente (índice de la migración 4). Las búsquedas no tocan SQLite
+# salvo cuando toca refrescar o cuando un código no está en el índice (producto recién creado en otra caja).
+COLUMNAS_INDICE_PRODUCTOS = ('id', 'codigo_barras', 'nombre_producto', 'categoria_id', 'precio_venta_menudeo',
+                             'precio_venta_mayoreo', 'cantidad_para_mayoreo', 'stock_actual', 'stock_minimo',
+                             'unidad_medida', 'fecha_ultima_modificacion')
+INDICE_PRODUCTOS_REFRESCO_S = 5          # Antigüedad máxima antes de consultar cambios
+INDICE_PRODUCTOS_RECARGA_COMPLETA_S = 600 # Recarga total periódica (cubre borrados físicos hechos desde otra caja)
+INDICE_PRODUCTOS_SOLAPE_S = 5            # Las marcas de tiempo son por segundo y otra caja puede confirmar tarde
+_indice_productos = {
+    'por_id': {}, 'por_codigo': {}, 'marca': None, 'cargado': False, 'pendiente': False,
+    'cargado_en': None, 'refrescado_en': None,
+    'aciertos': 0, 'fallos': 0, 'refrescos': 0, 'filas_refrescadas': 0, 'recargas': 0,
+}
+_indice_productos_lock = threading.RLock()
+_SELECT_INDICE_PRODUCTOS = f"SELECT {', '.join('p.' + c for c in COLUMNAS_INDICE_PRODUCTOS)}, p.activo FROM Productos p"
+
+def _indexar_fila_producto(fila, mover_marca=True):
+    """
+    Inserta, reemplaza o quita (si está inactivo) un producto del índice. Requiere el lock.
+    mover_marca: solo la carga y el refresco, que leen todos los cambios hasta su marca, pueden
+    adelantarla; una fila suelta (fallo de búsqueda) dejaría sin leer cambios anteriores de otros productos.
+    """
+    por_id, por_codigo = _indice_productos['por_id'], _indice_productos['por_codigo']
+    anterior = por_id.pop(fila['id'], None)
+    if anterior is not None and anterior[1] is not None and por_codigo.get(anterior[1]) == fila['id']:
+        del por_codigo[anterior[1]]
+    if fila['activo']:
+        registro = tuple(fila[c] for c in COLUMNAS_INDICE_PRODUCTOS)
+        por_id[fila['id']] = registro
+        if registro[1] is not None:
+            por_codigo[registro[1]] = fila['id']
+    marca = fila['fecha_ultima_modificacion']
+    if mover_marca and marca is not None and (_indice_productos['marca'] is None or marca > _indice_productos['marca']):
+        _indice_productos['marca'] = marca
+
+def cargar_indice_productos():
+    """Carga completa del índice (al abrir el POS y periódicamente). Retorna el número de productos."""
+    conn = get_db_connection()
+    try:
+        filas = conn.execute(_SELECT_INDICE_PRODUCTOS + " WHERE p.activo = TRUE").fetchall()
+    finally:
+        conn.close()
+    with _indice_productos_lock:
+        _indice_productos['por_id'] = {}
+        _indice_productos['por_codigo'] = {}
+        _indice_productos['marca'] = None
+        for fila in filas:
+            _indexar_fila_producto(fila)
+        ahora = time.monotonic()
+        _indice_productos.update(cargado=True, pendiente=False, cargado_en=ahora, refrescado_en=ahora)
+        _indice_productos['recargas'] += 1
+        return len(_indice_productos['por_id'])
+
+def refrescar_indice_productos(forzar=False):
+    """Aplica al índice los productos modificados desde la última marca. Retorna filas leídas."""
+    with _indice_productos_lock:
+        if not _indice_productos['cargado']:
+            cargar_indice_productos()
+            return len(_indice_productos['por_id'])
+        ahora = time.monotonic()
+        if ahora - _indice_productos['cargado_en'] >= INDICE_PRODUCTOS_RECARGA_COMPLETA_S:
+            cargar_indice_productos()
+            return len(_indice_productos['por_id'])
+        if not forzar and not _indice_productos['pendiente'] and ahora - _indice_productos['refrescado_en'] < INDICE_PRODUCTOS_REFRESCO_S:
+            return 0
+        marca = _indice_productos['marca']
+        conn = get_db_connection()
+        try:
+            if marca is None:
+                filas = conn.execute(_SELECT_INDICE_PRODUCTOS + " WHERE p.fecha_ultima_modificacion IS NOT NULL").fetchall()
+            else:
+                # Lo posterior a la marca, más lo de los últimos segundos (puede haberse confirmado tarde)
+                filas = conn.execute(_SELECT_INDICE_PRODUCTOS + " WHERE p.fecha_ultima_modificacion > ? OR p.fecha_ultima_modificacion >= datetime('now', ?)",
+                                     (marca, f"-{INDICE_PRODUCTOS_SOLAPE_S} seconds")).fetchall()
+        finally:
+            conn.close()
+        for fila in filas:
+            _indexar_fila_producto(fila)
+        _indice_productos.update(pendiente=False, refrescado_en=time.monotonic())
+        _indice_productos['refrescos'] += 1
+        _indice_productos['filas_refrescadas'] += len(filas)
+        return len(filas)
+
+def _marcar_indice_productos_pendiente():
+    """Tras un cambio local de productos (edición, venta) el próximo escaneo refresca el índice."""
+    _indice_productos['pendiente'] = True
+
+def _registro_indice_a_dict(registro):
+    return dict(zip(COLUMNAS_INDICE_PRODUCTOS, registro))
+
+def obtener_producto_indexado_por_codigo(codigo_barras):
+    """Producto activo por código de barras desde el índice en memoria (None si no existe)."""
+    refrescar_indice_productos()
+    with _indice_productos_lock:
+        producto_id = _indice_productos['por_codigo'].get(codigo_barras)
+        registro = _indice_productos['por_id'].get(producto_id) if producto_id is not None else None
+        if registro is not None:
+            _indice_productos['aciertos'] += 1
+            return _registro_indice_a_dict(registro)
+        _indice_productos['fallos'] += 1
+    # Puede ser un producto creado en otra caja después del último refresco
+    conn = get_db_connection()
+    try:
+        fila = conn.execute(_SELECT_INDICE_PRODUCTOS + " WHERE p.codigo_barras = ? AND p.activo = TRUE", (codigo_barras,)).fetchone()
+    finally:
+        conn.close()
+    if fila is None:
+        return None
+    with _indice_productos_lock:
+        _indexar_fila_producto(fila, mover_marca=False)
+    return {c: fila[c] for c in COLUMNAS_INDICE_PRODUCTOS}
+
+def obtener_producto_indexado_por_id(producto_id):
+    """Producto activo por ID desde el índice en memoria (None si no existe o está inactivo)."""
+    refrescar_indice_productos()
+    with _indice_productos_lock:
+        registro = _indice_productos['por_id'].get(producto_id)
+        if registro is not None:
+            _indice_productos['aciertos'] += 1
+            return _registro_indice_a_dict(registro)
+        _indice_productos['fallos'] += 1
+    producto = obtener_producto_por_id(producto_id)
+    if producto is None:
+        return None
+    with _indice_productos_lock:
+        _indexar_fila_producto(producto, mover_marca=False)
+    return {c: producto[c] for c in COLUMNAS_INDICE_PRODUCTOS}
+
+def obtener_estadisticas_indice_productos():
+    """Tamaño y antigüedad del índice en memoria."""
+    with _indice_productos_lock:
+        ahora = time.monotonic()
+        cargado = _indice_productos['cargado']
+        return {
+            'cargado': cargado,
+            'productos': len(_indice_productos['por_id']),
+            'codigos_barras': len(_indice_productos['por_codigo']),
+            'ultima_modificacion_vista': _indice_productos['marca'],
+            'segundos_desde_refresco': round(ahora - _indice_productos['refrescado_en'], 3) if cargado else None,
+            'segundos_desde_recarga_completa': round(ahora - _indice_productos['cargado_en'], 3) if cargado else None,
+            'pendiente_refresco': _indice_productos['pendiente'],
+            'aciertos': _indice_productos['aciertos'],
+            'fallos': _indice_productos['fallos'],
+            'refrescos': _indice_productos['refrescos'],
+            'filas_refrescadas': _indice_productos['filas_refrescadas'],
+            'recargas_completas': _indice_productos['recargas'],
+        }
+
+def invalidar_indice_productos():
+    """Descarta el índice (p. ej. tras importar una base de datos); se recarga en el próximo uso."""
+    with _indice_productos_lock:
+        _indice_productos.update(por_id={}, por_codigo={}, marca=None, cargado=False, pendiente=False)
+
+# --- Búsqueda de texto en productos (FTS5 con trigramas, ver migración 3) ---
+# El tokenizador trigram no encuentra subcadenas de menos de 3 caracteres; esos términos se
+# resuelven con LIKE sobre las filas que ya filtró el índice.
+LONGITUD_MINIMA_TERMINO_FTS = 3
+_estado_fts_productos = {}
+
+def _fts_productos_disponible():
+    """
+    Indica si existe ProductosFTS. Se comprueba una vez por proceso (o tras cambiar de base).
+    La migración 3 queda registrada aunque el SQLite de entonces no tuviera FTS5/trigram; si falta
+    el índice se intenta crear aquí (tabla, triggers y 'rebuild'), así aparece tras actualizar SQLite.
+    """
+    if 'disponible' not in _estado_fts_productos:
+        conn = get_db_connection()
+        consulta = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ProductosFTS'"
+        try:
+            disponible = conn.execute(consulta).fetchone() is not None
+            if not disponible:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    if cursor.execute(consulta).fetchone() is None: # Otra terminal pudo crearlo mientras tanto
+                        database_setup._migracion_003_busqueda_productos_fts(cursor)
+                    disponible = cursor.execute(consulta).fetchone() is not None
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    print(f"Advertencia: No se pudo crear el índice de búsqueda de productos ({e}). Se usará búsqueda simple.")
+            _estado_fts_productos['disponible'] = disponible
+        finally:
+            conn.close()
+    return _estado_fts_productos['disponible']
+
+def _expresion_busqueda_fts(texto, columna=None, por_palabras=True):
+    """
+    Convierte lo que escribe el usuario en una expresión MATCH: cada palabra como frase entre
+    comillas (sin operadores de FTS5) y todas requeridas. Con por_palabras=False el texto
+    completo es una sola frase (misma semántica que LIKE '%texto%').
+    Retorna (expresion o None, [términos demasiado cortos para el índice]).
+    """
+    terminos = [t for t in str(texto).split() if t] if por_palabras else [str(texto)]
+    largos = [t for t in terminos if len(t) >= LONGITUD_MINIMA_TERMINO_FTS]
+    cortos = [t for t in terminos if len(t) < LONGITUD_MINIMA_TERMINO_FTS]
+    if not largos:
+        return None, cortos
+    frases = ['"' + t.replace('"', '""') + '"' for t in largos]
+    expresion = " AND ".join(frases)
+    if columna:
+        expresion = f"{columna} : ({expresion})"
+    return expresion, cortos
+
+def buscar_productos_texto(termino, categoria_id=None, solo_activos=True, limit=25):
+    """
+    Búsqueda por relevancia en nombre, descripción y código de barras.
+    Orden: código de barras exacto primero, luego bm25 (el nombre pesa más que la descripción).
+    Sin índice FTS o con términos muy cortos se usa LIKE sobre nombre y código de barras.
+    """
+    termino = (termino or "").strip()
+    if not termino:
+        return []
+    expresion_fts, terminos_cortos = _expresion_busqueda_fts(termino)
+
+    conditions = []
+    params = []
+    if solo_activos:
+        conditions.append("p.activo = TRUE")
+    if categoria_id:
+        conditions.append("p.categoria_id = ?")
+        params.append(categoria_id)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if expresion_fts and _fts_productos_disponible():
+            condiciones_fts = ["ProductosFTS MATCH ?"] + conditions
+            params_fts = [expresion_fts] + params
+            for corto in terminos_cortos:
+                condiciones_fts.append("(p.nombre_producto LIKE ? OR p.codigo_barras LIKE ?)")
+                params_fts.extend([f"%{corto}%", f"%{corto}%"])
+            cursor.execute(f'''
+                SELECT p.*, c.nombre_categoria, pr.nombre_proveedor
+                FROM ProductosFTS
+                JOIN Productos p ON p.id = ProductosFTS.rowid
+                LEFT JOIN Categorias c ON p.categoria_id = c.id
+                LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+                WHERE {" AND ".join(condiciones_fts)}
+                ORDER BY (p.codigo_barras = ?) DESC, bm25(ProductosFTS, 10.0, 1.0, 5.0), p.nombre_producto
+                LIMIT ?
+            ''', tuple(params_fts + [termino, limit]))
+        else:
+            for t in (terminos_cortos or [termino]):
+                conditions.append("(p.nombre_producto LIKE ? OR p.codigo_barras LIKE ?)")
+                params.extend([f"%{t}%", f"%{t}%"])
+            cursor.execute(f'''
+                SELECT p.*, c.nombre_categoria, pr.nombre_proveedor
+                FROM Productos p
+                LEFT JOIN Categorias c ON p.categoria_id = c.id
+                LEFT JOIN Proveedores pr ON p.proveedor_id = pr.id
+                WHERE {" AND ".join(conditions)}
+                ORDER BY (p.codigo_barras = ?) DESC, p.nombre_producto
+                LIMIT ?
+            ''', tuple(params + [termino, limit]))
+        return [dict(prod) for prod in cursor.fetchall()]
+    finally:
+        conn.close()
+
 def buscar_productos(nombre=None, codigo_barras=None, categoria_id=None, limit=25):
-    # Wrapper simple para listar_productos, podría ser más específico.
-    return listar_productos(nombre=nombre, categoria_id=categoria_id, limit=limit) # No busca por CB aquí directamente
+    """Búsqueda por relevancia (nombre, descripción o código de barras); sin término lista por nombre."""
+    termino = nombre or codigo_barras
+    if not termino:
+        return listar_productos(categoria_id=categoria_id, limit=limit)
+    return buscar_productos_texto(termino, categoria_id=categoria_id, limit=limit)
 
 def obtener_productos_stock_bajo(page=1, limit=25):
     return listar_productos(stock_bajo=True, page=page, limit=limit)
 
-def registrar_movimiento_stock(producto_id, cantidad, tipo_movimiento, notas=None):
+# --- Libro de movimientos de stock (MovimientosStock, migración 5) ---
+# Toda variación de stock se escribe en la misma transacción que el cambio de Productos.stock_actual,
+# así el stock de un producto siempre es la suma de sus movimientos.
+SIGNO_MOVIMIENTO = {'entrada': 1, 'devolucion': 1, 'salida': -1, 'venta': -1}
+SNAPSHOT_STOCK_INTERVALO_DIAS = 7
+
+def _insertar_movimiento(cursor, producto_id, tipo, cantidad, venta_id=None, usuario_id=None, notas=None):
+    """Añade un movimiento (cantidad con signo) dentro de la transacción del llamador."""
+    cursor.execute('''
+        INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, venta_id, usuario_id, notas)
+        SELECT id, ?, ?, stock_actual, ?, ?, ? FROM Productos WHERE id = ?
+    ''', (tipo, cantidad, venta_id, usuario_id, notas, producto_id))
+
+def registrar_movimiento_stock(producto_id, cantidad, tipo_movimiento, notas=None, usuario_id=None, venta_id=None):
     """
-    Registra una entrada o salida de stock.
-    tipo_movimiento: 'entrada' o 'salida'
-    cantidad: debe ser positiva.
-    Retorna True si fue exitoso, False si no (ej. stock insuficiente para salida).
+    Registra un movimiento de stock y aplica el cambio de forma atómica (UPDATE con delta en la misma
+    transacción que la inserción en MovimientosStock; no hay lectura previa que pueda quedar desfasada).
+    tipo_movimiento: 'entrada', 'salida', 'devolucion' (cantidad positiva, el signo lo da el tipo)
+                     o 'ajuste' (cantidad con signo: positiva suma, negativa resta).
+    Retorna True si fue exitoso, False si no (ej. stock insuficiente para salida, producto inactivo).
     """
-    if cantidad <= 0: return False
-
-    producto = obtener_producto_por_id(producto_id)
-    if not producto: return False
-
-    nuevo_stock = producto['stock_actual']
-    if tipo_movimiento == 'entrada':
-        nuevo_stock += cantidad
-    elif tipo_movimiento == 'salida':
-        if producto['stock_actual'] >= cantidad:
-            nuevo_stock -= cantidad
-        else:
-            # print(f"Stock insuficiente para {producto['nombre_producto']}. Solicitado: {cantidad}, Disponible: {producto['stock_actual']}")
-            return False # Stock insuficiente
+    if tipo_movimiento == 'ajuste':
+        delta = cantidad
+    elif tipo_movimiento in SIGNO_MOVIMIENTO and cantidad > 0:
+        delta = SIGNO_MOVIMIENTO[tipo_movimiento] * cantidad
     else:
-        return False # Tipo de movimiento no válido
+        return False # Tipo de movimiento no válido o cantidad no positiva
+    if not delta:
+        return False
 
-    # TODO: En un sistema completo, esto también se registraría en una tabla de 'MovimientosStock'
-    # para auditoría: (producto_id, fecha, tipo, cantidad, usuario_id, notas)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute('''
+            UPDATE Productos
+            SET stock_actual = stock_actual + ?,
+                fecha_ultima_modificacion = CURRENT_TIMESTAMP
+            WHERE id = ? AND activo = TRUE AND stock_actual + ? >= 0
+        ''', (delta, producto_id, delta))
+        if cursor.rowcount == 0: # Producto inexistente/inactivo o stock insuficiente
+            conn.rollback()
+            return False
+        _insertar_movimiento(cursor, producto_id, tipo_movimiento, delta, venta_id, usuario_id, notas)
+        conn.commit()
+        _marcar_indice_productos_pendiente()
+        return True
+    except sqlite3.Error as e:
+        print(f"Error al registrar movimiento de stock: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        return False
+    finally:
+        conn.close()
 
-    return actualizar_producto(producto_id, stock_actual=nuevo_stock)
+def listar_movimientos_stock(producto_id=None, fecha_inicio=None, fecha_fin=None, tipo=None, limit=100):
+    """Movimientos más recientes primero, con filtros opcionales (usa los índices por producto y por fecha)."""
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
+    conditions = []
+    params = []
+    if producto_id:
+        conditions.append("m.producto_id = ?")
+        params.append(producto_id)
+    if desde:
+        conditions.append("m.fecha >= ?")
+        params.append(desde)
+    if hasta:
+        conditions.append("m.fecha < ?")
+        params.append(hasta)
+    if tipo:
+        conditions.append("m.tipo = ?")
+        params.append(tipo)
+    query = '''
+        SELECT m.*, p.nombre_producto, u.nombre_usuario
+        FROM MovimientosStock m
+        JOIN Productos p ON m.producto_id = p.id
+        LEFT JOIN Usuarios u ON m.usuario_id = u.id
+    '''
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY m.id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    conn = get_db_connection()
+    try:
+        return [dict(m) for m in conn.execute(query, tuple(params)).fetchall()]
+    finally:
+        conn.close()
 
-# --- Funciones de Ventas ---
-def registrar_nueva_venta(usuario_id, detalles_productos, total_venta, cliente_nombre=None, cliente_identificacion=None, monto_recibido=None, cambio_entregado=None, tipo_pago='efectivo', estado_venta='completada', notas=None):
+def crear_snapshot_stock():
     """
-    Registra una nueva venta y actualiza el stock de los productos.
-    detalles_productos: lista de dicts, cada uno con:
-                        {'producto_id', 'cantidad', 'precio_unitario_venta', 'subtotal_linea', 'descuento_linea'(opcional)}
+    Guarda una foto del stock de todos los productos junto con el último movimiento incluido.
+    Retorna la fecha de corte o None si falló.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        # Iniciar transacción
-        cursor.execute("BEGIN TRANSACTION")
-
-        # 1. Insertar en Ventas
+        cursor.execute("BEGIN IMMEDIATE") # Stock y último movimiento deben leerse sin ventas intercaladas
+        fecha_corte = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
         cursor.execute('''
-            INSERT INTO Ventas (usuario_id, cliente_nombre, cliente_identificacion, total_venta,
-                                monto_recibido, cambio_entregado, tipo_pago, estado_venta, notas)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (usuario_id, cliente_nombre, cliente_identificacion, total_venta,
-              monto_recibido, cambio_entregado, tipo_pago, estado_venta, notas))
-        venta_id = cursor.lastrowid
-
-        if not venta_id:
-            raise sqlite3.Error("No se pudo obtener el ID de la nueva venta.")
-
-        # 2. Insertar en DetallesVenta y actualizar stock
-        for item in detalles_productos:
-            producto_id = item['producto_id']
-            cantidad_vendida = item['cantidad']
-
-            # Insertar detalle de venta
+            INSERT OR IGNORE INTO SnapshotsStock (fecha_corte, producto_id, stock, ultimo_movimiento_id)
+            SELECT ?, id, stock_actual, (SELECT COALESCE(MAX(id), 0) FROM MovimientosStock)
+            FROM Productos
+        ''', (fecha_corte,))
+        conn.commit()
+        return fecha_corte
+    except sqlite3.Error as e:
+        print(f"Error al crear snapshot de stock: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+def asegurar_snapshot_stock_periodico(intervalo_dias=SNAPSHOT_STOCK_INTERVALO_DIAS):
+    """Crea una foto de stock si la última tiene más de intervalo_dias. Retorna la fecha de corte creada o None."""
+    conn = get_db_connection()
+    try:
+        ultima = conn.execute("SELECT MAX(fecha_corte) FROM SnapshotsStock").fetchone()[0]
+        vencida = conn.execute("SELECT ? IS NULL OR ? < datetime('now', ?)",
+                               (ultima, ultima, f"-{int(intervalo_dias)} days")).fetchone()[0]
+    finally:
+        conn.close()
+    return crear_snapshot_stock() if vencida else None
+
+def obtener_stock_a_fecha(fecha, producto_id=None):
+    """
+    Stock al cierre de `fecha` ('YYYY-MM-DD'): la última foto anterior más los movimientos posteriores
+    a ella (una cola acotada, no todo el historial). Sin fotos previas se suman todos los movimientos.
+    Retorna el stock (int) si se indica producto_id, o dict {producto_id: stock} para todos los productos.
+    Fechas anteriores al saldo 'inicial' (migración 5) no tienen historial y devuelven 0.
+    """
+    _, hasta = rango_fechas_semiabierto(None, fecha)
+    filtro_producto = " AND producto_id = ?" if producto_id else ""
+    params_producto = (producto_id,) if producto_id else ()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        stock = {}
+        ultimo_movimiento_id = 0
+        corte = cursor.execute("SELECT MAX(fecha_corte) FROM SnapshotsStock WHERE fecha_corte < ?", (hasta,)).fetchone()[0]
+        if corte:
+            cursor.execute(f"SELECT producto_id, stock, ultimo_movimiento_id FROM SnapshotsStock WHERE fecha_corte = ?{filtro_producto}",
+                           (corte,) + params_producto)
+            for pid, cantidad, ultimo in cursor.fetchall():
+                stock[pid] = cantidad
+                ultimo_movimiento_id = ultimo
+            if not stock: # El producto no existía en la foto: su historial empieza después
+                ultimo_movimiento_id = cursor.execute("SELECT ultimo_movimiento_id FROM SnapshotsStock WHERE fecha_corte = ? LIMIT 1",
+                                                      (corte,)).fetchone()[0]
+        # Cola acotada: por producto se recorre el índice (producto_id, fecha) desde la foto;
+        # para todos, el rango de ids posterior a la foto (+producto_id evita recorrer el índice completo)
+        if producto_id:
             cursor.execute('''
-                INSERT INTO DetallesVenta (venta_id, producto_id, cantidad, precio_unitario_venta,
-                                         subtotal_linea, descuento_linea)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (venta_id, producto_id, cantidad_vendida, item['precio_unitario_venta'],
-                  item['subtotal_linea'], item.get('descuento_linea', 0)))
-
-            # Actualizar stock del producto
-            # Usar una subconsulta para asegurar la atomicidad de la lectura y escritura del stock
+                SELECT producto_id, SUM(cantidad) FROM MovimientosStock
+                WHERE producto_id = ? AND fecha >= ? AND fecha < ? AND id > ?
+                GROUP BY producto_id
+            ''', (producto_id, corte or '', hasta, ultimo_movimiento_id))
+        else:
             cursor.execute('''
+                SELECT producto_id, SUM(cantidad) FROM MovimientosStock
+                WHERE id > ? AND fecha < ?
+                GROUP BY +producto_id
+            ''', (ultimo_movimiento_id, hasta))
+        for pid, delta in cursor.fetchall():
+            stock[pid] = stock.get(pid, 0) + delta
+    finally:
+        conn.close()
+    if producto_id:
+        return stock.get(producto_id, 0)
+    return stock
+
+# --- Funciones de Ventas ---
+PRODUCTOS_POR_SENTENCIA_VENTA = 250 # 2 parámetros por producto en las listas VALUES
+
+def _lotes_pedido(cantidades):
+    """Divide [(producto_id, cantidad)] en lotes con su lista VALUES y parámetros."""
+    pares = list(cantidades.items())
+    for inicio in range(0, len(pares), PRODUCTOS_POR_SENTENCIA_VENTA):
+        lote = pares[inicio:inicio + PRODUCTOS_POR_SENTENCIA_VENTA]
+        valores = ", ".join(["(?, ?)"] * len(lote))
+        yield valores, [x for par in lote for x in par]
+
+def _insertar_venta(cursor, usuario_id, detalles_productos, total_venta, cliente_nombre=None, cliente_identificacion=None, monto_recibido=None, cambio_entregado=None, tipo_pago='efectivo', estado_venta='completada', notas=None):
+    """
+    Cuerpo de la venta dentro de una transacción ya abierta por el llamador (no hace commit ni rollback):
+    una verificación de faltantes para todo el ticket, un executemany de los detalles y un único UPDATE de stock.
+    Retorna {'success': True, 'venta_id': id, 'fecha_venta': ...} o {'error', 'faltantes'} sin haber
+    escrito nada; los errores de SQLite se propagan.
+    """
+    if not detalles_productos:
+        return {"error": "La venta no tiene productos.", "faltantes": []}
+
+    cantidades = {} # Cantidad total por producto (un producto puede venir en varias líneas)
+    for item in detalles_productos:
+        cantidades[item['producto_id']] = cantidades.get(item['producto_id'], 0) + item['cantidad']
+
+    # 1. Faltantes de todo el ticket en una consulta
+    faltantes = []
+    for valores, params in _lotes_pedido(cantidades):
+        cursor.execute(f'''
+            WITH pedido(producto_id, cantidad) AS (VALUES {valores})
+            SELECT pedido.producto_id, p.nombre_producto, p.stock_actual, pedido.cantidad
+            FROM pedido
+            LEFT JOIN Productos p ON p.id = pedido.producto_id
+            WHERE p.id IS NULL OR p.stock_actual < pedido.cantidad
+        ''', params)
+        faltantes.extend({'producto_id': f[0], 'nombre_producto': f[1], 'stock_disponible': f[2], 'cantidad_solicitada': f[3]}
+                         for f in cursor.fetchall())
+    if faltantes:
+        descripcion = "; ".join(
+            f"{f['nombre_producto'] or 'ID ' + str(f['producto_id'])} (Disponible: {f['stock_disponible'] if f['stock_disponible'] is not None else 'no existe'}, Solicitado: {f['cantidad_solicitada']})"
+            for f in faltantes)
+        return {"error": f"Stock insuficiente o producto no encontrado: {descripcion}.", "faltantes": faltantes}
+
+    # 2. Insertar en Ventas
+    cursor.execute('''
+        INSERT INTO Ventas (usuario_id, cliente_nombre, cliente_identificacion, total_venta,
+                          monto_recibido, cambio_entregado, tipo_pago, estado_venta, notas)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (usuario_id, cliente_nombre, cliente_identificacion, total_venta,
+          monto_recibido, cambio_entregado, tipo_pago, estado_venta, notas))
+    venta_id = cursor.lastrowid
+
+    if not venta_id:
+        raise sqlite3.Error("No se pudo obtener el ID de la nueva venta.")
+
+    # 3. Todos los detalles de una vez
+    cursor.executemany('''
+        INSERT INTO DetallesVenta (venta_id, producto_id, cantidad, precio_unitario_venta,
+                                 subtotal_linea, descuento_linea)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(venta_id, item['producto_id'], item['cantidad'], item['precio_unitario_venta'],
+           item['subtotal_linea'], item.get('descuento_linea', 0)) for item in detalles_productos])
+
+    # 4. Descontar el stock de todos los productos en una sentencia (UPDATE ... FROM, SQLite 3.33+)
+    actualizados = 0
+    if sqlite3.sqlite_version_info >= (3, 33, 0):
+        for valores, params in _lotes_pedido(cantidades):
+            cursor.execute(f'''
+                WITH pedido(producto_id, cantidad) AS (VALUES {valores})
                 UPDATE Productos
-                SET stock_actual = stock_actual - ?,
+                SET stock_actual = stock_actual - pedido.cantidad,
                     fecha_ultima_modificacion = CURRENT_TIMESTAMP
-                WHERE id = ? AND stock_actual >= ?
-            ''', (cantidad_vendida, producto_id, cantidad_vendida))
+                FROM pedido
+                WHERE Productos.id = pedido.producto_id
+            ''', params)
+            # rowcount no se informa para sentencias que empiezan con WITH; changes() sí (sin contar triggers)
+            actualizados += cursor.execute("SELECT changes()").fetchone()[0]
+    else:
+        cursor.executemany('''
+            UPDATE Productos
+            SET stock_actual = stock_actual - ?,
+                fecha_ultima_modificacion = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', [(cantidad, producto_id) for producto_id, cantidad in cantidades.items()])
+        actualizados = cursor.rowcount
+    if actualizados != len(cantidades):
+        raise sqlite3.Error(f"Se esperaban {len(cantidades)} productos actualizados y se actualizaron {actualizados}.")
+
+    # 5. Libro de movimientos: una salida por producto con el stock resultante
+    for valores, params in _lotes_pedido(cantidades):
+        cursor.execute(f'''
+            WITH pedido(producto_id, cantidad) AS (VALUES {valores})
+            INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, venta_id, usuario_id)
+            SELECT p.id, 'venta', -pedido.cantidad, p.stock_actual, ?, ?
+            FROM pedido JOIN Productos p ON p.id = pedido.producto_id
+        ''', params + [venta_id, usuario_id])
+
+    # 6. Resúmenes diarios para reportes
+    if estado_venta == 'completada':
+        _acumular_resumenes_venta(cursor, venta_id)
+
+    cursor.execute("SELECT fecha_venta FROM Ventas WHERE id = ?", (venta_id,))
+    return {"success": True, "venta_id": venta_id, "fecha_venta": cursor.fetchone()[0]}
+
+def _acumular_resumenes_venta(cursor, venta_id, signo=1):
+    """
+    Suma (signo=1, venta confirmada) o resta (signo=-1, venta cancelada) una venta en los
+    resúmenes diarios (migración 6), dentro de la transacción del llamador.
+    """
+    cursor.execute('''
+        INSERT INTO ResumenVentasDiaPago (dia, tipo_pago, num_ventas, total)
+        SELECT substr(fecha_venta, 1, 10), COALESCE(tipo_pago, ''), ?, ? * total_venta FROM Ventas WHERE id = ?
+        ON CONFLICT (dia, tipo_pago) DO UPDATE SET num_ventas = num_ventas + excluded.num_ventas, total = total + excluded.total
+    ''', (signo, signo, venta_id))
+    cursor.execute('''
+        INSERT INTO ResumenVentasDiaUsuario (dia, usuario_id, num_ventas, total)
+        SELECT substr(fecha_venta, 1, 10), usuario_id, ?, ? * total_venta FROM Ventas WHERE id = ?
+        ON CONFLICT (dia, usuario_id) DO UPDATE SET num_ventas = num_ventas + excluded.num_ventas, total = total + excluded.total
+    ''', (signo, signo, venta_id))
+    cursor.execute('''
+        INSERT INTO ResumenVentasDiaProducto (dia, producto_id, num_tickets, cantidad, total)
+        SELECT substr(v.fecha_venta, 1, 10), dv.producto_id, ?, ? * SUM(dv.cantidad), ? * SUM(dv.subtotal_linea)
+        FROM DetallesVenta dv JOIN Ventas v ON v.id = dv.venta_id
+        WHERE dv.venta_id = ?
+        GROUP BY dv.producto_id
+        ON CONFLICT (dia, producto_id) DO UPDATE SET num_tickets = num_tickets + excluded.num_tickets,
+            cantidad = cantidad + excluded.cantidad, total = total + excluded.total
+    ''', (signo, signo, signo, venta_id))
 
-            if cursor.rowcount == 0:
-                # Esto significa que el stock no fue suficiente o el producto no existe (aunque debería haberse verificado antes)
-                producto_info = obtener_producto_por_id(producto_id) # Para mensaje de error
-                nombre_prod_error = producto_info['nombre_producto'] if producto_info else f"ID {producto_id}"
-                raise sqlite3.Error(f"Stock insuficiente para el producto: {nombre_prod_error} (ID: {producto_id}) o producto no encontrado.")
+# Transacciones de venta abiertas en este proceso: los backups programados esperan a que terminen
+_ventas_en_curso = {'valor': 0}
+_ventas_en_curso_lock = threading.Lock()
 
+def _cambiar_ventas_en_curso(delta):
+    with _ventas_en_curso_lock:
+        _ventas_en_curso['valor'] += delta
+
+def hay_venta_en_curso():
+    """True si este proceso tiene abierta una transacción de venta (individual o en lote)."""
+    return _ventas_en_curso['valor'] > 0
+
+def _despues_de_confirmar_ventas(dias=None):
+    """
+    Invalida los datos derivados tras confirmar o cancelar una o varias ventas.
+    dias: días ('YYYY-MM-DD') de las ventas afectadas; None si no se conocen.
+    """
+    _notificar_cambio_ventas(dias)
+    _marcar_indice_productos_pendiente() # Stock descontado
+
+def registrar_nueva_venta_detallada(usuario_id, detalles_productos, total_venta, cliente_nombre=None, cliente_identificacion=None, monto_recibido=None, cambio_entregado=None, tipo_pago='efectivo', estado_venta='completada', notas=None):
+    """
+    Registra una nueva venta y descuenta el stock con sentencias por conjunto (ver _insertar_venta),
+    en una transacción BEGIN IMMEDIATE y sin abrir otras conexiones, para que el bloqueo de escritura dure lo mínimo.
+    detalles_productos: lista de dicts, cada uno con:
+                        {'producto_id', 'cantidad', 'precio_unitario_venta', 'subtotal_linea', 'descuento_linea'(opcional)}
+    Retorna {'success': True, 'venta_id': id} o {'error': mensaje, 'faltantes': [...]}, donde cada faltante es
+    {'producto_id', 'nombre_producto', 'stock_disponible', 'cantidad_solicitada'} (nombre y stock None si el producto no existe).
+    """
+    if not detalles_productos:
+        return {"error": "La venta no tiene productos.", "faltantes": []}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    _cambiar_ventas_en_curso(1)
+    try:
+        # El bloqueo de escritura se toma al inicio: el stock verificado no puede cambiar antes del UPDATE
+        cursor.execute("BEGIN IMMEDIATE")
+        resultado = _insertar_venta(cursor, usuario_id, detalles_productos, total_venta, cliente_nombre,
+                                    cliente_identificacion, monto_recibido, cambio_entregado, tipo_pago, estado_venta, notas)
+        if not resultado.get("success"):
+            conn.rollback()
+            return resultado
         # Confirmar transacción
         conn.commit()
-        return venta_id
+        _despues_de_confirmar_ventas({resultado["fecha_venta"][:10]})
+        return resultado
 
     except sqlite3.Error as e:
         print(f"Error en transacción de venta: {e}")
-        if conn:
+        if conn.in_transaction:
             conn.rollback()
-        return None # Indicar fallo
+        return {"error": f"Error en transacción de venta: {e}", "faltantes": []}
     finally:
-        if conn:
-            conn.close()
+        _cambiar_ventas_en_curso(-1)
+        conn.close()
+
+def registrar_lote_ventas(ventas):
+    """
+    Confirma varias ventas en una sola transacción (group commit: un fsync para todo el lote).
+    Cada venta va en su propio SAVEPOINT, así una venta con faltantes o con error se descarta
+    sin afectar a las demás.
+    ventas: lista de dicts con los argumentos de registrar_nueva_venta_detallada.
+    Retorna una lista de resultados en el mismo orden (mismo formato que registrar_nueva_venta_detallada).
+    Si falla el COMMIT, todas las ventas del lote devuelven error.
+    """
+    if not ventas:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    resultados = []
+    _cambiar_ventas_en_curso(1)
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for venta in ventas:
+            cursor.execute("SAVEPOINT venta")
+            try:
+                resultado = _insertar_venta(cursor, **venta)
+            except (sqlite3.Error, KeyError, TypeError) as e:
+                print(f"Error en transacción de venta: {e}")
+                resultado = {"error": f"Error en transacción de venta: {e}", "faltantes": []}
+            if not resultado.get("success"):
+                cursor.execute("ROLLBACK TO venta")
+            cursor.execute("RELEASE venta")
+            resultados.append(resultado)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error al confirmar el lote de ventas: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        return [{"error": f"Error en transacción de venta: {e}", "faltantes": []} for _ in ventas]
+    finally:
+        _cambiar_ventas_en_curso(-1)
+        conn.close()
+    dias = {r["fecha_venta"][:10] for r in resultados if r.get("success")}
+    if dias:
+        _despues_de_confirmar_ventas(dias)
+    return resultados
+
+def registrar_nueva_venta(usuario_id, detalles_productos, total_venta, cliente_nombre=None, cliente_identificacion=None, monto_recibido=None, cambio_entregado=None, tipo_pago='efectivo', estado_venta='completada', notas=None):
+    """
+    Registra una nueva venta y actualiza el stock de los productos.
+    Retorna el ID de la venta o None si falló (ver registrar_nueva_venta_detallada para el motivo).
+    """
+    resultado = registrar_nueva_venta_detallada(usuario_id, detalles_productos, total_venta, cliente_nombre,
+                                                cliente_identificacion, monto_recibido, cambio_entregado,
+                                                tipo_pago, estado_venta, notas)
+    if resultado.get("success"):
+        return resultado["venta_id"]
+    if resultado.get("faltantes"):
+        print(f"Error en transacción de venta: {resultado['error']}")
+    return None
 
 def obtener_venta_por_id(venta_id_buscada):
     conn = get_db_connection()
@@ -795,8 +1629,104 @@ def obtener_venta_por_id(venta_id_buscada):
     conn.close()
     return venta_resultado
 
+def cancelar_venta(venta_id, usuario_id=None, motivo=None):
+    """
+    Cancela una venta completada y devuelve su mercancía al stock (movimientos 'devolucion'),
+    todo en una transacción.
+    Retorna {'success': True} o {'error': mensaje}.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT fecha_venta FROM Ventas WHERE id = ?", (venta_id,))
+        fila = cursor.fetchone()
+        cursor.execute('''
+            UPDATE Ventas
+            SET estado_venta = 'cancelada',
+                notas = CASE WHEN ? IS NULL THEN notas ELSE COALESCE(notas || ' | ', '') || 'CANCELADA: ' || ? END
+            WHERE id = ? AND estado_venta = 'completada'
+        ''', (motivo, motivo, venta_id))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return {"error": "La venta no existe o no está completada."}
+        cursor.execute('''
+            UPDATE Productos
+            SET stock_actual = stock_actual + (SELECT SUM(d.cantidad) FROM DetallesVenta d
+                                               WHERE d.venta_id = ? AND d.producto_id = Productos.id),
+                fecha_ultima_modificacion = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT producto_id FROM DetallesVenta WHERE venta_id = ?)
+        ''', (venta_id, venta_id))
+        cursor.execute('''
+            INSERT INTO MovimientosStock (producto_id, tipo, cantidad, stock_resultante, venta_id, usuario_id, notas)
+            SELECT d.producto_id, 'devolucion', SUM(d.cantidad), p.stock_actual, ?, ?, ?
+            FROM DetallesVenta d JOIN Productos p ON p.id = d.producto_id
+            WHERE d.venta_id = ?
+            GROUP BY d.producto_id
+        ''', (venta_id, usuario_id, motivo, venta_id))
+        _acumular_resumenes_venta(cursor, venta_id, signo=-1)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error al cancelar la venta {venta_id}: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        return {"error": f"Error al cancelar la venta: {e}"}
+    finally:
+        conn.close()
+    _despues_de_confirmar_ventas({fila['fecha_venta'][:10]}) # Cambian los reportes del día de la venta, no los de hoy
+    return {"success": True}
+
+
+# Caché de totales del historial: el COUNT(*) exacto solo se recalcula si hubo ventas nuevas
+# (o tras el TTL, por ventas registradas desde otra terminal).
+CONTEO_VENTAS_TTL_S = 30
+_cache_conteos_ventas = {} # (condiciones, parámetros) -> (total, versión de ventas, instante)
+_version_ventas = {'valor': 0}
+_cache_conteos_lock = threading.Lock()
+_oyentes_cambios_ventas = [] # Funciones llamadas con los días de ventas afectados (p. ej. caché de reportes)
 
-def listar_ventas_modelo(fecha_inicio=None, fecha_fin=None, usuario_id_filtro=None, cliente_filtro=None, page=1, limit=25):
+def registrar_oyente_cambios_ventas(funcion):
+    """
+    Registra funcion(dias) para que se llame tras confirmar o cancelar ventas en este proceso.
+    dias es un conjunto de fechas 'YYYY-MM-DD' (de Ventas.fecha_venta) o None si no se conocen.
+    """
+    if funcion not in _oyentes_cambios_ventas:
+        _oyentes_cambios_ventas.append(funcion)
+
+def _notificar_cambio_ventas(dias=None):
+    """Se llama tras confirmar una venta para invalidar datos derivados (conteos, etc.)."""
+    with _cache_conteos_lock:
+        _version_ventas['valor'] += 1
+        _cache_conteos_ventas.clear()
+    for oyente in list(_oyentes_cambios_ventas):
+        try:
+            oyente(dias)
+        except Exception as e: # Un oyente con error no debe afectar a la venta ya confirmada
+            print(f"Error al notificar cambio de ventas: {e}")
+
+def _contar_ventas(cursor, where_sql, params):
+    clave = (where_sql, tuple(params))
+    ahora = time.monotonic()
+    with _cache_conteos_lock:
+        version = _version_ventas['valor']
+        entrada = _cache_conteos_ventas.get(clave)
+        if entrada and entrada[1] == version and ahora - entrada[2] < CONTEO_VENTAS_TTL_S:
+            return entrada[0]
+    cursor.execute(f"SELECT COUNT(*) FROM Ventas v JOIN Usuarios u ON v.usuario_id = u.id{where_sql}", tuple(params))
+    total = cursor.fetchone()[0]
+    with _cache_conteos_lock:
+        if _version_ventas['valor'] == version:
+            _cache_conteos_ventas[clave] = (total, version, ahora)
+    return total
+
+def listar_ventas_modelo(fecha_inicio=None, fecha_fin=None, usuario_id_filtro=None, cliente_filtro=None, page=1, limit=25, cursor_pagina=None, contar_total=True):
+    """
+    Historial de ventas, más recientes primero, ordenado por (fecha_venta, id) descendente.
+    cursor_pagina: (fecha_venta, id) de la última venta de la página anterior. Si se indica, la página
+                   se obtiene por clave (keyset) y `page` se ignora, así la página 400 cuesta lo mismo que la 1.
+    contar_total: si es False no se calcula el total de registros (el conteo exacto se cachea igualmente).
+    """
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -808,12 +1738,12 @@ def listar_ventas_modelo(fecha_inicio=None, fecha_fin=None, usuario_id_filtro=No
     conditions = []
     params = []
 
-    if fecha_inicio:
-        conditions.append("date(v.fecha_venta) >= date(?)") # Comparar solo la fecha
-        params.append(fecha_inicio)
-    if fecha_fin:
-        conditions.append("date(v.fecha_venta) <= date(?)")
-        params.append(fecha_fin)
+    if desde:
+        conditions.append("v.fecha_venta >= ?") # Rango semiabierto: sin date() para poder usar los índices
+        params.append(desde)
+    if hasta:
+        conditions.append("v.fecha_venta < ?")
+        params.append(hasta)
     if usuario_id_filtro:
         conditions.append("v.usuario_id = ?")
         params.append(usuario_id_filtro)
@@ -822,60 +1752,140 @@ def listar_ventas_modelo(fecha_inicio=None, fecha_fin=None, usuario_id_filtro=No
         params.append(f"%{cliente_filtro}%")
         params.append(f"%{cliente_filtro}%")
 
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
+    where_sql = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    # Total de registros para paginación (sin el cursor, que solo delimita la página)
+    total_registros = _contar_ventas(cursor, where_sql, params) if contar_total else None
 
-    query += " ORDER BY v.fecha_venta DESC" # Más recientes primero
+    if cursor_pagina:
+        conditions.append("(v.fecha_venta, v.id) < (?, ?)")
+        params.extend(cursor_pagina)
+        where_sql = " WHERE " + " AND ".join(conditions)
 
-    # Para contar total de registros para paginación (antes de aplicar LIMIT/OFFSET)
-    count_query = query.replace("v.id, v.fecha_venta, u.nombre_usuario, v.cliente_nombre, v.total_venta, v.tipo_pago, v.estado_venta", "COUNT(*)")
-    cursor.execute(count_query, tuple(params))
-    total_registros = cursor.fetchone()[0]
+    query += where_sql + " ORDER BY v.fecha_venta DESC, v.id DESC" # Más recientes primero
 
     if limit:
-        query += " LIMIT ? OFFSET ?"
-        params.extend([limit, (page - 1) * limit])
+        if cursor_pagina:
+            query += " LIMIT ?"
+            params.append(limit)
+        else:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([limit, (page - 1) * limit])
 
     cursor.execute(query, tuple(params))
-    ventas = cursor.fetchall()
+    ventas = [dict(v) for v in cursor.fetchall()]
     conn.close()
 
+    siguiente_cursor = None
+    if limit and len(ventas) == limit:
+        siguiente_cursor = (ventas[-1]['fecha_venta'], ventas[-1]['id'])
+
+    total_paginas = None
+    if total_registros is not None:
+        total_paginas = (total_registros + limit - 1) // limit if limit else 1
+
     return {
-        "ventas": [dict(v) for v in ventas],
+        "ventas": ventas,
         "total_registros": total_registros,
         "pagina_actual": page,
-        "total_paginas": (total_registros + limit - 1) // limit if limit > 0 else 1
+        "total_paginas": total_paginas,
+        "siguiente_cursor": siguiente_cursor
     }
 
 # --- Funciones para Reportes ---
+def rango_fechas_semiabierto(fecha_inicio=None, fecha_fin=None):
+    """
+    Convierte fechas 'YYYY-MM-DD' (ambas inclusivas) en el rango semiabierto [desde, hasta)
+    que se compara directamente contra Ventas.fecha_venta ('YYYY-MM-DD HH:MM:SS').
+    Así la columna no queda envuelta en date() y las consultas pueden usar los índices.
+    También acepta date, datetime o 'YYYY-MM-DD HH:MM:SS' (se toma el día completo).
+    Lanza ValueError si alguna fecha no tiene formato válido.
+    """
+    desde = _dia_de_fecha(fecha_inicio).isoformat() if fecha_inicio else None
+    hasta = (_dia_de_fecha(fecha_fin) + timedelta(days=1)).isoformat() if fecha_fin else None
+    return desde, hasta
+
+def _dia_de_fecha(fecha):
+    """Día de una fecha date/datetime o texto ISO; valida el texto completo, no solo sus 10 primeros caracteres."""
+    if isinstance(fecha, datetime):
+        return fecha.date()
+    if isinstance(fecha, date):
+        return fecha
+    if not isinstance(fecha, str):
+        raise ValueError(f"Fecha inválida: {fecha!r}")
+    if len(fecha) == 10:
+        return date.fromisoformat(fecha)
+    return datetime.fromisoformat(fecha).date()
+
+def _rango_en_dias_completos(fecha_inicio, fecha_fin):
+    """True si el rango son días completos ('YYYY-MM-DD'), que es lo que guardan los resúmenes diarios."""
+    return all(f is None or len(str(f)) == 10 for f in (fecha_inicio, fecha_fin))
+
+def huella_ventas_periodo(fecha_inicio, fecha_fin):
+    """
+    (ventas, total) de los días del rango según ResumenVentasDiaPago: a lo sumo una fila por día y tipo
+    de pago, leídas por su clave primaria. Cambia al confirmar o cancelar ventas de esos días, también
+    desde otra terminal, así que sirve para comprobar si un reporte guardado sigue vigente.
+    """
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
+    conn = get_db_connection()
+    try:
+        fila = conn.execute('''
+            SELECT COALESCE(SUM(num_ventas), 0), TOTAL(total)
+            FROM ResumenVentasDiaPago
+            WHERE dia >= ? AND dia < ?
+        ''', (desde, hasta)).fetchone()
+    finally:
+        conn.close()
+    return tuple(fila)
+
 def obtener_resumen_ventas_periodo(fecha_inicio, fecha_fin):
     """
     Calcula el total de ventas, número de transacciones y desglose por tipo de pago
-    para un período dado.
+    para un período dado. Con días completos lee ResumenVentasDiaPago (una fila por día y tipo de pago).
     """
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
     conn = get_db_connection()
     cursor = conn.cursor()
 
+    if _rango_en_dias_completos(fecha_inicio, fecha_fin):
+        cursor.execute('''
+            SELECT NULLIF(tipo_pago, '') AS tipo_pago, SUM(total) AS total_por_tipo, SUM(num_ventas) AS transacciones_por_tipo
+            FROM ResumenVentasDiaPago
+            WHERE dia >= ? AND dia < ?
+            GROUP BY tipo_pago
+            HAVING SUM(num_ventas) > 0
+        ''', (desde, hasta))
+        desglose_tipo_pago = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        numero = sum(d['transacciones_por_tipo'] for d in desglose_tipo_pago)
+        total = sum(d['total_por_tipo'] for d in desglose_tipo_pago) if numero else None
+        return {
+            "resumen": {"numero_transacciones": numero, "total_ventas_periodo": total,
+                        "venta_promedio": total / numero if numero else None},
+            "desglose_tipo_pago": desglose_tipo_pago,
+        }
+
     query_resumen = '''
         SELECT
             COUNT(id) as numero_transacciones,
             SUM(total_venta) as total_ventas_periodo,
             AVG(total_venta) as venta_promedio
         FROM Ventas
-        WHERE date(fecha_venta) BETWEEN date(?) AND date(?)
-        AND estado_venta = 'completada'
+        WHERE estado_venta = 'completada'
+        AND fecha_venta >= ? AND fecha_venta < ?
     '''
-    cursor.execute(query_resumen, (fecha_inicio, fecha_fin))
+    cursor.execute(query_resumen, (desde, hasta))
     resumen = cursor.fetchone()
 
     query_tipo_pago = '''
         SELECT tipo_pago, SUM(total_venta) as total_por_tipo, COUNT(id) as transacciones_por_tipo
         FROM Ventas
-        WHERE date(fecha_venta) BETWEEN date(?) AND date(?)
-        AND estado_venta = 'completada'
+        WHERE estado_venta = 'completada'
+        AND fecha_venta >= ? AND fecha_venta < ?
         GROUP BY tipo_pago
     '''
-    cursor.execute(query_tipo_pago, (fecha_inicio, fecha_fin))
+    cursor.execute(query_tipo_pago, (desde, hasta))
     desglose_tipo_pago = [dict(row) for row in cursor.fetchall()]
 
     # Para obtener la lista detallada de ventas (opcional, para Excel)
@@ -883,10 +1893,10 @@ def obtener_resumen_ventas_periodo(fecha_inicio, fecha_fin):
     #     SELECT v.id, v.fecha_venta, u.nombre_usuario, v.cliente_nombre, v.total_venta, v.tipo_pago
     #     FROM Ventas v
     #     JOIN Usuarios u ON v.usuario_id = u.id
-    #     WHERE date(v.fecha_venta) BETWEEN date(?) AND date(?) AND v.estado_venta = 'completada'
+    #     WHERE v.estado_venta = 'completada' AND v.fecha_venta >= ? AND v.fecha_venta < ?
     #     ORDER BY v.fecha_venta
     # '''
-    # cursor.execute(query_detalle_ventas, (fecha_inicio, fecha_fin))
+    # cursor.execute(query_detalle_ventas, (desde, hasta))
     # ventas_detalladas = [dict(row) for row in cursor.fetchall()]
 
     conn.close()
@@ -897,59 +1907,92 @@ def obtener_resumen_ventas_periodo(fecha_inicio, fecha_fin):
         # "ventas_detalladas": ventas_detalladas
     }
 
-def obtener_productos_mas_vendidos(fecha_inicio, fecha_fin, top_n=10):
+# Métricas del ranking de productos: clave en el resultado -> columna calculada en la agregación.
+# margen_bruto usa el precio_compra actual del producto (no se guarda el costo histórico por venta).
+METRICAS_TOP_PRODUCTOS = {
+    'cantidad': ('top_por_cantidad', 'total_cantidad_vendida'),
+    'valor': ('top_por_valor', 'total_valor_vendido'),
+    'margen': ('top_por_margen', 'margen_bruto'),
+    'tickets': ('top_por_tickets', 'num_tickets'),
+}
+
+def _agregar_ventas_por_producto(cursor, fecha_inicio, fecha_fin):
+    """Una única agregación por producto con todas las métricas del período."""
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
+    if _rango_en_dias_completos(fecha_inicio, fecha_fin):
+        cursor.execute('''
+            SELECT p.id, p.codigo_barras, p.nombre_producto,
+                   SUM(r.cantidad) AS total_cantidad_vendida,
+                   SUM(r.total) AS total_valor_vendido,
+                   SUM(r.total) - SUM(r.cantidad) * p.precio_compra AS margen_bruto,
+                   SUM(r.num_tickets) AS num_tickets
+            FROM ResumenVentasDiaProducto r
+            JOIN Productos p ON r.producto_id = p.id
+            WHERE r.dia >= ? AND r.dia < ?
+            GROUP BY p.id
+            HAVING SUM(r.num_tickets) > 0
+        ''', (desde, hasta))
+    else:
+        cursor.execute('''
+            SELECT p.id, p.codigo_barras, p.nombre_producto,
+                   SUM(dv.cantidad) AS total_cantidad_vendida,
+                   SUM(dv.subtotal_linea) AS total_valor_vendido,
+                   SUM(dv.subtotal_linea) - SUM(dv.cantidad) * p.precio_compra AS margen_bruto,
+                   COUNT(DISTINCT dv.venta_id) AS num_tickets
+            FROM DetallesVenta dv
+            JOIN Productos p ON dv.producto_id = p.id
+            JOIN Ventas v ON dv.venta_id = v.id
+            WHERE v.estado_venta = 'completada' AND v.fecha_venta >= ? AND v.fecha_venta < ?
+            GROUP BY p.id
+        ''', (desde, hasta))
+    return [dict(row) for row in cursor.fetchall()]
+
+def obtener_productos_mas_vendidos(fecha_inicio, fecha_fin, top_n=10, metricas=('cantidad', 'valor')):
     """
-    Obtiene los N productos más vendidos por cantidad y por valor total.
+    Obtiene los N productos más vendidos para cada métrica pedida ('cantidad', 'valor', 'margen', 'tickets').
+    Se agrega una sola vez por producto y cada ranking sale de esa misma lista con heapq.nlargest
+    (montículo acotado a top_n), así añadir métricas no añade recorridos de las ventas.
+    Retorna {'top_por_cantidad': [...], 'top_por_valor': [...], ...}; cada fila trae todas las métricas.
     """
+    desconocidas = [m for m in metricas if m not in METRICAS_TOP_PRODUCTOS]
+    if desconocidas:
+        raise ValueError(f"Métricas no soportadas: {', '.join(desconocidas)}. Opciones: {', '.join(METRICAS_TOP_PRODUCTOS)}")
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Por cantidad
-    query_por_cantidad = '''
-        SELECT p.id, p.codigo_barras, p.nombre_producto, SUM(dv.cantidad) as total_cantidad_vendida
-        FROM DetallesVenta dv
-        JOIN Productos p ON dv.producto_id = p.id
-        JOIN Ventas v ON dv.venta_id = v.id
-        WHERE date(v.fecha_venta) BETWEEN date(?) AND date(?) AND v.estado_venta = 'completada'
-        GROUP BY p.id, p.nombre_producto
-        ORDER BY total_cantidad_vendida DESC
-        LIMIT ?
-    '''
-    cursor.execute(query_por_cantidad, (fecha_inicio, fecha_fin, top_n))
-    top_por_cantidad = [dict(row) for row in cursor.fetchall()]
+    try:
+        productos = _agregar_ventas_por_producto(conn.cursor(), fecha_inicio, fecha_fin)
+    finally:
+        conn.close()
 
-    # Por valor total
-    query_por_valor = '''
-        SELECT p.id, p.codigo_barras, p.nombre_producto, SUM(dv.subtotal_linea) as total_valor_vendido
-        FROM DetallesVenta dv
-        JOIN Productos p ON dv.producto_id = p.id
-        JOIN Ventas v ON dv.venta_id = v.id
-        WHERE date(v.fecha_venta) BETWEEN date(?) AND date(?) AND v.estado_venta = 'completada'
-        GROUP BY p.id, p.nombre_producto
-        ORDER BY total_valor_vendido DESC
-        LIMIT ?
-    '''
-    cursor.execute(query_por_valor, (fecha_inicio, fecha_fin, top_n))
-    top_por_valor = [dict(row) for row in cursor.fetchall()]
-
-    conn.close()
-    return {
-        "top_por_cantidad": top_por_cantidad,
-        "top_por_valor": top_por_valor
-    }
+    resultado = {}
+    for metrica in metricas:
+        clave, columna = METRICAS_TOP_PRODUCTOS[metrica]
+        resultado[clave] = heapq.nlargest(top_n, productos, key=lambda fila: fila[columna] or 0)
+    return resultado
 
 def obtener_ventas_agrupadas_por_usuario(fecha_inicio, fecha_fin):
+    desde, hasta = rango_fechas_semiabierto(fecha_inicio, fecha_fin)
     conn = get_db_connection()
     cursor = conn.cursor()
-    query = '''
-        SELECT u.nombre_usuario, COUNT(v.id) as numero_ventas, SUM(v.total_venta) as total_vendido_por_usuario
-        FROM Ventas v
-        JOIN Usuarios u ON v.usuario_id = u.id
-        WHERE date(v.fecha_venta) BETWEEN date(?) AND date(?) AND v.estado_venta = 'completada'
-        GROUP BY u.id, u.nombre_usuario
-        ORDER BY total_vendido_por_usuario DESC
-    '''
-    cursor.execute(query, (fecha_inicio, fecha_fin))
+    if _rango_en_dias_completos(fecha_inicio, fecha_fin):
+        query = '''
+            SELECT u.nombre_usuario, SUM(r.num_ventas) as numero_ventas, SUM(r.total) as total_vendido_por_usuario
+            FROM ResumenVentasDiaUsuario r
+            JOIN Usuarios u ON r.usuario_id = u.id
+            WHERE r.dia >= ? AND r.dia < ?
+            GROUP BY u.id, u.nombre_usuario
+            HAVING SUM(r.num_ventas) > 0
+            ORDER BY total_vendido_por_usuario DESC
+        '''
+    else:
+        query = '''
+            SELECT u.nombre_usuario, COUNT(v.id) as numero_ventas, SUM(v.total_venta) as total_vendido_por_usuario
+            FROM Ventas v
+            JOIN Usuarios u ON v.usuario_id = u.id
+            WHERE v.estado_venta = 'completada' AND v.fecha_venta >= ? AND v.fecha_venta < ?
+            GROUP BY u.id, u.nombre_usuario
+            ORDER BY total_vendido_por_usuario DESC
+        '''
+    cursor.execute(query, (desde, hasta))
     ventas_por_usuario = [dict(row) for row in cursor.fetchall()]
     conn.close()
     return ventas_por_usuario
@@ -962,6 +2005,7 @@ def procesar_fila_producto_excel(fila_datos, es_actualizacion=False):
     fila_datos: dict donde las claves son los nombres de las columnas del Excel.
     es_actualizacion: bool, si es True, se espera un 'id' o 'codigo_barras' para actualizar.
     Retorna: un dict con {'status': 'creado'/'actualizado'/'error', 'id': product_id, 'nombre': nombre, 'mensaje': ...}
+    Para archivos completos usar importador_productos, que procesa las filas por lotes.
     """
     # Mapeo esperado de columnas Excel a campos de la DB (ajustar según formato definido)
     # Se asume que el Excel tendrá nombres de columna que podemos mapear.
@@ -1065,7 +2109,7 @@ def procesar_fila_producto_excel(fila_datos, es_actualizacion=False):
             if not producto_data.get('precio_venta_menudeo'): # Precio venta es mandatorio para crear
                  return {'status': 'error', 'mensaje': f"Precio Venta Menudeo requerido para nuevo producto '{nombre_producto}'"}
 
-            nuevo_id = crear_producto(**producto_data)
+            nuevo_id = crear_producto(**{k: v for k, v in producto_data.items() if k != 'activo'}) # Los productos nuevos nacen activos
             if nuevo_id:
                 return {'status': 'creado', 'id': nuevo_id, 'nombre': nombre_producto, 'mensaje': 'Creado correctamente'}
             else:
@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import backup_manager
+import models
+import verificador_backups
+
+# Programador de backups en segundo plano.
+# Hasta ahora solo había backups al pulsar "exportar" en la configuración o antes de una importación.
+# Un hilo propio decide cuándo respaldar y lo hace sin ocupar la interfaz ni retrasar el cobro:
+# - base completa ('db') a cada una de HORAS_BACKUP_COMPLETO; si la aplicación estaba cerrada a esa
+#   hora, en la primera revisión tras abrirla;
+# - incremental cada INTERVALO_INCREMENTAL_MIN minutos, o antes si se confirmaron VENTAS_POR_INCREMENTAL
+#   ventas (se cuentan por Ventas.id, así entran también las de otras terminales);
+# - la copia de páginas va limitada a LIMITE_MB_POR_S y se detiene entre pasos mientras este proceso
+#   tiene una transacción de venta abierta (models.hay_venta_en_curso), como mucho ESPERA_MAXIMA_VENTA_S
+#   por pausa: la copia en línea no bloquea a las ventas, la pausa solo les deja el disco libre;
+# - al arrancar, los pos_backup_*.sql / *.db sin comprimir que queden en backup/ se comprimen y pasan
+#   al índice (backup_manager.archivar_backups_existentes), así también entran en la retención;
+# - tras un backup fallido (disco lleno, archivo bloqueado) no se reintenta hasta pasado un tiempo que
+#   empieza en INTERVALO_REVISION_S y se duplica con cada fallo seguido, hasta el intervalo incremental:
+#   sin esto cada venta confirmada despertaría al hilo y repetiría la copia completa cada segundo;
+# - cada ejecución queda en estadisticas() (duración, tiempo diferido por ventas, bytes escritos);
+# - tras cada backup se encolan los que falten por verificar (verificador_backups, otro proceso).
+
+HORAS_BACKUP_COMPLETO = ['06:00']
+INTERVALO_INCREMENTAL_MIN = 60
+VENTAS_POR_INCREMENTAL = 200
+LIMITE_MB_POR_S = 4.0         # Ritmo máximo de la copia de páginas
+PAGINAS_POR_PASO = 64
+TAMANO_PAGINA_ESTIMADO = 4096 # Para convertir el límite en MB/s en una pausa entre pasos
+ESPERA_MAXIMA_VENTA_S = 5     # Pausa máxima de la copia por una venta en curso
+INTERVALO_REVISION_S = 30     # Revisión periódica (además de la que dispara cada venta confirmada)
+SEPARACION_MINIMA_S = 1       # Como mucho una revisión por segundo aunque lleguen muchas ventas
+HISTORIAL_EJECUCIONES = 50
+
+
+class ProgramadorBackups:
+    def __init__(self, horas_completo=None, intervalo_incremental_min=INTERVALO_INCREMENTAL_MIN,
+                 ventas_por_incremental=VENTAS_POR_INCREMENTAL, limite_mb_por_s=LIMITE_MB_POR_S,
+                 paginas_por_paso=PAGINAS_POR_PASO):
+        self.horas_completo = list(horas_completo if horas_completo is not None else HORAS_BACKUP_COMPLETO)
+        self.intervalo_incremental_min = intervalo_incremental_min
+        self.ventas_por_incremental = ventas_por_incremental
+        self.paginas_por_paso = paginas_por_paso
+        self.pausa_s = paginas_por_paso * TAMANO_PAGINA_ESTIMADO / (limite_mb_por_s * 1e6) if limite_mb_por_s else 0
+        self._hilo = None
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self._lock = threading.Lock()
+        self._ultima_venta_respaldada = None # Ventas.id máximo al empezar el último backup
+        self._ultimo_incremental = time.monotonic()
+        self._diferido_actual = 0.0
+        self._fallos_seguidos = 0
+        self._reintentar_desde = 0.0 # time.monotonic() a partir del cual se puede reintentar tras un fallo
+        # Métricas
+        self.ejecuciones = 0
+        self.fallos = 0
+        self.sin_cambios = 0
+        self.duracion_total = 0.0
+        self.duracion_maxima = 0.0
+        self.diferido_total = 0.0
+        self.bytes_escritos = 0
+        self.historial = deque(maxlen=HISTORIAL_EJECUCIONES)
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._ultima_venta_respaldada = self._maximo_venta_id()
+        models.registrar_oyente_cambios_ventas(self._al_confirmar_ventas)
+        self._hilo = threading.Thread(target=self._bucle, name="ProgramadorBackups", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=30):
+        """Termina el hilo; un backup en curso se completa antes."""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+        self._hilo = None
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive() and not self._detener.is_set()
+
+    def _al_confirmar_ventas(self, dias):
+        self._despertar.set() # Solo despierta al hilo; la cuenta se hace allí
+
+    def _maximo_venta_id(self):
+        conn = models.get_db_connection()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM Ventas").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _ultima_hora_programada(self, ahora):
+        """Última hora de HORAS_BACKUP_COMPLETO ya alcanzada (hoy o ayer)."""
+        horas = []
+        for texto in self.horas_completo:
+            hora, minuto = (int(parte) for parte in texto.split(':'))
+            programada = ahora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+            horas.append(programada if programada <= ahora else programada - timedelta(days=1))
+        return max(horas) if horas else None
+
+    def _espera_tras_fallo(self):
+        """Espera antes de reintentar tras _fallos_seguidos fallos: se duplica hasta el intervalo incremental."""
+        maxima = max(INTERVALO_REVISION_S, self.intervalo_incremental_min * 60)
+        return min(INTERVALO_REVISION_S * 2 ** (self._fallos_seguidos - 1), maxima)
+
+    def _tarea_pendiente(self):
+        if time.monotonic() < self._reintentar_desde:
+            return None
+        ahora = datetime.now()
+        hito = self._ultima_hora_programada(ahora)
+        if hito is not None:
+            bases = [e for e in backup_manager.listar_backups() if e['tipo'] == 'db']
+            if not bases or datetime.fromisoformat(bases[0]['fecha']) < hito:
+                return 'db'
+        if self._maximo_venta_id() - self._ultima_venta_respaldada >= self.ventas_por_incremental:
+            return 'incremental'
+        if time.monotonic() - self._ultimo_incremental >= self.intervalo_incremental_min * 60:
+            return 'incremental'
+        return None
+
+    def _esperar_ventas(self, copiadas=None, totales=None):
+        """Espera (acotada) a que no haya ventas en curso; también es el progreso de la copia de páginas."""
+        if not models.hay_venta_en_curso():
+            return
+        inicio = time.perf_counter()
+        limite = inicio + ESPERA_MAXIMA_VENTA_S
+        while models.hay_venta_en_curso() and time.perf_counter() < limite and not self._detener.is_set():
+            time.sleep(0.005)
+        self._diferido_actual += time.perf_counter() - inicio
+
+    def _ejecutar(self, tipo):
+        self._diferido_actual = 0.0
+        fecha = datetime.now().isoformat(timespec='seconds')
+        inicio = time.perf_counter()
+        venta_maxima = self._maximo_venta_id()
+        self._esperar_ventas()
+        ritmo = {'progreso': self._esperar_ventas, 'paginas_por_paso': self.paginas_por_paso, 'pausa_s': self.pausa_s}
+        try:
+            if tipo == 'db':
+                entrada = backup_manager.crear_backup('db', origen='programado', **ritmo)
+            else:
+                entrada = backup_manager.crear_backup_incremental(origen='programado', **ritmo)
+        except Exception as e: # El hilo programador nunca debe morir por un backup fallido
+            print(f"Error en el backup programado ({tipo}): {e}")
+            entrada = None
+        duracion = time.perf_counter() - inicio
+
+        if entrada is None:
+            resultado = 'error'
+        elif entrada.get('sin_cambios'):
+            resultado = 'sin_cambios'
+        else:
+            resultado = 'ok'
+        ejecucion = {
+            'tipo': entrada.get('tipo', tipo) if resultado == 'ok' else tipo, 'fecha': fecha, 'resultado': resultado,
+            'archivo': entrada.get('archivo') if entrada else None,
+            'bytes_archivo': entrada.get('bytes_archivo', 0) if resultado == 'ok' else 0,
+            'duracion_s': round(duracion, 3), 'diferido_s': round(self._diferido_actual, 3),
+        }
+        with self._lock:
+            self.ejecuciones += 1
+            self.fallos += resultado == 'error'
+            self.sin_cambios += resultado == 'sin_cambios'
+            self.duracion_total += duracion
+            self.duracion_maxima = max(self.duracion_maxima, duracion)
+            self.diferido_total += self._diferido_actual
+            self.bytes_escritos += ejecucion['bytes_archivo']
+            self.historial.append(ejecucion)
+        if resultado == 'error':
+            self._fallos_seguidos += 1
+            self._reintentar_desde = time.monotonic() + self._espera_tras_fallo()
+        else:
+            self._fallos_seguidos = 0
+            self._reintentar_desde = 0.0
+            self._ultima_venta_respaldada = venta_maxima
+            self._ultimo_incremental = time.monotonic()
+        if resultado == 'ok':
+            try:
+                verificador_backups.verificar_pendientes()
+            except Exception as e:
+                print(f"Error al encolar la verificación de backups: {e}")
+        return ejecucion
+
+    def _bucle(self):
+        try:
+            archivados = backup_manager.archivar_backups_existentes() # Volcados sin comprimir de versiones anteriores
+            if archivados:
+                print(f"Backups sin comprimir archivados en el índice: {archivados}")
+        except Exception as e:
+            print(f"Error al archivar los backups existentes: {e}")
+        while not self._detener.is_set():
+            self._despertar.wait(INTERVALO_REVISION_S)
+            self._despertar.clear()
+            if self._detener.is_set():
+                break
+            try:
+                tipo = self._tarea_pendiente()
+                if tipo:
+                    self._ejecutar(tipo)
+            except Exception as e:
+                print(f"Error en el programador de backups: {e}")
+            self._detener.wait(SEPARACION_MINIMA_S)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'activo': self.activo,
+                'ejecuciones': self.ejecuciones,
+                'fallos': self.fallos,
+                'fallos_seguidos': self._fallos_seguidos,
+                'proximo_reintento_s': round(max(0.0, self._reintentar_desde - time.monotonic()), 1),
+                'sin_cambios': self.sin_cambios,
+                'duracion_promedio_s': round(self.duracion_total / self.ejecuciones, 3) if self.ejecuciones else 0,
+                'duracion_maxima_s': round(self.duracion_maxima, 3),
+                'diferido_total_s': round(self.diferido_total, 3),
+                'bytes_escritos': self.bytes_escritos,
+                'limite_mb_por_s': round(self.paginas_por_paso * TAMANO_PAGINA_ESTIMADO / self.pausa_s / 1e6, 2) if self.pausa_s else None,
+                'ultima': self.historial[-1] if self.historial else None,
+                'historial': list(self.historial),
+            }
+
+
+_programador = None
+_programador_lock = threading.Lock()
+
+def iniciar_programador(**ajustes):
+    """Inicia el programador de backups del proceso (ajustes: argumentos de ProgramadorBackups)."""
+    global _programador
+    with _programador_lock:
+        if _programador is None:
+            _programador = ProgramadorBackups(**ajustes)
+        _programador.iniciar()
+        return _programador
+
+def detener_programador():
+    global _programador
+    with _programador_lock:
+        if _programador is not None:
+            _programador.detener()
+            _programador = None
+
+def obtener_estadisticas_programador():
+    programador = _programador
+    return programador.estadisticas() if programador is not None else {'activo': False}
@@ -1,6 +1,7 @@
 import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -8,6 +9,7 @@ from reportlab.lib import colors
 from reportlab.lib.units import inch
 from datetime import datetime, timedelta #timedelta añadido
 import os # Para manejar rutas de archivos
+import time
 
 # --- Estilos y Helpers ---
 BASE_REPORTS_DIR = "generated_reports" # Carpeta para guardar reportes
@@ -253,66 +255,62 @@ if __name__ == '__main__':
     print("Pruebas de generación de reportes completadas.")
 
 # --- Generador de Excel para Productos ---
-def generar_excel_productos(lista_productos):
+# (cabecera, columna del producto, formato de número)
+COLUMNAS_EXCEL_PRODUCTOS = [
+    ("ID", 'id', None), ("Código Barras", 'codigo_barras', None), ("Nombre Producto", 'nombre_producto', None),
+    ("Descripción", 'descripcion', None), ("Categoría ID", 'categoria_id', None), ("Categoría", 'nombre_categoria', None),
+    ("Proveedor ID", 'proveedor_id', None), ("Proveedor", 'nombre_proveedor', None),
+    ("Precio Compra ($)", 'precio_compra', '"$"#,##0.00'), ("Precio Venta ($)", 'precio_venta_menudeo', '"$"#,##0.00'),
+    ("Precio Mayoreo ($)", 'precio_venta_mayoreo', '"$"#,##0.00'), ("Cant. Mayoreo", 'cantidad_para_mayoreo', None),
+    ("Stock Actual", 'stock_actual', None), ("Stock Mínimo", 'stock_minimo', None), ("Unidad Medida", 'unidad_medida', None),
+    ("Activo", 'activo', None), ("Fecha Creación", 'fecha_creacion', None), ("Última Modificación", 'fecha_ultima_modificacion', None),
+]
+ANCHOS_EXCEL_PRODUCTOS = {'C': 35, 'D': 30} # El resto de columnas: 15
+
+def generar_excel_productos(productos):
+    """
+    Escribe el listado de productos en un libro write_only de openpyxl: las filas se vuelcan al
+    archivo a medida que llegan, así que la memoria no crece con el catálogo si `productos` es un
+    generador (models.iterar_productos). Acepta dicts o filas sqlite3.Row.
+    Los estilos son objetos compartidos: solo las cabeceras y los precios llevan formato.
+    """
     filename = _get_report_filename("ListadoProductos", "xlsx")
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Productos"
-
-    # Título
-    ws.merge_cells('A1:M1') # Ajustar el número de columnas según los headers
-    ws['A1'] = "Listado Completo de Productos"
-    ws['A1'].font = Font(size=16, bold=True)
-    ws['A1'].alignment = alignment_center
-
-    # Cabeceras
-    headers = [
-        "ID", "Código Barras", "Nombre Producto", "Descripción",
-        "Categoría ID", "Categoría", "Proveedor ID", "Proveedor",
-        "Precio Compra ($)", "Precio Venta ($)", "Precio Mayoreo ($)", "Cant. Mayoreo",
-        "Stock Actual", "Stock Mínimo", "Unidad Medida", "Activo",
-        "Fecha Creación", "Última Modificación"
-    ]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=3, column=col_num, value=header)
-        cell.font = font_bold; cell.fill = header_fill; cell.alignment = alignment_center; cell.border = thin_border
-
-    # Datos de productos
-    row_idx = 4
-    for prod in lista_productos: # Asumimos que lista_productos es una lista de dicts como los de models.listar_productos
-        ws.cell(row=row_idx, column=1, value=prod.get('id')).border = thin_border
-        ws.cell(row=row_idx, column=2, value=prod.get('codigo_barras')).border = thin_border
-        ws.cell(row=row_idx, column=3, value=prod.get('nombre_producto')).border = thin_border
-        ws.cell(row=row_idx, column=4, value=prod.get('descripcion')).border = thin_border
-        ws.cell(row=row_idx, column=5, value=prod.get('categoria_id')).border = thin_border
-        ws.cell(row=row_idx, column=6, value=prod.get('nombre_categoria')).border = thin_border # Asumiendo que listar_productos hace JOIN
-        ws.cell(row=row_idx, column=7, value=prod.get('proveedor_id')).border = thin_border
-        ws.cell(row=row_idx, column=8, value=prod.get('nombre_proveedor')).border = thin_border # Asumiendo que listar_productos hace JOIN
-
-        pc = ws.cell(row=row_idx, column=9, value=prod.get('precio_compra', 0))
-        pc.number_format = '"$"#,##0.00'; pc.border = thin_border
-        pv = ws.cell(row=row_idx, column=10, value=prod.get('precio_venta_menudeo', 0))
-        pv.number_format = '"$"#,##0.00'; pv.border = thin_border
-        pm = ws.cell(row=row_idx, column=11, value=prod.get('precio_venta_mayoreo')) # Puede ser None
-        if pm.value is not None: pm.number_format = '"$"#,##0.00'
-        pm.border = thin_border
-
-        ws.cell(row=row_idx, column=12, value=prod.get('cantidad_para_mayoreo')).border = thin_border
-        ws.cell(row=row_idx, column=13, value=prod.get('stock_actual', 0)).border = thin_border
-        ws.cell(row=row_idx, column=14, value=prod.get('stock_minimo', 0)).border = thin_border
-        ws.cell(row=row_idx, column=15, value=prod.get('unidad_medida')).border = thin_border
-        ws.cell(row=row_idx, column=16, value="Sí" if prod.get('activo', True) else "No").border = thin_border
-        ws.cell(row=row_idx, column=17, value=prod.get('fecha_creacion')).border = thin_border
-        ws.cell(row=row_idx, column=18, value=prod.get('fecha_ultima_modificacion')).border = thin_border
-        row_idx += 1
-
-    # Ajustar ancho de columnas (ejemplo)
-    ws.column_dimensions['C'].width = 35 # Nombre Producto
-    ws.column_dimensions['D'].width = 30 # Descripcion
-    for i in range(1, len(headers) + 1):
-        if ws.column_dimensions[get_column_letter(i)].width < 15 : # Ancho mínimo para otras
-             if get_column_letter(i) not in ['C','D']:
-                 ws.column_dimensions[get_column_letter(i)].width = 15
+    inicio = time.perf_counter()
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Productos")
+    for i in range(1, len(COLUMNAS_EXCEL_PRODUCTOS) + 1):
+        letra = get_column_letter(i)
+        ws.column_dimensions[letra].width = ANCHOS_EXCEL_PRODUCTOS.get(letra, 15)
+
+    # Título y cabeceras (en write_only no se pueden combinar celdas)
+    titulo = WriteOnlyCell(ws, value="Listado Completo de Productos")
+    titulo.font = Font(size=16, bold=True)
+    ws.append([titulo])
+    ws.append([])
+    cabeceras = []
+    for cabecera, _, _ in COLUMNAS_EXCEL_PRODUCTOS:
+        celda = WriteOnlyCell(ws, value=cabecera)
+        celda.font = font_bold; celda.fill = header_fill; celda.alignment = alignment_center; celda.border = thin_border
+        cabeceras.append(celda)
+    ws.append(cabeceras)
+
+    # Datos: una celda con estilo solo donde hay formato de número; el resto, valores simples
+    formatos = [formato for _, _, formato in COLUMNAS_EXCEL_PRODUCTOS]
+    claves = [clave for _, clave, _ in COLUMNAS_EXCEL_PRODUCTOS]
+    indice_activo = claves.index('activo')
+    filas = 0
+    for prod in productos:
+        valores = [prod[clave] for clave in claves]
+        valores[indice_activo] = "Sí" if valores[indice_activo] else "No"
+        for i, formato in enumerate(formatos):
+            if formato and valores[i] is not None:
+                celda = WriteOnlyCell(ws, value=valores[i])
+                celda.number_format = formato
+                valores[i] = celda
+        ws.append(valores)
+        filas += 1
 
     wb.save(filename)
+    duracion = time.perf_counter() - inicio
+    print(f"Exportación de productos: {filas} filas en {duracion:.2f} s ({filas / duracion if duracion else 0:.0f} filas/s) -> {filename}")
     return filename
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database_setup
+import models
+
+
+@pytest.fixture
+def base_temporal(tmp_path, monkeypatch):
+    """Base de datos nueva en un directorio temporal (las rutas de la aplicación son relativas al directorio actual)."""
+    monkeypatch.chdir(tmp_path)
+    models.cerrar_conexiones()
+    database_setup.crear_tablas()
+    models.inicializar_datos_base()
+    models.invalidar_cache_permisos()
+    models.invalidar_indice_productos()
+    models._estado_fts_productos.clear()
+    yield tmp_path
+    models.cerrar_conexiones()
+    models.invalidar_cache_permisos()
+    models.invalidar_indice_productos()
+    models._estado_fts_productos.clear()
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+
+import pytest
+
+import backup_manager
+import controllers
+import db_utils
+import models
+
+
+def test_archivar_volcados_sin_comprimir_no_pisa_backups_del_mismo_segundo(base_temporal):
+    ruta_sql = db_utils.export_database_to_sql() # Formato anterior: .sql sin comprimir en backup/
+    nombre = os.path.basename(ruta_sql)
+    with open(os.path.join(db_utils.BACKUP_DIR, nombre + '.gz'), 'wb') as f:
+        f.write(b'backup existente')
+
+    assert backup_manager.archivar_backups_existentes() == 1
+
+    entrada, = backup_manager.listar_backups()
+    assert entrada['origen'] == 'archivado' and entrada['tipo'] == 'sql'
+    assert entrada['archivo'] != nombre + '.gz'
+    assert not os.path.exists(ruta_sql)
+    with open(os.path.join(db_utils.BACKUP_DIR, nombre + '.gz'), 'rb') as f:
+        assert f.read() == b'backup existente'
+    with backup_manager.abrir_backup(os.path.join(db_utils.BACKUP_DIR, entrada['archivo'])) as f:
+        assert b'CREATE TABLE' in f.read()
+
+
+def _vender(usuario_id, producto_id, cantidad):
+    carrito = []
+    controllers.agregar_al_carrito(carrito, models.obtener_producto_indexado_por_id(producto_id), cantidad)
+    resultado = controllers.procesar_nueva_venta_usuario(usuario_id, carrito, sum(item['subtotal'] for item in carrito))
+    assert resultado.get('success'), resultado
+    return resultado['venta_id']
+
+
+def _manifiesto(ruta):
+    conn = sqlite3.connect(ruta)
+    try:
+        return backup_manager.calcular_manifiesto(conn), conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _cadena_con_dos_incrementales(usuario_id):
+    azucar = models.crear_producto('Azúcar 1 kg', 28.0, codigo_barras='AZ-1', stock_actual=20)
+    sal = models.crear_producto('Sal 1 kg', 15.0, codigo_barras='SA-1', stock_actual=20)
+    temporal = models.crear_producto('Producto de prueba', 5.0, codigo_barras='TMP-1')
+    base = backup_manager.crear_backup('db')
+
+    venta_id = _vender(usuario_id, azucar, 3)
+    _vender(usuario_id, sal, 2)
+    primero = backup_manager.crear_backup_incremental()
+
+    assert models.cancelar_venta(venta_id, usuario_id=usuario_id, motivo='Devolución').get('success')
+    assert models.actualizar_producto(sal, precio_venta_menudeo=16.5)
+    assert models.eliminar_producto(temporal, suave=False)
+    segundo = backup_manager.crear_backup_incremental()
+    return base, primero, segundo
+
+
+def test_restaurar_cadena_incremental_reproduce_la_base(base_temporal):
+    usuario_id = models.obtener_usuario_por_nombre('usuario')['id']
+    base, primero, segundo = _cadena_con_dos_incrementales(usuario_id)
+    assert (primero['tipo'], segundo['tipo']) == ('incremental', 'incremental')
+    assert segundo['desde'] == primero['marca'] and primero['desde'] == base['marca']
+
+    destino = str(base_temporal / 'restaurada.db')
+    resultado = backup_manager.restaurar_backup(destino)
+
+    assert resultado['incrementales'] == [primero['archivo'], segundo['archivo']]
+    manifiesto_restaurado, integridad = _manifiesto(destino)
+    assert integridad == 'ok'
+    assert manifiesto_restaurado == _manifiesto(db_utils.DATABASE_NAME)[0]
+
+
+def test_restaurar_con_incremental_faltante_falla(base_temporal):
+    usuario_id = models.obtener_usuario_por_nombre('usuario')['id']
+    _, primero, segundo = _cadena_con_dos_incrementales(usuario_id)
+    with backup_manager._indice_lock:
+        indice = backup_manager._leer_indice()
+        indice['backups'] = [e for e in indice['backups'] if e['archivo'] != primero['archivo']]
+        backup_manager._guardar_indice(indice)
+
+    destino = base_temporal / 'restaurada.db'
+    with pytest.raises(ValueError, match='Cadena de backups incompleta'):
+        backup_manager.restaurar_backup(str(destino), segundo['archivo'])
+    assert not destino.exists()
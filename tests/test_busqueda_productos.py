@@ -0,0 +1,28 @@
+import sqlite3
+
+import models
+
+
+def test_indice_fts_se_crea_si_la_migracion_no_pudo(base_temporal):
+    models.crear_producto('Mantequilla', 45.0, codigo_barras='MT-1')
+    models.crear_producto('Mermelada de fresa', 38.0, codigo_barras='MF-1')
+    conn = sqlite3.connect(models.DATABASE_NAME)
+    with conn: # Base migrada con un SQLite sin FTS5/trigram: versión 3 aplicada pero sin índice
+        conn.execute("DROP TABLE ProductosFTS")
+        for trigger in ('insert', 'delete', 'update'):
+            conn.execute(f"DROP TRIGGER trg_productos_fts_{trigger}")
+    conn.close()
+    models.cerrar_conexiones()
+    models._estado_fts_productos.clear()
+
+    encontrados = models.buscar_productos_texto('mela')
+
+    assert [p['nombre_producto'] for p in encontrados] == ['Mermelada de fresa']
+    assert models._fts_productos_disponible()
+    conn = sqlite3.connect(models.DATABASE_NAME)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM ProductosFTS").fetchone()[0] == 2
+        triggers = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_productos_fts_%'").fetchone()[0]
+        assert triggers == 3
+    finally:
+        conn.close()
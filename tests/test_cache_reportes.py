@@ -0,0 +1,66 @@
+import sqlite3
+
+import controllers
+import database_setup
+import models
+import report_generator
+
+
+def test_exportar_reporte_cuenta_un_acierto_por_peticion(base_temporal, monkeypatch):
+    def generar_excel(datos, fecha_inicio, fecha_fin):
+        ruta = base_temporal / f"ventas_{fecha_inicio}_{fecha_fin}.xlsx"
+        ruta.write_bytes(b'reporte')
+        return str(ruta)
+
+    monkeypatch.setattr(report_generator, 'generar_excel_ventas_periodo', generar_excel)
+    controllers.invalidar_cache_reportes()
+    usuario_id = models.obtener_usuario_por_nombre('usuario')['id']
+    antes = controllers.obtener_estadisticas_cache_reportes()
+
+    primera = controllers.exportar_reporte_ctrl(usuario_id, 'ventas_periodo', 'excel', '2020-01-01', '2020-01-31')
+    segunda = controllers.exportar_reporte_ctrl(usuario_id, 'ventas_periodo', 'excel', '2020-01-01', '2020-01-31')
+
+    assert primera['desde_cache'] is False and segunda['desde_cache'] is True
+    assert segunda['filepath'] == primera['filepath']
+    despues = controllers.obtener_estadisticas_cache_reportes()
+    assert despues['fallos'] - antes['fallos'] == 1
+    assert despues['aciertos'] - antes['aciertos'] == 1
+    assert despues['archivos_reutilizados'] - antes['archivos_reutilizados'] == 1
+
+
+def _venta_en_periodo_cerrado(usuario_id, producto_id):
+    producto = models.obtener_producto_indexado_por_id(producto_id)
+    carrito = []
+    controllers.agregar_al_carrito(carrito, producto)
+    resultado = controllers.procesar_nueva_venta_usuario(usuario_id, carrito, carrito[0]['subtotal'])
+    assert resultado.get('success'), resultado
+    conn = sqlite3.connect(models.DATABASE_NAME)
+    with conn:
+        conn.execute("UPDATE Ventas SET fecha_venta = '2020-01-15 10:00:00' WHERE id = ?", (resultado['venta_id'],))
+        database_setup._reconstruir_resumenes_ventas(conn.cursor())
+    conn.close()
+    return resultado['venta_id']
+
+
+def test_periodo_cerrado_detecta_cancelacion_de_otra_terminal(base_temporal, monkeypatch):
+    usuario_id = models.obtener_usuario_por_nombre('usuario')['id']
+    producto_id = models.crear_producto('Café', 80.0, stock_actual=10)
+    venta_id = _venta_en_periodo_cerrado(usuario_id, producto_id)
+    _venta_en_periodo_cerrado(usuario_id, producto_id)
+    controllers.invalidar_cache_reportes()
+
+    primera = controllers.obtener_reporte_ctrl(usuario_id, 'ventas_periodo', '2020-01-01', '2020-01-31')
+    assert primera['desde_cache'] is False
+    assert primera['datos']['resumen']['numero_transacciones'] == 2
+    primera['datos']['resumen']['numero_transacciones'] = 999 # El llamador modifica su copia
+
+    segunda = controllers.obtener_reporte_ctrl(usuario_id, 'ventas_periodo', '2020-01-01', '2020-01-31')
+    assert segunda['desde_cache'] is True
+    assert segunda['datos']['resumen']['numero_transacciones'] == 2
+
+    monkeypatch.setattr(models, '_oyentes_cambios_ventas', []) # Otra terminal: este proceso no recibe aviso
+    assert models.cancelar_venta(venta_id, usuario_id=usuario_id, motivo='Devolución').get('success')
+
+    tercera = controllers.obtener_reporte_ctrl(usuario_id, 'ventas_periodo', '2020-01-01', '2020-01-31')
+    assert tercera['desde_cache'] is False
+    assert tercera['datos']['resumen']['numero_transacciones'] == 1
@@ -0,0 +1,35 @@
+import controllers
+import models
+
+
+def test_escanear_varias_veces_cruza_a_mayoreo_y_cobra(base_temporal):
+    usuario = models.obtener_usuario_por_nombre('usuario')
+    producto_id = models.crear_producto('Refresco 600 ml', 20.0, codigo_barras='7501000000001',
+                                        precio_venta_mayoreo=17.5, cantidad_para_mayoreo=6, stock_actual=50)
+    producto = models.obtener_producto_indexado_por_id(producto_id)
+
+    carrito = []
+    for _ in range(8): # Un escaneo por unidad
+        controllers.agregar_al_carrito(carrito, producto)
+
+    assert len(carrito) == 1
+    assert carrito[0]['cantidad'] == 8
+    assert carrito[0]['precio_unitario_actual'] == 17.5
+    total = sum(item['subtotal'] for item in carrito)
+    resultado = controllers.procesar_nueva_venta_usuario(usuario['id'], carrito, total, tipo_pago='tarjeta_debito')
+    assert resultado.get('success'), resultado
+    assert models.obtener_producto_por_id(producto_id)['stock_actual'] == 42
+
+
+def test_quitar_unidades_vuelve_a_menudeo(base_temporal):
+    producto_id = models.crear_producto('Galletas', 12.0, precio_venta_mayoreo=10.0, cantidad_para_mayoreo=3, stock_actual=10)
+    producto = models.obtener_producto_indexado_por_id(producto_id)
+
+    carrito = []
+    controllers.agregar_al_carrito(carrito, producto, 3)
+    assert carrito[0]['precio_unitario_actual'] == 10.0
+    controllers.agregar_al_carrito(carrito, producto, -1)
+    assert carrito[0]['precio_unitario_actual'] == 12.0
+    assert carrito[0]['subtotal'] == 24.0
+    assert controllers.agregar_al_carrito(carrito, producto, -2) is None
+    assert carrito == []
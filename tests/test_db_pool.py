@@ -0,0 +1,18 @@
+import db_pool
+
+
+def test_primer_perfil_no_cierra_el_pool_que_crea_la_conexion(tmp_path, monkeypatch):
+    ruta = str(tmp_path / 'pool.db')
+    monkeypatch.setattr(db_pool, '_perfil_activo', {})
+    try:
+        conn = db_pool.obtener_conexion(ruta)
+        conn.close()
+        conn = db_pool.obtener_conexion(ruta)
+        conn.close()
+
+        pool = db_pool._pools[ruta]
+        estadisticas = pool.estadisticas()
+        assert estadisticas['conexiones_creadas'] == 1
+        assert estadisticas['reutilizaciones'] == 1
+    finally:
+        db_pool.cerrar_pools(ruta)
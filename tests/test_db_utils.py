@@ -0,0 +1,58 @@
+import os
+import sqlite3
+
+import backup_manager
+import db_utils
+import models
+
+
+def _estado_base():
+    conn = sqlite3.connect(db_utils.DATABASE_NAME)
+    try:
+        return {
+            'user_version': conn.execute("PRAGMA user_version").fetchone()[0],
+            'triggers': conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0],
+            'productos': conn.execute("SELECT COUNT(*) FROM Productos").fetchone()[0],
+            'productos_fts': conn.execute("SELECT COUNT(*) FROM ProductosFTS").fetchone()[0],
+            'manifiesto': backup_manager.calcular_manifiesto(conn),
+        }
+    finally:
+        conn.close()
+
+
+def _volcado_con_productos():
+    models.crear_producto('Harina 1 kg', 22.0, codigo_barras='HA-1')
+    models.crear_producto('Avena 500 g', 18.0, codigo_barras='AV-1')
+    entrada = backup_manager.crear_backup('sql')
+    return os.path.join(db_utils.BACKUP_DIR, entrada['archivo'])
+
+
+def test_importar_volcado_sql_comprimido_restaura_esquema_e_indice(base_temporal):
+    ruta = _volcado_con_productos()
+    antes = _estado_base()
+    models.crear_producto('Posterior al volcado', 9.0)
+
+    resultado = db_utils.import_database_from_sql(ruta)
+
+    assert resultado is not None and resultado['filas'] > 0
+    despues = _estado_base()
+    assert despues['user_version'] == antes['user_version']
+    assert despues['triggers'] == antes['triggers']
+    assert despues['productos'] == antes['productos'] == 2
+    assert despues['productos_fts'] == despues['productos']
+    assert not os.path.exists(db_utils.DATABASE_NAME + '.restaurando')
+
+
+def test_volcado_truncado_no_modifica_la_base(base_temporal):
+    ruta = _volcado_con_productos()
+    truncado = str(base_temporal / 'truncado.sql.gz')
+    with open(ruta, 'rb') as origen, open(truncado, 'wb') as destino:
+        datos = origen.read()
+        destino.write(datos[:len(datos) // 2])
+    models.crear_producto('Posterior al volcado', 9.0)
+    antes = _estado_base()
+
+    assert db_utils.import_database_from_sql(truncado) is None
+
+    assert _estado_base() == antes
+    assert not os.path.exists(db_utils.DATABASE_NAME + '.restaurando')
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import escritor_ventas
+import models
+
+
+def test_venta_que_agota_la_espera_no_se_escribe_ni_se_duplica(monkeypatch):
+    liberar = threading.Event()
+    escritas = []
+
+    def registrar_lote_lento(ventas):
+        liberar.wait(5) # Simula un commit bloqueado (disco lento, bloqueo de otra terminal)
+        escritas.extend(venta['notas'] for venta in ventas)
+        return [{"success": True, "venta_id": i} for i, _ in enumerate(ventas, 1)]
+
+    monkeypatch.setattr(models, 'registrar_lote_ventas', registrar_lote_lento)
+    escritor = escritor_ventas.EscritorVentas(tamano_maximo_lote=1)
+    escritor.iniciar()
+    try:
+        resultados = {}
+        hilo = threading.Thread(target=lambda: resultados.update(a=escritor.registrar(timeout=0.3, notas='A')))
+        hilo.start()
+        while escritor._cola.qsize(): # Esperar a que A entre en el lote que se está escribiendo
+            time.sleep(0.001)
+        resultados['b'] = escritor.registrar(timeout=0.2, notas='B') # B sigue en cola al agotar la espera
+        hilo.join()
+
+        assert resultados['a']['pendiente'] is True # Ya se estaba escribiendo: no se informa como fallida
+        assert 'no se registró' in resultados['b']['error']
+        liberar.set()
+        assert resultados['a']['futuro'].result(timeout=5)['success']
+    finally:
+        liberar.set()
+        escritor.detener()
+
+    assert escritas == ['A'] # B se canceló y el escritor la descartó
+    assert escritor.estadisticas()['ventas_canceladas'] == 1
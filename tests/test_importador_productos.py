@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+import importador_productos
+import models
+
+
+def test_cambio_rechazado_no_queda_en_la_copia_en_memoria(base_temporal):
+    producto_id = models.crear_producto('Arroz 1 kg', 30.0, codigo_barras='A-100', stock_actual=5)
+
+    def filas():
+        # Otra terminal da de alta 'B-200' después de que el importador cargó su copia de Productos
+        models.crear_producto('Frijol 1 kg', 40.0, codigo_barras='B-200')
+        yield 2, {'ID': producto_id, 'Nombre Producto': 'Arroz 1 kg', 'Código Barras': 'B-200', 'Precio Venta': 32.0}
+        # Sigue siendo 'A-100' en la base: debe reconocerse como el mismo producto, no como un alta
+        yield 3, {'Nombre Producto': 'Arroz 1 kg', 'Código Barras': 'A-100', 'Precio Venta': 31.0}
+
+    resumen = importador_productos.ImportadorProductos(tamano_lote=10).procesar(filas())
+
+    fila_2, fila_3 = resumen['detalles']
+    assert fila_2['status'] == 'error'
+    assert fila_3['status'] == 'actualizado' and fila_3['id'] == producto_id
+    assert fila_3['cambios'] == {'precio_venta_menudeo': (30.0, 31.0)} # Comparado con la base, no con la fila rechazada
+    producto = models.obtener_producto_por_id(producto_id)
+    assert (producto['codigo_barras'], producto['precio_venta_menudeo']) == ('A-100', 31.0)
+
+
+def test_mismo_producto_dos_veces_en_un_lote(base_temporal):
+    producto_id = models.crear_producto('Aceite', 50.0, codigo_barras='C-300')
+    filas = [
+        (2, {'Nombre Producto': 'Aceite', 'Código Barras': 'C-300', 'Precio Venta': 55.0}),
+        (3, {'Nombre Producto': 'Aceite', 'Código Barras': 'C-300', 'Precio Venta': 50.0}), # Vuelve al precio original
+    ]
+
+    resumen = importador_productos.ImportadorProductos(tamano_lote=10).procesar(filas)
+
+    assert [d['status'] for d in resumen['detalles']] == ['actualizado', 'actualizado']
+    assert models.obtener_producto_por_id(producto_id)['precio_venta_menudeo'] == 50.0
+
+
+class _ConexionConCommitFallido:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def commit(self):
+        raise sqlite3.OperationalError("disk I/O error")
+
+
+def test_commit_fallido_fila_a_fila_no_toca_la_copia_en_memoria(base_temporal):
+    producto_id = models.crear_producto('Aceite', 50.0, codigo_barras='C-300')
+    importador = importador_productos.ImportadorProductos(tamano_lote=10)
+    conn = models.get_db_connection()
+    try:
+        importador.cargar_mapas(conn.cursor())
+        _, valores = importador.preparar_fila({'Nombre Producto': 'Aceite', 'Código Barras': 'C-300', 'Precio Venta': 55.0})
+        diferencias = importador.diferencias(producto_id, valores)
+        cambio = (2, 'Aceite', {c: nuevo for c, (_, nuevo) in diferencias.items()}, producto_id, diferencias)
+
+        with pytest.raises(sqlite3.OperationalError):
+            importador._confirmar_fila_a_fila(_ConexionConCommitFallido(conn), [], [cambio])
+        conn.rollback()
+    finally:
+        conn.close()
+
+    assert importador.actuales[producto_id]['precio_venta_menudeo'] == 50.0
+    assert importador.actualizados == 0 and importador.detalles == []
+    assert models.obtener_producto_por_id(producto_id)['precio_venta_menudeo'] == 50.0
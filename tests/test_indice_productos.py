@@ -0,0 +1,29 @@
+import models
+
+
+def _fijar_modificacion(producto_id, fecha, **columnas):
+    conn = models.get_db_connection()
+    try:
+        asignaciones = ''.join(f", {c} = ?" for c in columnas)
+        conn.execute(f"UPDATE Productos SET fecha_ultima_modificacion = ?{asignaciones} WHERE id = ?",
+                     (fecha, *columnas.values(), producto_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_fallo_de_busqueda_no_adelanta_la_marca_de_refresco(base_temporal):
+    cambiado = models.crear_producto('Leche', 25.0, codigo_barras='L-1')
+    _fijar_modificacion(cambiado, '2020-01-01 00:00:00')
+    assert models.cargar_indice_productos() == 1
+
+    # Otra caja cambia un precio y, un segundo después, da de alta un producto nuevo
+    _fijar_modificacion(cambiado, '2020-01-01 00:00:01', precio_venta_menudeo=27.0)
+    nuevo = models.crear_producto('Pan', 10.0, codigo_barras='P-1')
+    _fijar_modificacion(nuevo, '2020-01-01 00:00:02')
+
+    assert models.obtener_producto_indexado_por_codigo('P-1')['id'] == nuevo # Fallo: se lee de la base
+    assert models.obtener_estadisticas_indice_productos()['ultima_modificacion_vista'] == '2020-01-01 00:00:00'
+
+    models.refrescar_indice_productos(forzar=True)
+    assert models.obtener_producto_indexado_por_id(cambiado)['precio_venta_menudeo'] == 27.0
@@ -0,0 +1,66 @@
+import pytest
+
+import models
+
+# Rangos con hora: no son días completos, así que los reportes consultan Ventas directamente
+# (con días completos leen los resúmenes diarios) y deben hacerlo por los índices idx_ventas_*.
+DESDE, HASTA = '2024-01-01 00:00:00', '2024-01-31 23:59:59'
+
+
+@pytest.fixture
+def sentencias(base_temporal, monkeypatch):
+    """SELECT ejecutados por models, con sus parámetros ya sustituidos."""
+    capturadas = []
+    obtener_original = models.get_db_connection
+
+    def obtener_con_traza():
+        conn = obtener_original()
+        conn.set_trace_callback(capturadas.append)
+        return conn
+
+    monkeypatch.setattr(models, 'get_db_connection', obtener_con_traza)
+    yield capturadas
+    models.cerrar_conexiones() # Las conexiones del pool conservarían la traza
+
+
+def _planes_sobre_ventas(sentencias):
+    conn = models.get_db_connection()
+    try:
+        planes = []
+        for sql in sentencias:
+            if 'Ventas v' in sql or 'FROM Ventas' in sql:
+                conn.set_trace_callback(None)
+                planes.append([fila[3] for fila in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+        return planes
+    finally:
+        conn.close()
+
+
+def _verificar_indices(planes):
+    assert planes, "No se ejecutó ninguna consulta sobre Ventas"
+    for plan in planes:
+        detalle = ' | '.join(plan)
+        assert 'USING INDEX idx_ventas_' in detalle or 'USING COVERING INDEX idx_ventas_' in detalle, detalle
+        assert not any(paso.startswith('SCAN v') or paso.startswith('SCAN Ventas') for paso in plan), detalle
+
+
+@pytest.mark.parametrize('reporte', [
+    lambda: models.obtener_resumen_ventas_periodo(DESDE, HASTA),
+    lambda: models.obtener_productos_mas_vendidos(DESDE, HASTA),
+    lambda: models.obtener_ventas_agrupadas_por_usuario(DESDE, HASTA),
+    lambda: models.listar_ventas_modelo(DESDE, HASTA),
+], ids=['resumen_periodo', 'productos_mas_vendidos', 'ventas_por_usuario', 'listar_ventas'])
+def test_reportes_usan_indices_de_ventas(sentencias, reporte):
+    reporte()
+    _verificar_indices(_planes_sobre_ventas(sentencias))
+
+
+@pytest.mark.parametrize('fecha', ['2024-01-01garbage', '2024-13-01', '01/02/2024', 20240101])
+def test_rango_fechas_rechaza_formatos_invalidos(fecha):
+    with pytest.raises(ValueError):
+        models.rango_fechas_semiabierto(fecha, None)
+
+
+def test_rango_fechas_acepta_fecha_y_fecha_hora():
+    assert models.rango_fechas_semiabierto('2024-01-01', '2024-01-31') == ('2024-01-01', '2024-02-01')
+    assert models.rango_fechas_semiabierto('2024-01-01 08:30:00', None) == ('2024-01-01', None)
@@ -0,0 +1,36 @@
+import sqlite3
+
+import models
+
+
+def _agregar_permiso_de_otra_terminal(nombre, usuario_id):
+    conn = sqlite3.connect(models.DATABASE_NAME)
+    with conn:
+        permiso_id = conn.execute("INSERT INTO Permisos (nombre_permiso) VALUES (?)", (nombre,)).lastrowid
+        conn.execute("INSERT INTO UsuariosPermisos (usuario_id, permiso_id, otorgado) VALUES (?, ?, 1)",
+                     (usuario_id, permiso_id))
+    conn.close()
+
+
+def test_permiso_nuevo_recarga_el_catalogo(base_temporal):
+    usuario_id = models.obtener_usuario_por_nombre('usuario')['id']
+    assert models.tiene_permiso(usuario_id, 'realizar_ventas')
+    assert 'auditar_caja' not in models.obtener_catalogo_permisos()
+
+    _agregar_permiso_de_otra_terminal('auditar_caja', usuario_id)
+    models.invalidar_cache_permisos(usuario_id) # Lo que haría el TTL de la máscara; el catálogo no se toca
+
+    assert models.tiene_permiso(usuario_id, 'auditar_caja')
+    assert 'auditar_caja' in models.obtener_catalogo_permisos()
+
+
+def test_catalogo_se_devuelve_sin_copiar_y_de_solo_lectura(base_temporal):
+    catalogo = models.obtener_catalogo_permisos()
+    assert models.obtener_catalogo_permisos() is catalogo
+    try:
+        catalogo['inventado'] = 99
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("El catálogo de permisos debe ser de solo lectura")
+    assert not models.tiene_permiso(models.obtener_usuario_por_nombre('usuario')['id'], 'inventado')
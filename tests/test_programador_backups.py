@@ -0,0 +1,25 @@
+import backup_manager
+import programador_backups
+
+
+def test_backup_fallido_espera_con_retroceso_antes_de_reintentar(base_temporal, monkeypatch):
+    intentos = []
+    monkeypatch.setattr(backup_manager, 'crear_backup', lambda *a, **k: intentos.append('db'))
+    monkeypatch.setattr(backup_manager, 'crear_backup_incremental', lambda *a, **k: intentos.append('incremental'))
+    programador = programador_backups.ProgramadorBackups(intervalo_incremental_min=5)
+    programador._ultima_venta_respaldada = 0
+
+    assert programador._tarea_pendiente() == 'db' # Nunca hubo una base completa
+    assert programador._ejecutar('db')['resultado'] == 'error'
+    assert programador._tarea_pendiente() is None # Sin reintento inmediato aunque sigan llegando ventas
+    espera = programador.estadisticas()['proximo_reintento_s']
+    assert 0 < espera <= programador_backups.INTERVALO_REVISION_S
+
+    esperas = []
+    for _ in range(6):
+        programador._reintentar_desde = 0.0 # Como si hubiera pasado la espera
+        programador._ejecutar('db')
+        esperas.append(programador._espera_tras_fallo())
+    assert esperas == sorted(esperas)
+    assert esperas[-1] == 5 * 60 # Tope: el intervalo incremental
+    assert len(intentos) == 7
@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import backup_manager
+import db_utils
+
+# Verificación de backups en un proceso aparte.
+# Que un archivo exista en backup/ no garantiza que se pueda restaurar. Cada backup nuevo se
+# verifica en un proceso hijo (nunca en el de la caja: comprobar varios GB ocupa CPU y disco durante
+# minutos y no debe retrasar ni la interfaz ni las ventas):
+# 1. sha256 del archivo contra el índice;
+# 2. se reconstruye la base en un archivo temporal de backup/: descomprimiendo la copia 'db',
+#    cargando el volcado 'sql' (db_utils.cargar_volcado_sql) o aplicando la cadena de un incremental
+#    (backup_manager.restaurar_backup);
+# 3. se abre en solo lectura y se ejecuta PRAGMA quick_check (integrity_check completo a pedido);
+# 4. se compara el manifiesto de cada tabla con el calculado en el momento del backup.
+# El resultado queda en la entrada del índice ('verificacion'); el temporal se borra siempre.
+
+PROCESOS_VERIFICACION = 1 # Un solo hijo: las verificaciones van en cola y no se reparten el disco
+PRIORIDAD_PROCESO = 10    # os.nice del hijo (donde exista): cede la CPU a la caja
+MAXIMO_ERRORES_INFORMADOS = 10
+TEMPORAL_HUERFANO_H = 6   # Temporales de hijos que murieron a mitad de una verificación
+
+
+def _inicializar_proceso(backup_dir, database_name):
+    # El hijo se crea con 'spawn' (importa los módulos de cero): hereda las rutas en uso, no los valores por defecto
+    db_utils.BACKUP_DIR = backup_dir
+    db_utils.DATABASE_NAME = database_name
+    limite = time.time() - TEMPORAL_HUERFANO_H * 3600
+    for nombre in os.listdir(backup_dir):
+        ruta = os.path.join(backup_dir, nombre)
+        if nombre.startswith('verificando_') and os.path.getmtime(ruta) < limite:
+            os.remove(ruta)
+    if hasattr(os, 'nice'):
+        try:
+            os.nice(PRIORIDAD_PROCESO)
+        except OSError:
+            pass
+
+def _reconstruir(entrada, destino):
+    """Reconstruye en `destino` la base contenida en el backup; retorna avisos de la reconstrucción."""
+    avisos = []
+    if entrada['tipo'] == 'db':
+        with backup_manager.abrir_backup(backup_manager._verificar_suma(entrada)) as origen, open(destino, 'wb') as salida:
+            for bloque in iter(lambda: origen.read(backup_manager.TAMANO_BLOQUE), b''):
+                salida.write(bloque)
+    elif entrada['tipo'] == 'sql':
+        db_utils.cargar_volcado_sql(backup_manager._verificar_suma(entrada), destino)
+    else:
+        resultado = backup_manager.restaurar_backup(destino, entrada['archivo']) # Verifica el sha256 de toda la cadena
+        aplicado = [e for e in backup_manager.listar_backups() if e['archivo'] in resultado['incrementales']]
+        esperadas = sum(e.get('filas', 0) for e in aplicado), sum(e.get('borradas', 0) for e in aplicado)
+        if (resultado['filas'], resultado['borradas']) != esperadas:
+            avisos.append(f"La cadena aplicó {resultado['filas']} filas y {resultado['borradas']} borrados; "
+                          f"el índice registra {esperadas[0]} y {esperadas[1]}")
+    return avisos
+
+def _comprobar(ruta, completo, manifiesto):
+    """Abre la base reconstruida en solo lectura; retorna la lista de errores encontrados."""
+    errores = []
+    conn = sqlite3.connect(f"file:{os.path.abspath(ruta)}?mode=ro", uri=True)
+    try:
+        pragma = "integrity_check" if completo else "quick_check"
+        resultado = [fila[0] for fila in conn.execute(f"PRAGMA {pragma}({MAXIMO_ERRORES_INFORMADOS})")]
+        if resultado != ['ok']:
+            errores.extend(f"{pragma}: {linea}" for linea in resultado)
+        if manifiesto is None:
+            return errores
+        actual = backup_manager.calcular_manifiesto(conn, list(manifiesto))
+        for tabla, esperado in manifiesto.items():
+            if tabla not in actual:
+                errores.append(f"Falta la tabla {tabla}")
+            elif actual[tabla][0] != esperado[0]:
+                errores.append(f"{tabla}: {actual[tabla][0]} filas, se esperaban {esperado[0]}")
+            elif actual[tabla] != esperado:
+                errores.append(f"{tabla}: las sumas de control no coinciden con las del backup")
+    finally:
+        conn.close()
+    return errores
+
+def verificar_backup(archivo, completo=False):
+    """
+    Verifica un backup del índice en este proceso (el verificador lo llama en el hijo).
+    completo: PRAGMA integrity_check en lugar de quick_check (revisa también índices; más lento).
+    Uso: python verificador_backups.py archivo [--completo]
+    Retorna el resultado {'fecha', 'modo', 'ok', 'errores', 'duracion_s'} o None si el backup
+    ya no está en el índice (p. ej. lo borró la retención).
+    """
+    entrada = next((e for e in backup_manager.listar_backups() if e['archivo'] == archivo), None)
+    if entrada is None:
+        return None
+    inicio = time.perf_counter()
+    temporal = os.path.join(db_utils.BACKUP_DIR, f"verificando_{os.getpid()}.db")
+    errores = []
+    reconstruida = False
+    try:
+        for sufijo in ('', '-journal', '-wal', '-shm', '.parcial'):
+            if os.path.exists(temporal + sufijo):
+                os.remove(temporal + sufijo)
+        errores.extend(_reconstruir(entrada, temporal))
+        reconstruida = True
+    except Exception as e: # Archivo dañado, truncado o ilegible: es justamente lo que se quiere detectar
+        errores.append(f"No se pudo reconstruir la base: {e}")
+    try:
+        if reconstruida:
+            errores.extend(_comprobar(temporal, completo, entrada.get('manifiesto')))
+    except sqlite3.Error as e:
+        errores.append(f"La base reconstruida está dañada: {e}")
+    finally:
+        for sufijo in ('', '-journal', '-wal', '-shm', '.parcial'):
+            if os.path.exists(temporal + sufijo):
+                os.remove(temporal + sufijo)
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'modo': 'completa' if completo else 'rapida',
+        'ok': not errores,
+        'errores': errores,
+        'duracion_s': round(time.perf_counter() - inicio, 3),
+    }
+
+
+_ejecutor = None
+_ejecutor_lock = threading.Lock()
+_en_cola = set() # Archivos con verificación pendiente, para no encolar dos veces el mismo
+
+def _obtener_ejecutor():
+    global _ejecutor
+    if _ejecutor is None:
+        _ejecutor = ProcessPoolExecutor(
+            max_workers=PROCESOS_VERIFICACION,
+            mp_context=multiprocessing.get_context('spawn'), # fork copiaría hilos y conexiones abiertas de la caja
+            initializer=_inicializar_proceso,
+            initargs=(os.path.abspath(db_utils.BACKUP_DIR), os.path.abspath(db_utils.DATABASE_NAME)),
+        )
+    return _ejecutor
+
+def _al_terminar(archivo, futuro):
+    global _ejecutor
+    with _ejecutor_lock:
+        _en_cola.discard(archivo)
+    if futuro.cancelled():
+        return
+    try:
+        resultado = futuro.result()
+    except Exception as e: # El hijo murió (memoria, señal) o no se pudo lanzar
+        if isinstance(e, BrokenProcessPool):
+            with _ejecutor_lock:
+                _ejecutor = None # Un ejecutor roto no acepta más tareas: la próxima solicitud lanza otro hijo
+        resultado = {'fecha': datetime.now().isoformat(timespec='seconds'), 'modo': None, 'ok': False,
+                     'errores': [f"El proceso de verificación falló: {e}"], 'duracion_s': None}
+    if resultado is None:
+        return
+    backup_manager.actualizar_entrada_backup(archivo, verificacion=resultado)
+    if resultado['ok']:
+        print(f"Backup verificado: {archivo} ({resultado['modo']}, {resultado['duracion_s']} s)")
+    else:
+        print(f"Advertencia: El backup {archivo} no pasó la verificación: {'; '.join(resultado['errores'])}")
+
+def solicitar_verificacion(archivo, completo=False):
+    """
+    Encola la verificación de un backup en el proceso verificador y retorna enseguida.
+    Retorna el Future (su resultado es el de verificar_backup) o None si ya estaba en cola.
+    """
+    with _ejecutor_lock:
+        if archivo in _en_cola:
+            return None
+        _en_cola.add(archivo)
+        try:
+            futuro = _obtener_ejecutor().submit(verificar_backup, archivo, completo)
+        except Exception:
+            _en_cola.discard(archivo)
+            raise
+    futuro.add_done_callback(lambda f: _al_terminar(archivo, f))
+    return futuro
+
+def verificar_pendientes(completo=False):
+    """Encola los backups del índice que aún no tienen verificación. Retorna cuántos se encolaron."""
+    encolados = 0
+    for entrada in reversed(backup_manager.listar_backups()): # Los más antiguos primero: bases antes que sus incrementales
+        if 'verificacion' not in entrada and solicitar_verificacion(entrada['archivo'], completo) is not None:
+            encolados += 1
+    return encolados
+
+def detener_verificador():
+    """Cancela las verificaciones en cola y cierra el proceso verificador sin esperar a la que está en curso."""
+    global _ejecutor
+    with _ejecutor_lock:
+        ejecutor, _ejecutor = _ejecutor, None
+        _en_cola.clear()
+    if ejecutor is not None:
+        ejecutor.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Uso: python verificador_backups.py archivo_del_indice [--completo]")
+        sys.exit(1)
+    resultado = verificar_backup(sys.argv[1], completo='--completo' in sys.argv[2:])
+    if resultado is None:
+        print(f"El backup {sys.argv[1]} no está en el índice.")
+        sys.exit(1)
+    backup_manager.actualizar_entrada_backup(sys.argv[1], verificacion=resultado)
+    print(resultado)
+    sys.exit(0 if resultado['ok'] else 2)